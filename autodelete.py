@@ -0,0 +1,90 @@
+import asyncio
+import logging
+import time
+
+from telegram.ext import Application, ContextTypes
+
+from database import AsyncDatabase
+
+logger = logging.getLogger(__name__)
+
+
+class DeletionScheduler:
+    """
+    Отложенное удаление служебных сообщений без ожидания в хендлерах
+
+    Хендлер отвечает и сразу возвращается, а сообщения удаляет периодическая
+    задача JobQueue: все созревшие удаления чата обрабатываются за один проход.
+    Очередь сохраняется в базе и восстанавливается после перезапуска.
+    """
+
+    def __init__(self, tick: float = 1.0):
+        self.tick = tick
+        # chat_id -> {message_id: due_at (unix time)}
+        self._pending = {}
+        self._tasks = set()
+
+    def attach(self, application: Application):
+        """Запустить периодическую обработку и восстановить очередь из базы"""
+        if application.job_queue is None:
+            logger.error("JobQueue is not available: install python-telegram-bot[job-queue]")
+            return
+
+        application.job_queue.run_once(self._restore, when=0, name='autodelete_restore')
+        application.job_queue.run_repeating(self._flush, interval=self.tick, first=self.tick, name='autodelete')
+
+    def schedule(self, chat_id: int, message_ids: list, delay: float):
+        """Удалить сообщения чата через delay секунд"""
+        due_at = time.time() + delay
+        messages = {message_id: due_at for message_id in message_ids if message_id}
+        if not messages:
+            return
+
+        self._pending.setdefault(chat_id, {}).update(messages)
+        self._spawn(AsyncDatabase.add_pending_deletions(chat_id, messages))
+
+    def pending_count(self) -> int:
+        return sum(len(messages) for messages in self._pending.values())
+
+    def _spawn(self, coroutine):
+        """Сохранение в базу — в фоне, чтобы не задерживать хендлер"""
+        task = asyncio.get_running_loop().create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _restore(self, context: ContextTypes.DEFAULT_TYPE):
+        restored = await AsyncDatabase.get_pending_deletions()
+        for chat_id, messages in restored.items():
+            self._pending.setdefault(chat_id, {}).update(messages)
+        if restored:
+            logger.info(f"Restored {self.pending_count()} pending message deletions")
+
+    async def _flush(self, context: ContextTypes.DEFAULT_TYPE):
+        now = time.time()
+        due_by_chat = {}
+        for chat_id, messages in self._pending.items():
+            due = [message_id for message_id, due_at in messages.items() if due_at <= now]
+            if due:
+                due_by_chat[chat_id] = due
+
+        if due_by_chat:
+            await asyncio.gather(*(
+                self._delete_chat_messages(context, chat_id, message_ids)
+                for chat_id, message_ids in due_by_chat.items()
+            ))
+
+    async def _delete_chat_messages(self, context: ContextTypes.DEFAULT_TYPE, chat_id: int, message_ids: list):
+        messages = self._pending.get(chat_id, {})
+        for message_id in message_ids:
+            messages.pop(message_id, None)
+        if not messages:
+            self._pending.pop(chat_id, None)
+
+        for message_id in message_ids:
+            try:
+                await context.bot.delete_message(chat_id=chat_id, message_id=message_id)
+            except Exception as e:
+                logger.debug(f"Failed to delete message {message_id} in chat {chat_id}: {e}")
+
+        # Только по ID: пока шли удаления, schedule() мог добавить в этот чат новые сообщения
+        await AsyncDatabase.remove_pending_deletions(chat_id, message_ids)
@@ -0,0 +1,102 @@
+"""
+Бенчмарк методов Database на поддельном Firestore с задержкой сети
+
+Для каждого метода: сколько документов читается и пишется за вызов
+и распределение задержки (p50/p95/p99) при заданной latency/jitter.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_database.py [latency_ms] [jitter_ms]
+"""
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_firestore import FakeFirestore
+from storage import set_backend
+from storage_firestore import FirestoreBackend
+
+import database
+from database import Database
+
+CHAT_ID = -1001234567890
+
+
+def percentile(values, p: float):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def seed_trip(participants: int, expenses: int, rng):
+    """Поездка с участниками, тратами и частью погашенных долгов"""
+    Database.create_trip(CHAT_ID, 'Бенчмарк', 'EUR', 1)
+    user_ids = list(range(1, participants + 1))
+    for user_id in user_ids:
+        Database.add_participant(CHAT_ID, user_id, f"user_{user_id}", f"Имя{user_id}")
+        Database.link_user_to_trip(user_id, CHAT_ID)
+
+    debt_ids = []
+    for _ in range(expenses):
+        payer_id = rng.choice(user_ids)
+        members = rng.sample(user_ids, min(len(user_ids), rng.randint(2, 6)))
+        if payer_id not in members:
+            members.append(payer_id)
+        result = Database.create_debt(CHAT_ID, rng.randint(100, 50000) / 100, payer_id, members, 'ужин')
+        debt_ids.extend(debt['id'] for debt in result['debts'])
+
+    for debt_id in rng.sample(debt_ids, len(debt_ids) // 3):
+        Database.mark_debt_paid(debt_id)
+    return user_ids, debt_ids
+
+
+def measure(client, name: str, func, runs: int):
+    timings = []
+    client.reset()
+    for _ in range(runs):
+        # Кэш поездки живёт TRIP_CACHE_TTL секунд — меряем «холодный» апдейт
+        database.trip_cache.invalidate(CHAT_ID)
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    stats = client.stats()
+    print(
+        f"{name:<28} reads/call {stats['reads'] / runs:7.1f}  writes/call {stats['writes'] / runs:5.1f}  "
+        f"p50 {statistics.median(timings) * 1000:7.2f} ms  "
+        f"p95 {percentile(timings, 0.95) * 1000:7.2f} ms  "
+        f"p99 {percentile(timings, 0.99) * 1000:7.2f} ms"
+    )
+
+
+def main():
+    latency = float(sys.argv[1]) / 1000 if len(sys.argv) > 1 else 0.02
+    jitter = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.01
+    rng = random.Random(42)
+
+    for participants, expenses in ((5, 30), (50, 200)):
+        client = FakeFirestore(seed=42)
+        set_backend(FirestoreBackend(client=client))
+        user_ids, debt_ids = seed_trip(participants, expenses, rng)
+        client.latency, client.jitter = latency, jitter
+
+        print(f"--- {participants} participants, {expenses} expenses "
+              f"(latency {latency * 1000:.0f} ms, jitter {jitter * 1000:.0f} ms) ---")
+        runs = 50
+        measure(client, 'get_trip', lambda: Database.get_trip(CHAT_ID), runs)
+        measure(client, 'add_participant (known)', lambda: Database.add_participant(CHAT_ID, 1, 'user_1', 'Имя1'), runs)
+        measure(client, 'link_user_to_trip', lambda: Database.link_user_to_trip(1, CHAT_ID), runs)
+        measure(client, 'get_user_active_trip', lambda: Database.get_user_active_trip(1), runs)
+        measure(client, 'get_debts_summary', lambda: Database.get_debts_summary(CHAT_ID), runs)
+        measure(client, 'get_my_debts', lambda: Database.get_my_debts(CHAT_ID, user_ids[1]), runs)
+        measure(client, 'get_debts_to_user', lambda: Database.get_debts_to_user(CHAT_ID, user_ids[0]), runs)
+        measure(client, 'get_history_page', lambda: Database.get_history_page(CHAT_ID), runs)
+        measure(client, 'create_debt (4 people)',
+                lambda: Database.create_debt(CHAT_ID, 100, user_ids[0], user_ids[:4], 'кофе'), runs)
+        unpaid = iter(Database.get_individual_debts(CHAT_ID))
+        measure(client, 'mark_debt_paid', lambda: Database.mark_debt_paid(next(unpaid)['id']), runs)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Бенчмарк упрощения долгов (settlement.Settlement.simplify)
+
+Запуск из корня репозитория:
+    python benchmarks/bench_settlement.py
+"""
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from settlement import Settlement
+
+CURRENCIES = ['EUR', 'THB', 'RUB']
+
+
+def make_summary(participants: int, expenses: int, seed: int = 42):
+    """Сводка как из Database.get_debts_summary для случайных трат поездки"""
+    rng = random.Random(seed)
+    user_ids = list(range(1, participants + 1))
+    pairs = {}
+
+    for _ in range(expenses):
+        payer_id = rng.choice(user_ids)
+        currency = rng.choice(CURRENCIES)
+        debtors = rng.sample(user_ids, rng.randint(2, min(8, participants)))
+        amount = rng.randint(100, 500000) / 100
+        for debtor_id in debtors:
+            if debtor_id == payer_id:
+                continue
+            key = (debtor_id, payer_id, currency)
+            pairs[key] = pairs.get(key, 0) + amount / (len(debtors) + 1)
+
+    return [
+        {'debtor_id': d, 'creditor_id': c, 'currency': cur, 'total_amount': total}
+        for (d, c, cur), total in pairs.items()
+    ]
+
+
+def check(summary, transfers):
+    """Упрощённые переводы дают те же чистые балансы, что и исходная сводка"""
+    expected = Settlement.net_balances(summary)
+    actual = Settlement.net_balances([
+        {'debtor_id': t['debtor_id'], 'creditor_id': t['creditor_id'],
+         'currency': t['currency'], 'total_amount': t['amount']}
+        for t in transfers
+    ])
+    for currency, balances in expected.items():
+        for user_id, cents in balances.items():
+            assert abs(actual.get(currency, {}).get(user_id, 0) - cents) <= 1, (currency, user_id)
+
+
+def main():
+    for participants, expenses in [(5, 20), (10, 60), (50, 300), (50, 1500)]:
+        summary = make_summary(participants, expenses)
+        transfers = Settlement.simplify(summary)
+        check(summary, transfers)
+
+        balances = Settlement.net_balances(summary)
+
+        runs = 1000
+        total = min(timeit.repeat(lambda: Settlement.simplify(summary), number=runs, repeat=5)) / runs
+        settle = min(timeit.repeat(
+            lambda: [Settlement.settle_currency(b) for b in balances.values()],
+            number=runs, repeat=5
+        )) / runs
+        print(
+            f"participants={participants:>3} pairs={len(summary):>5} "
+            f"transfers={len(transfers):>4} -> simplify {total * 1e6:7.1f} µs, "
+            f"settle (netted) {settle * 1e6:6.1f} µs"
+        )
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,319 @@
+"""
+Сквозной бенчмарк: синтетические апдейты через настоящие Application и Handlers
+
+Генератор строит апдейты в том виде, в каком их присылает Telegram:
+болтовня в группе, траты «2000 @a @b такси», навигация по вкладкам в ЛС,
+кнопки «вернул» и «подтверждаю». Апдейты проходят тот же путь, что и в
+проде (Update.de_json -> ChatSequentialUpdateProcessor -> хендлеры), но Bot API
+заменён заглушкой (stub_telegram), а хранилище — локальным backend'ом.
+
+Для поездок на 5, 50 и 500 участников печатает p50/p95/p99 по хендлерам,
+апдейты в секунду и число операций хранилища и Bot API на апдейт.
+Лимиты рассылки Telegram сняты: меряем бота, а не флуд-контроль.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_updates.py [fake|sqlite] [updates] [db_latency_ms] [api_latency_ms]
+"""
+import asyncio
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram import Update
+
+from fake_firestore import FakeFirestore
+from stub_telegram import BOT_USER, StubRequest
+from storage import set_backend
+
+from bot import build_application
+from callback_data import CallbackData
+from database import Database
+from notifications import NotificationDispatcher
+
+# Трафик: вид апдейта -> вес
+TRAFFIC_MIX = {
+    'chatter': 45,
+    'expense': 20,
+    'dm_text': 5,
+    'dm_tab': 20,
+    'pay': 5,
+    'confirm': 5,
+}
+
+# Вкладки ЛС: действие CallbackData -> хендлер, который его обслуживает
+DM_TABS = {
+    'dm_debts': 'show_debts_dm',
+    'debts_i_owe': 'show_i_owe',
+    'debts_owe_me': 'show_owe_me',
+    'dm_history': 'show_history_dm',
+}
+
+CHATTER = ('привет', 'кто идёт на ужин?', 'во сколько выезд', 'ок', 'я на месте', 'скиньте фотки')
+DESCRIPTIONS = ('такси', 'ужин', 'продукты', 'билеты', 'кофе', 'отель')
+
+SCENARIOS = ((5, 30), (50, 200), (500, 1000))
+
+
+def percentile(values, p: float):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+class CountingBackend:
+    """Прозрачная обёртка над backend'ом: считает вызовы методов хранилища"""
+
+    def __init__(self, backend):
+        self._backend = backend
+        self._lock = threading.Lock()
+        self.calls = Counter()
+
+    @property
+    def name(self):
+        return self._backend.name
+
+    def __getattr__(self, item):
+        attr = getattr(self._backend, item)
+        if not callable(attr):
+            return attr
+
+        def counted(*args, **kwargs):
+            with self._lock:
+                self.calls[item] += 1
+            return attr(*args, **kwargs)
+        return counted
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+
+
+class TrafficGenerator:
+    """Апдейты Telegram (dict, как в JSON от Bot API) для одной поездки"""
+
+    def __init__(self, chat_id: int, user_ids: list, unpaid_debts: list, rng: random.Random):
+        self.chat_id = chat_id
+        self.user_ids = user_ids
+        # Каждый долг гасится один раз: кнопки берут долги из этих очередей
+        self.to_pay = unpaid_debts[:len(unpaid_debts) // 2]
+        self.to_confirm = unpaid_debts[len(unpaid_debts) // 2:]
+        self.rng = rng
+        self._update_ids = iter(range(1, 10 ** 9))
+        self._message_ids = iter(range(1, 10 ** 9))
+
+    @staticmethod
+    def user(user_id: int) -> dict:
+        return {'id': user_id, 'is_bot': False, 'first_name': f"Имя{user_id}", 'username': f"user_{user_id}"}
+
+    def _message(self, user_id: int, chat: dict, text: str) -> dict:
+        return {
+            'update_id': next(self._update_ids),
+            'message': {
+                'message_id': next(self._message_ids),
+                'date': int(time.time()),
+                'chat': chat,
+                'from': self.user(user_id),
+                'text': text
+            }
+        }
+
+    def _callback(self, user_id: int, data: str) -> dict:
+        return {
+            'update_id': next(self._update_ids),
+            'callback_query': {
+                'id': str(next(self._update_ids)),
+                'from': self.user(user_id),
+                'chat_instance': str(user_id),
+                'data': data,
+                'message': {
+                    'message_id': next(self._message_ids),
+                    'date': int(time.time()),
+                    'chat': {'id': user_id, 'type': 'private', 'first_name': f"Имя{user_id}"},
+                    'from': BOT_USER,
+                    'text': '👤 Личный кабинет'
+                }
+            }
+        }
+
+    def group_chat(self) -> dict:
+        return {'id': self.chat_id, 'type': 'supergroup', 'title': 'Бенчмарк'}
+
+    def private_chat(self, user_id: int) -> dict:
+        return {'id': user_id, 'type': 'private', 'first_name': f"Имя{user_id}"}
+
+    def next_update(self):
+        """(хендлер, апдейт); кнопки долгов без свободных долгов заменяются вкладкой ЛС"""
+        kinds = list(TRAFFIC_MIX)
+        kind = self.rng.choices(kinds, weights=[TRAFFIC_MIX[k] for k in kinds])[0]
+        user_id = self.rng.choice(self.user_ids)
+
+        if kind == 'chatter':
+            return 'handle_group_message', self._message(user_id, self.group_chat(), self.rng.choice(CHATTER))
+
+        if kind == 'expense':
+            others = [u for u in self.rng.sample(self.user_ids, min(len(self.user_ids), 4)) if u != user_id]
+            mentions = ' '.join(f"@user_{u}" for u in others[:self.rng.randint(1, 3)])
+            text = f"{self.rng.randint(100, 5000)} {mentions} {self.rng.choice(DESCRIPTIONS)}"
+            return 'handle_group_expense_text', self._message(user_id, self.group_chat(), text)
+
+        if kind == 'dm_text':
+            return 'show_dm_cabinet', self._message(user_id, self.private_chat(user_id), 'меню')
+
+        if kind == 'pay' and self.to_pay:
+            debt = self.to_pay.pop()
+            data = CallbackData.encode('pay_debt', debt_id=debt['id'])
+            return 'pay_debt', self._callback(debt['debtor_id'], data)
+
+        if kind == 'confirm' and self.to_confirm:
+            debt = self.to_confirm.pop()
+            data = CallbackData.encode('confirm_debt', debt_id=debt['id'])
+            return 'confirm_debt_return', self._callback(debt['creditor_id'], data)
+
+        action = self.rng.choice(list(DM_TABS))
+        return DM_TABS[action], self._callback(user_id, CallbackData.encode(action, chat_id=self.chat_id))
+
+    def generate(self, count: int) -> list:
+        return [self.next_update() for _ in range(count)]
+
+
+def seed_trip(chat_id: int, user_ids: list, expenses: int, rng: random.Random) -> list:
+    """Поездка с участниками и тратами; возвращает непогашенные долги"""
+    Database.create_trip(chat_id, 'Бенчмарк', 'EUR', user_ids[0])
+    for user_id in user_ids:
+        Database.add_participant(chat_id, user_id, f"user_{user_id}", f"Имя{user_id}")
+        Database.link_user_to_trip(user_id, chat_id)
+
+    for _ in range(expenses):
+        payer_id = rng.choice(user_ids)
+        members = rng.sample(user_ids, min(len(user_ids), rng.randint(2, 6)))
+        if payer_id not in members:
+            members.append(payer_id)
+        Database.create_debt(chat_id, rng.randint(100, 50000) / 100, payer_id, members, 'ужин')
+
+    debts = Database.get_individual_debts(chat_id)
+    rng.shuffle(debts)
+    return debts
+
+
+def make_backend(kind: str, workdir: str, participants: int):
+    """(backend, клиент поддельного Firestore или None)"""
+    if kind == 'fake':
+        from storage_firestore import FirestoreBackend
+        client = FakeFirestore(seed=42, max_log=None)
+        return FirestoreBackend(client=client), client
+    if kind == 'sqlite':
+        from storage_sqlite import SqliteBackend
+        return SqliteBackend(os.path.join(workdir, f"bench_{participants}.db")), None
+    raise ValueError(f"Unknown backend: {kind}")
+
+
+async def replay(application, traffic: list):
+    """
+    Прогнать апдейты как при пачке из очереди: все сразу, параллелизм и порядок
+    внутри чата — как у ChatSequentialUpdateProcessor в проде.
+    Возвращает ({хендлер: [секунды]}, общее время)
+    """
+    processor = application.update_processor
+    timings = defaultdict(list)
+
+    async def timed(label: str, update: Update):
+        started = time.perf_counter()
+        await application.process_update(update)
+        timings[label].append(time.perf_counter() - started)
+
+    async def one(label: str, data: dict):
+        update = Update.de_json(data, application.bot)
+        await processor.process_update(update, timed(label, update))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(label, data) for label, data in traffic))
+    return timings, time.perf_counter() - started
+
+
+async def run_scenario(kind: str, participants: int, expenses: int, updates: int,
+                       db_latency: float, api_latency: float, workdir: str):
+    rng = random.Random(participants)
+    chat_id = -1001000000000 - participants
+    user_ids = [participants * 100000 + i for i in range(1, participants + 1)]
+
+    backend, client = make_backend(kind, workdir, participants)
+    counting = CountingBackend(backend)
+    set_backend(counting)
+    unpaid = seed_trip(chat_id, user_ids, expenses, rng)
+    traffic = TrafficGenerator(chat_id, user_ids, unpaid, rng).generate(updates)
+
+    request = StubRequest(latency=api_latency, jitter=api_latency / 2, seed=participants)
+    application = build_application(token='123456:stub', request=request)
+    application.bot_data['handlers'].notifier = NotificationDispatcher(global_rate=10 ** 6, per_chat_interval=0)
+
+    errors = Counter()
+
+    async def count_errors(update, context):
+        errors[type(context.error).__name__] += 1
+    application.add_error_handler(count_errors)
+
+    await application.initialize()
+    await application.start()
+
+    counting.reset()
+    request.reset()
+    if client:
+        client.latency, client.jitter = db_latency, db_latency / 2
+        client.reset()
+
+    timings, elapsed = await replay(application, traffic)
+
+    # Фоновые задачи (рассылки, сохранение очереди автоудаления) — тоже нагрузка апдейтов
+    await application.stop()
+    background = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+    await asyncio.gather(*background, return_exceptions=True)
+    await application.shutdown()
+
+    db_note = f"db {db_latency * 1000:.0f} ms" if client else 'db local'
+    print(f"--- {participants} participants, {expenses} seeded expenses, {kind} ({db_note}, "
+          f"api {api_latency * 1000:.0f} ms) ---")
+    print(f"{updates} updates in {elapsed:.2f} s: {updates / elapsed:.1f} updates/sec, "
+          f"errors: {dict(errors) or 0}")
+    print(f"{'handler':<28}{'count':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for label, values in sorted(timings.items(), key=lambda item: -len(item[1])):
+        print(f"{label:<28}{len(values):>6}"
+              f"{statistics.median(values) * 1000:>10.2f}"
+              f"{percentile(values, 0.95) * 1000:>10.2f}"
+              f"{percentile(values, 0.99) * 1000:>10.2f}")
+
+    storage_calls = sum(counting.calls.values())
+    line = f"per update: storage calls {storage_calls / updates:.2f}"
+    if client:
+        stats = client.stats()
+        line += f", doc reads {stats['reads'] / updates:.1f}, doc writes {stats['writes'] / updates:.2f}"
+    line += f", Bot API calls {request.api_calls() / updates:.2f}"
+    print(line)
+    top = ', '.join(f"{name} {count / updates:.2f}" for name, count in counting.calls.most_common(6))
+    print(f"top storage methods per update: {top}")
+    print()
+
+
+def main():
+    kind = sys.argv[1] if len(sys.argv) > 1 else 'fake'
+    updates = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    db_latency = float(sys.argv[3]) / 1000 if len(sys.argv) > 3 else 0.005
+    api_latency = float(sys.argv[4]) / 1000 if len(sys.argv) > 4 else 0.02
+
+    # bot.py включает подробные логи; в бенчмарке они только мешают
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger('handlers').setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        for participants, expenses in SCENARIOS:
+            asyncio.run(run_scenario(kind, participants, expenses, updates, db_latency, api_latency, workdir))
+
+
+if __name__ == '__main__':
+    main()
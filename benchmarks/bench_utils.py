@@ -0,0 +1,113 @@
+"""
+Микро-бенчмарки utils.Utils (разбор и форматирование)
+
+Запуск из корня репозитория:
+    python benchmarks/bench_utils.py
+"""
+import os
+import random
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import Utils
+
+
+def make_participants(count: int):
+    return [
+        {
+            'user_id': 1000 + i,
+            'username': f"user_{i}" if i % 3 else '',
+            'first_name': f"Имя{i}"
+        }
+        for i in range(count)
+    ]
+
+
+def make_summary(participants, pairs: int, rng):
+    return [
+        {
+            'debtor_id': rng.choice(participants)['user_id'],
+            'creditor_id': rng.choice(participants)['user_id'],
+            'currency': rng.choice(['EUR', 'THB']),
+            'total_amount': rng.randint(100, 100000) / 100
+        }
+        for _ in range(pairs)
+    ]
+
+
+def make_debts(participants, count: int, rng):
+    return [
+        {
+            'debtor_id': participants[0]['user_id'],
+            'creditor_id': rng.choice(participants)['user_id'],
+            'amount': rng.randint(100, 100000) / 100,
+            'currency': 'EUR',
+            'group_info': {'description': f"Расход *{i}*", 'category': '🍽'}
+        }
+        for i in range(count)
+    ]
+
+
+def make_events(participants, count: int, rng):
+    now = datetime.now()
+    events = []
+    for i in range(count):
+        if i % 2:
+            events.append({
+                'type': 'debt_created',
+                'timestamp': now - timedelta(minutes=i),
+                'payer_id': rng.choice(participants)['user_id'],
+                'total_amount': rng.randint(100, 100000) / 100,
+                'currency': 'EUR',
+                'description': 'такси',
+                'category': '🚕',
+                'participants': [p['user_id'] for p in participants[:4]]
+            })
+        else:
+            events.append({
+                'type': 'debt_paid',
+                'timestamp': now - timedelta(minutes=i),
+                'debtor_id': rng.choice(participants)['user_id'],
+                'creditor_id': rng.choice(participants)['user_id'],
+                'amount': rng.randint(100, 100000) / 100,
+                'currency': 'EUR',
+                'description': 'отель',
+                'category': '🏨'
+            })
+    return events
+
+
+def bench(name: str, func, number: int = 2000):
+    seconds = min(timeit.repeat(func, number=number, repeat=5)) / number
+    print(f"{name:<45} {seconds * 1e6:9.2f} µs")
+
+
+def main():
+    rng = random.Random(42)
+    trip = {'name': 'Тайланд_2024', 'currency': 'EUR'}
+
+    for size in (5, 50):
+        participants = make_participants(size)
+        summary = make_summary(participants, size * 2, rng)
+        debts = make_debts(participants, 20, rng)
+        events = make_events(participants, 50, rng)
+        mentions = ' '.join(f"@user_{i}" for i in range(1, min(size, 8)))
+        expense = f"2000 THB {mentions} ужин в ресторане"
+
+        print(f"--- {size} participants ---")
+        bench('parse_currency_from_text', lambda: Utils.parse_currency_from_text(expense))
+        bench('parse_participants_from_text', lambda: Utils.parse_participants_from_text(expense, participants))
+        bench('get_participant_name (list)', lambda: Utils.get_participant_name(participants[-1]['user_id'], participants))
+        bench('format_amount', lambda: Utils.format_amount(1234.5, 'EUR'))
+        bench('escape_markdown', lambda: Utils.escape_markdown('user_name *bold* [link]'))
+        bench(f'format_summary ({len(summary)} pairs)', lambda: Utils.format_summary(trip, summary, participants))
+        bench('format_my_debts (20 debts)', lambda: Utils.format_my_debts(debts, participants))
+        bench('format_debts_to_me (20 debts)', lambda: Utils.format_debts_to_me(debts, participants))
+        bench('format_history (50 events)', lambda: Utils.format_history(trip, events, participants), number=500)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,597 @@
+"""
+Поддельный Firestore в памяти процесса — для бенчмарков без облака
+
+Реализует подмножество API google-cloud-firestore, которое использует
+storage_firestore.FirestoreBackend: коллекции и подколлекции, документы,
+where/order_by/limit/start_after/select/stream, add, set (с merge), update
+(пути полей через точку), delete, get_all, батчи и транзакции (совместимые с
+@firestore.transactional), а также Increment, ArrayUnion, ArrayRemove и DELETE_FIELD.
+
+Каждый вызов «сети» ждёт latency + случайный хвост (экспоненциальный, среднее
+jitter) и пишется в журнал: сколько документов прочитано и записано.
+
+    client = FakeFirestore(latency=0.02, jitter=0.01)
+    set_backend(FirestoreBackend(client=client))
+    ...
+    print(client.stats())
+"""
+import copy
+import itertools
+import random
+import secrets
+import string
+import threading
+import time
+from collections import deque, namedtuple
+from datetime import datetime
+
+from google.api_core.exceptions import AlreadyExists, Aborted, InvalidArgument, NotFound
+from google.cloud.firestore_v1 import transforms
+from google.cloud.firestore_v1.field_path import FieldPath
+
+ID_ALPHABET = string.ascii_letters + string.digits
+
+# Запись журнала: операция, путь, прочитано и записано документов, задержка (с)
+Call = namedtuple('Call', 'op path reads writes seconds')
+
+# Операции, для которых можно задать свою задержку
+OPERATIONS = ('get', 'get_all', 'query', 'write', 'commit', 'begin', 'rollback')
+
+BATCH_MAX_OPS = 500
+
+_MISSING = object()
+
+
+def _split(path):
+    if isinstance(path, FieldPath):
+        return path.parts
+    return FieldPath.from_string(path).parts
+
+
+def _get_field(data: dict, parts):
+    for part in parts:
+        if not isinstance(data, dict) or part not in data:
+            return _MISSING
+        data = data[part]
+    return data
+
+
+def _doc_field(doc_id: str, data: dict, parts):
+    """Поле для order_by и курсора; '__name__' — ID документа"""
+    if parts == ('__name__',):
+        return doc_id
+    return _get_field(data, parts)
+
+
+def _apply_value(current, value):
+    """Значение поля после записи с учётом трансформаций"""
+    if isinstance(value, transforms.Increment):
+        base = current if isinstance(current, (int, float)) else 0
+        return base + value.value
+    if isinstance(value, transforms.ArrayUnion):
+        result = list(current) if isinstance(current, list) else []
+        result.extend(item for item in value.values if item not in result)
+        return result
+    if isinstance(value, transforms.ArrayRemove):
+        return [item for item in current if item not in value.values] if isinstance(current, list) else []
+    if value is transforms.SERVER_TIMESTAMP:
+        return datetime.now()
+    if isinstance(value, dict):
+        return {key: _apply_value(_MISSING, item) for key, item in value.items() if item is not transforms.DELETE_FIELD}
+    return copy.deepcopy(value)
+
+
+def _set_field(data: dict, parts, value):
+    for part in parts[:-1]:
+        child = data.get(part)
+        if not isinstance(child, dict):
+            child = data[part] = {}
+        data = child
+    if value is transforms.DELETE_FIELD:
+        data.pop(parts[-1], None)
+    else:
+        data[parts[-1]] = _apply_value(data.get(parts[-1], _MISSING), value)
+
+
+def _merge(data: dict, updates: dict):
+    """set(..., merge=True): вложенные словари сливаются, листья заменяются"""
+    for key, value in updates.items():
+        if isinstance(value, dict) and isinstance(data.get(key), dict):
+            _merge(data[key], value)
+        else:
+            _set_field(data, (key,), value)
+
+
+def _sort_key(value):
+    # Порядок типов как в Firestore: null, числа, даты, строки, остальное
+    if value is None or value is _MISSING:
+        return (0, 0)
+    if isinstance(value, bool):
+        return (1, value)
+    if isinstance(value, (int, float)):
+        return (2, value)
+    if isinstance(value, datetime):
+        # Firestore хранит даты с точностью до микросекунды
+        return (3, round(value.timestamp() * 1_000_000))
+    if isinstance(value, str):
+        return (4, value)
+    return (5, str(value))
+
+
+def _matches(value, op: str, expected):
+    if value is _MISSING:
+        return False
+    if op == '==':
+        return value == expected
+    if op == '!=':
+        return value != expected and value is not None
+    if op == 'in':
+        return value in expected
+    if op == 'not-in':
+        return value not in expected and value is not None
+    if op == 'array_contains':
+        return isinstance(value, list) and expected in value
+    if op == 'array_contains_any':
+        return isinstance(value, list) and any(item in value for item in expected)
+    if value is None:
+        return False
+    try:
+        if op == '<':
+            return value < expected
+        if op == '<=':
+            return value <= expected
+        if op == '>':
+            return value > expected
+        if op == '>=':
+            return value >= expected
+    except TypeError:
+        return False
+    raise InvalidArgument(f"Unsupported operator {op}")
+
+
+class FakeDocumentSnapshot:
+    def __init__(self, reference, data, read_time=None):
+        self.reference = reference
+        self._data = data
+        self.read_time = read_time
+
+    @property
+    def id(self):
+        return self.reference.id
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field_path):
+        value = _get_field(self._data or {}, _split(field_path))
+        if value is _MISSING:
+            raise KeyError(field_path)
+        return copy.deepcopy(value)
+
+
+class FakeQuery:
+    def __init__(self, collection, filters=(), orders=(), limit=None, cursor=None, projection=None):
+        self._collection = collection
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit
+        self._cursor = cursor
+        self._projection = projection
+
+    def _copy(self, **changes):
+        state = {
+            'filters': self._filters,
+            'orders': self._orders,
+            'limit': self._limit,
+            'cursor': self._cursor,
+            'projection': self._projection
+        }
+        state.update(changes)
+        return FakeQuery(self._collection, **state)
+
+    def where(self, field_path=None, op_string=None, value=None, *, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + ((_split(field_path), op_string, value),))
+
+    def order_by(self, field_path, direction='ASCENDING'):
+        return self._copy(orders=self._orders + ((_split(field_path), direction == 'DESCENDING'),))
+
+    def limit(self, count: int):
+        return self._copy(limit=count)
+
+    def start_after(self, document_fields_or_snapshot):
+        return self._copy(cursor=document_fields_or_snapshot)
+
+    def select(self, field_paths):
+        return self._copy(projection=[_split(path) for path in field_paths])
+
+    def _cursor_values(self):
+        cursor = self._cursor
+        if isinstance(cursor, FakeDocumentSnapshot):
+            cursor = dict(cursor.to_dict() or {}, __name__=cursor.id)
+        values = []
+        for parts, _ in self._orders:
+            value = cursor.get('__name__') if parts == ('__name__',) else _get_field(cursor, parts)
+            # Курсор по ID документа принимает и строку, и DocumentReference
+            values.append(_sort_key(getattr(value, 'id', value)))
+        return tuple(values)
+
+    def _run(self, docs):
+        """Отфильтровать и упорядочить [(doc_id, data)] — под блокировкой хранилища"""
+        result = [
+            (doc_id, data) for doc_id, data in docs
+            if all(_matches(_get_field(data, parts), op, value) for parts, op, value in self._filters)
+        ]
+        # Как в Firestore: документы без поля сортировки в выборку не попадают
+        for parts, _ in self._orders:
+            result = [(doc_id, data) for doc_id, data in result if _doc_field(doc_id, data, parts) is not _MISSING]
+        for parts, descending in reversed(self._orders):
+            result.sort(key=lambda item: _sort_key(_doc_field(item[0], item[1], parts)), reverse=descending)
+
+        if self._cursor is not None and self._orders:
+            cursor = self._cursor_values()
+
+            def after(doc_id, data):
+                for (parts, descending), bound in zip(self._orders, cursor):
+                    value = _sort_key(_doc_field(doc_id, data, parts))
+                    if value != bound:
+                        return value < bound if descending else value > bound
+                return False
+
+            result = [(doc_id, data) for doc_id, data in result if after(doc_id, data)]
+
+        if self._limit is not None:
+            result = result[:self._limit]
+        return result
+
+    def stream(self, transaction=None):
+        client = self._collection._client
+        rows = client._query(self, transaction)
+        for doc_id, data in rows:
+            if self._projection is not None:
+                projected = {}
+                for parts in self._projection:
+                    if parts == ('__name__',):
+                        continue
+                    value = _get_field(data, parts)
+                    if value is not _MISSING:
+                        _set_field(projected, parts, value)
+                data = projected
+            yield FakeDocumentSnapshot(self._collection.document(doc_id), data)
+
+    def get(self, transaction=None):
+        return list(self.stream(transaction=transaction))
+
+
+class FakeCollectionReference(FakeQuery):
+    def __init__(self, client, path: str):
+        super().__init__(self)
+        self._client = client
+        self._path = path
+
+    @property
+    def id(self):
+        return self._path.rsplit('/', 1)[-1]
+
+    @property
+    def path(self):
+        return self._path
+
+    def document(self, document_id: str = None):
+        if document_id is None:
+            document_id = ''.join(secrets.choice(ID_ALPHABET) for _ in range(20))
+        return FakeDocumentReference(self._client, f"{self._path}/{document_id}")
+
+    def add(self, document_data: dict, document_id: str = None):
+        ref = self.document(document_id)
+        write_result = ref.create(document_data)
+        return write_result, ref
+
+    def list_documents(self):
+        with self._client._lock:
+            ids = list(self._client._collections.get(self._path, {}))
+        return [self.document(doc_id) for doc_id in ids]
+
+
+class FakeDocumentReference:
+    def __init__(self, client, path: str):
+        self._client = client
+        self._path = path
+
+    def __eq__(self, other):
+        return isinstance(other, FakeDocumentReference) and other._path == self._path
+
+    def __hash__(self):
+        return hash(self._path)
+
+    def __repr__(self):
+        return f"FakeDocumentReference({self._path!r})"
+
+    @property
+    def id(self):
+        return self._path.rsplit('/', 1)[-1]
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def parent(self):
+        return FakeCollectionReference(self._client, self._path.rsplit('/', 1)[0])
+
+    def collection(self, collection_id: str):
+        return FakeCollectionReference(self._client, f"{self._path}/{collection_id}")
+
+    def get(self, field_paths=None, transaction=None):
+        return self._client._get(self, transaction)
+
+    def create(self, document_data: dict):
+        return self._client._write_now([('create', self, document_data)])
+
+    def set(self, document_data: dict, merge: bool = False):
+        return self._client._write_now([('set_merge' if merge else 'set', self, document_data)])
+
+    def update(self, field_updates: dict):
+        return self._client._write_now([('update', self, field_updates)])
+
+    def delete(self):
+        return self._client._write_now([('delete', self, None)])
+
+
+class FakeWriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def __len__(self):
+        return len(self._writes)
+
+    def create(self, reference, document_data: dict):
+        self._writes.append(('create', reference, copy.deepcopy(document_data)))
+
+    def set(self, reference, document_data: dict, merge: bool = False):
+        self._writes.append(('set_merge' if merge else 'set', reference, copy.deepcopy(document_data)))
+
+    def update(self, reference, field_updates: dict):
+        self._writes.append(('update', reference, copy.deepcopy(field_updates)))
+
+    def delete(self, reference):
+        self._writes.append(('delete', reference, None))
+
+    def commit(self):
+        if len(self._writes) > BATCH_MAX_OPS:
+            raise InvalidArgument(f"maximum {BATCH_MAX_OPS} writes allowed per request")
+        writes, self._writes = self._writes, []
+        return self._client._commit(writes)
+
+
+class FakeTransaction(FakeWriteBatch):
+    """
+    Оптимистичная транзакция: версии прочитанных документов проверяются
+    при коммите, при конфликте — Aborted, и @firestore.transactional повторяет функцию.
+    """
+
+    def __init__(self, client, max_attempts: int = 5, read_only: bool = False):
+        super().__init__(client)
+        self._max_attempts = max_attempts
+        self._read_only = read_only
+        self._id = None
+        self._reads = {}
+
+    @property
+    def in_progress(self):
+        return self._id is not None
+
+    @property
+    def id(self):
+        return self._id
+
+    def _clean_up(self):
+        self._writes = []
+        self._reads = {}
+        self._id = None
+
+    def _begin(self, retry_id=None):
+        if self.in_progress:
+            raise ValueError("Transaction already begun")
+        self._client._delay('begin', '')
+        self._id = next(self._client._transaction_ids)
+
+    def _track_read(self, path: str, version: int):
+        if self._writes:
+            raise ValueError("Firestore transactions require all reads to be executed before all writes")
+        self._reads.setdefault(path, version)
+
+    def _commit(self):
+        if not self.in_progress:
+            raise ValueError("Transaction not in progress")
+        writes = self._writes
+        try:
+            return self._client._commit(writes, reads=self._reads)
+        finally:
+            self._clean_up()
+
+    def _rollback(self):
+        if self.in_progress:
+            self._client._delay('rollback', '')
+        self._clean_up()
+
+    def get(self, ref_or_query):
+        if isinstance(ref_or_query, FakeDocumentReference):
+            return iter([ref_or_query.get(transaction=self)])
+        return ref_or_query.stream(transaction=self)
+
+
+class FakeFirestore:
+    """
+    Клиент Firestore в памяти
+
+    latency — базовая задержка каждого сетевого вызова (с), jitter — среднее
+    экспоненциальной добавки (даёт «хвост» задержек), op_latency — задержки
+    для отдельных операций из OPERATIONS, seed — воспроизводимый jitter.
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, op_latency: dict = None,
+                 seed: int = None, max_log: int = 100000):
+        self.latency = latency
+        self.jitter = jitter
+        self.op_latency = dict(op_latency or {})
+        self._random = random.Random(seed)
+        self._lock = threading.RLock()
+        # путь коллекции -> {id документа: данные}
+        self._collections = {}
+        # путь документа -> версия (растёт при каждой записи)
+        self._versions = {}
+        self._version_counter = itertools.count(1)
+        self._transaction_ids = itertools.count(1)
+        self.log = deque(maxlen=max_log)
+
+    # ---- API клиента ----
+
+    def collection(self, path: str):
+        return FakeCollectionReference(self, path)
+
+    def document(self, path: str):
+        return FakeDocumentReference(self, path)
+
+    def batch(self):
+        return FakeWriteBatch(self)
+
+    def transaction(self, max_attempts: int = 5, read_only: bool = False):
+        return FakeTransaction(self, max_attempts=max_attempts, read_only=read_only)
+
+    def get_all(self, references, field_paths=None, transaction=None):
+        references = list(references)
+        seconds = self._delay('get_all', references[0].parent.path if references else '')
+        snapshots = []
+        with self._lock:
+            for ref in references:
+                collection, doc_id = self._locate(ref)
+                data = collection.get(doc_id)
+                if transaction is not None:
+                    transaction._track_read(ref.path, self._versions.get(ref.path, 0))
+                snapshots.append(FakeDocumentSnapshot(ref, copy.deepcopy(data)))
+        self._record('get_all', references[0].parent.path if references else '', len(references), 0, seconds)
+        return iter(snapshots)
+
+    # ---- Журнал и задержки ----
+
+    def _delay(self, op: str, path: str) -> float:
+        seconds = self.op_latency.get(op, self.latency)
+        if self.jitter:
+            with self._lock:
+                seconds += self._random.expovariate(1 / self.jitter)
+        if seconds > 0:
+            time.sleep(seconds)
+        return seconds
+
+    def _record(self, op: str, path: str, reads: int, writes: int, seconds: float):
+        self.log.append(Call(op, path, reads, writes, seconds))
+
+    def reset(self):
+        """Очистить журнал вызовов (данные остаются)"""
+        self.log.clear()
+
+    def clear(self):
+        """Удалить все данные и журнал"""
+        with self._lock:
+            self._collections.clear()
+            self._versions.clear()
+        self.log.clear()
+
+    def stats(self) -> dict:
+        """Сводка журнала: вызовы, прочитанные и записанные документы, по операциям"""
+        calls = list(self.log)
+        by_op = {}
+        for call in calls:
+            entry = by_op.setdefault(call.op, {'calls': 0, 'reads': 0, 'writes': 0})
+            entry['calls'] += 1
+            entry['reads'] += call.reads
+            entry['writes'] += call.writes
+        return {
+            'calls': len(calls),
+            'reads': sum(call.reads for call in calls),
+            'writes': sum(call.writes for call in calls),
+            'by_op': by_op
+        }
+
+    def document_count(self, collection_path: str = None) -> int:
+        with self._lock:
+            if collection_path is not None:
+                return len(self._collections.get(collection_path, {}))
+            return sum(len(docs) for docs in self._collections.values())
+
+    # ---- Хранилище ----
+
+    def _locate(self, ref):
+        collection_path, doc_id = ref.path.rsplit('/', 1)
+        return self._collections.setdefault(collection_path, {}), doc_id
+
+    def _get(self, ref, transaction=None):
+        seconds = self._delay('get', ref.path)
+        with self._lock:
+            collection, doc_id = self._locate(ref)
+            data = copy.deepcopy(collection.get(doc_id))
+            if transaction is not None:
+                transaction._track_read(ref.path, self._versions.get(ref.path, 0))
+        # Чтение отсутствующего документа тоже оплачивается
+        self._record('get', ref.path, 1, 0, seconds)
+        return FakeDocumentSnapshot(ref, data)
+
+    def _query(self, query, transaction=None):
+        path = query._collection.path
+        seconds = self._delay('query', path)
+        with self._lock:
+            docs = list(self._collections.get(path, {}).items())
+            rows = [(doc_id, copy.deepcopy(data)) for doc_id, data in query._run(docs)]
+            if transaction is not None:
+                for doc_id, _ in rows:
+                    doc_path = f"{path}/{doc_id}"
+                    transaction._track_read(doc_path, self._versions.get(doc_path, 0))
+        # Запрос без результатов оплачивается как одно чтение
+        self._record('query', path, max(1, len(rows)), 0, seconds)
+        return rows
+
+    def _write_now(self, writes):
+        return self._commit(writes, op='write')
+
+    def _commit(self, writes, reads=None, op='commit'):
+        path = writes[0][1].path if writes else ''
+        seconds = self._delay(op, path)
+        with self._lock:
+            for doc_path, version in (reads or {}).items():
+                if self._versions.get(doc_path, 0) != version:
+                    raise Aborted(f"Transaction conflict on {doc_path}")
+
+            # Проверяем все записи до применения: батч атомарен
+            for kind, ref, _ in writes:
+                collection, doc_id = self._locate(ref)
+                if kind == 'update' and doc_id not in collection:
+                    raise NotFound(f"No document to update: {ref.path}")
+                if kind == 'create' and doc_id in collection:
+                    raise AlreadyExists(f"Document already exists: {ref.path}")
+
+            for kind, ref, data in writes:
+                self._apply(kind, ref, data)
+        self._record(op, path, 0, len(writes), seconds)
+        return [datetime.now() for _ in writes]
+
+    def _apply(self, kind: str, ref, data):
+        collection, doc_id = self._locate(ref)
+        if kind == 'delete':
+            collection.pop(doc_id, None)
+        elif kind in ('set', 'create'):
+            collection[doc_id] = _apply_value(_MISSING, data)
+        elif kind == 'set_merge':
+            document = collection.setdefault(doc_id, {})
+            _merge(document, data)
+        else:
+            document = collection[doc_id]
+            for field_path, value in data.items():
+                _set_field(document, _split(field_path), value)
+        self._versions[ref.path] = next(self._version_counter)
@@ -0,0 +1,89 @@
+"""
+Заглушка Bot API для бенчмарков: python-telegram-bot ходит не в сеть, а сюда
+
+Подключается как BaseRequest приложения (bot.build_application(request=...)).
+Отвечает правдоподобными объектами на методы, которые вызывают хендлеры
+(getMe, sendMessage, editMessageText, answerCallbackQuery, deleteMessage,
+getChatMember), на остальные — True. Каждый вызов ждёт latency + случайный
+хвост (экспоненциальный, среднее jitter) и учитывается в calls.
+
+    request = StubRequest(latency=0.05)
+    application = build_application(token='123:stub', request=request)
+    ...
+    print(request.calls)
+"""
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import Counter
+
+from telegram.request import BaseRequest
+
+BOT_USER = {
+    'id': 8287466021,
+    'is_bot': True,
+    'first_name': 'TripSplit',
+    'username': 'dolgotripbot',
+    'can_join_groups': True,
+    'can_read_all_group_messages': True,
+    'supports_inline_queries': False
+}
+
+
+class StubRequest(BaseRequest):
+    """BaseRequest без сети: фиксированные ответы, задержка и счётчик вызовов"""
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, seed: int = None):
+        self.latency = latency
+        self.jitter = jitter
+        # метод Bot API -> количество вызовов
+        self.calls = Counter()
+        self._rng = random.Random(seed)
+        self._message_ids = itertools.count(1000)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit('/', 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.calls[api_method] += 1
+
+        delay = self.latency + (self._rng.expovariate(1 / self.jitter) if self.jitter else 0)
+        if delay:
+            await asyncio.sleep(delay)
+
+        result = self._result(api_method, params)
+        return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+    def _result(self, api_method: str, params: dict):
+        if api_method == 'getMe':
+            return BOT_USER
+        if api_method in ('sendMessage', 'editMessageText'):
+            chat_id = int(params['chat_id'])
+            return {
+                'message_id': params.get('message_id') or next(self._message_ids),
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private' if chat_id > 0 else 'supergroup'},
+                'from': BOT_USER,
+                'text': params.get('text', '')
+            }
+        if api_method == 'getChatMember':
+            return {
+                'status': 'creator',
+                'is_anonymous': False,
+                'user': {'id': int(params['user_id']), 'is_bot': False, 'first_name': 'Admin'}
+            }
+        return True
+
+    def api_calls(self) -> int:
+        return sum(self.calls.values())
+
+    def reset(self):
+        self.calls.clear()
@@ -1,14 +1,51 @@
+import time
+
+# Отсчёт времени запуска — до тяжёлых импортов (telegram, httpx)
+STARTED_AT = time.perf_counter()
+
+import asyncio
+import json
 import logging
+import secrets
+from collections import deque
 from telegram import Update
+from telegram.request import BaseRequest, HTTPXRequest
 from telegram.ext import (
     Application,
+    BaseUpdateProcessor,
     CommandHandler,
     CallbackQueryHandler,
     MessageHandler,
     ConversationHandler,
     filters
 )
-from config import BOT_TOKEN
+from config import (
+    BOT_TOKEN,
+    BOT_MODE,
+    CONCURRENT_UPDATES,
+    WEBHOOK_URL,
+    WEBHOOK_PATH,
+    WEBHOOK_LISTEN,
+    WEBHOOK_PORT,
+    WEBHOOK_SECRET_TOKEN,
+    SERVICE_HTTP_HOST,
+    SERVICE_HTTP_PORT,
+    HANDLERS_LOG_LEVEL,
+    STORAGE_PREWARM,
+)
+from database import AsyncDatabase, Database
+from http_server import ServiceHttpServer
+from metrics import (
+    REGISTRY,
+    TELEGRAM_LATENCY,
+    TELEGRAM_ERRORS,
+    TELEGRAM_RETRY_AFTER,
+    TELEGRAM_RETRY_AFTER_SECONDS,
+    UPDATE_QUEUE_SIZE,
+    AUTODELETE_PENDING,
+    instrument_handlers,
+)
+from router import CallbackRouter
 from handlers import Handlers, TRIP_NAME, TRIP_CURRENCY
 
 # Настройка логирования (УСИЛЕНО!)
@@ -18,25 +55,327 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Включить DEBUG для видимости всех действий
-logging.getLogger('handlers').setLevel(logging.DEBUG)
+# Подробность логов хендлеров (DEBUG — видны все действия)
+logging.getLogger('handlers').setLevel(HANDLERS_LOG_LEVEL)
+
+
+class ChatSequentialUpdateProcessor(BaseUpdateProcessor):
+    """Апдейты разных чатов обрабатываются параллельно, одного чата — по очереди.
+    
+    ConversationHandler и порядок сообщений внутри чата остаются корректными,
+    а медленный запрос в одном чате не задерживает остальные.
+    
+    Переопределяется только do_process_update: process_update в PTB 20.7
+    помечен @final и сам ограничивает параллельность семафором
+    (python-telegram-bot==20.7 в requirements.txt).
+    """
+    
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        # chat_id -> очередь корутин, ждущих выполняющийся апдейт этого чата
+        self._pending = {}
+    
+    async def do_process_update(self, update, coroutine):
+        chat = update.effective_chat if isinstance(update, Update) else None
+        if chat is None:
+            await coroutine
+            return
+        
+        # Чат уже занят — апдейт встаёт в его очередь и сразу отдаёт слот
+        # семафора: ждущие апдейты одного чата не тормозят остальные чаты
+        queue = self._pending.get(chat.id)
+        if queue is not None:
+            queue.append(coroutine)
+            return
+        
+        queue = self._pending[chat.id] = deque([coroutine])
+        try:
+            while queue:
+                try:
+                    await queue.popleft()
+                except Exception as e:
+                    logger.error(f"Error processing update in chat {chat.id}: {e}")
+        finally:
+            del self._pending[chat.id]
+            # Остановка посреди очереди: корутины не запустятся, закрываем их
+            for pending in queue:
+                pending.close()
+    
+    async def initialize(self):
+        pass
+    
+    async def shutdown(self):
+        pass
+
+
+class InstrumentedRequest(BaseRequest):
+    """Обёртка над BaseRequest: время, ошибки и RetryAfter каждого вызова Bot API"""
+    
+    def __init__(self, request: BaseRequest):
+        self._request = request
+    
+    @property
+    def read_timeout(self):
+        return self._request.read_timeout
+    
+    async def initialize(self):
+        await self._request.initialize()
+    
+    async def shutdown(self):
+        await self._request.shutdown()
+    
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit('/', 1)[-1]
+        started = time.perf_counter()
+        try:
+            status, payload = await self._request.do_request(
+                url, method, request_data,
+                read_timeout=read_timeout,
+                write_timeout=write_timeout,
+                connect_timeout=connect_timeout,
+                pool_timeout=pool_timeout
+            )
+        except Exception:
+            TELEGRAM_ERRORS.inc(method=api_method, status='network')
+            raise
+        finally:
+            TELEGRAM_LATENCY.observe(time.perf_counter() - started, method=api_method)
+        
+        if status >= 400:
+            TELEGRAM_ERRORS.inc(method=api_method, status=str(status))
+        if status == 429:
+            TELEGRAM_RETRY_AFTER.inc(method=api_method)
+            try:
+                retry_after = json.loads(payload)['parameters']['retry_after']
+                TELEGRAM_RETRY_AFTER_SECONDS.inc(retry_after)
+            except (ValueError, KeyError, TypeError):
+                pass
+        return status, payload
+
+
+class StartupTimer:
+    """Время этапов запуска: каждый этап длится от конца предыдущего"""
+    
+    def __init__(self, started_at: float):
+        self.started_at = started_at
+        self.phases = {}
+        self._last = started_at
+    
+    def mark(self, phase: str):
+        now = time.perf_counter()
+        self.phases[phase] = now - self._last
+        self._last = now
+    
+    def add(self, phases: dict):
+        """Этапы, измеренные в другом месте (например, в пуле потоков хранилища)"""
+        self.phases.update(phases)
+        self._last = time.perf_counter()
+    
+    def as_dict(self) -> dict:
+        return {phase: round(seconds * 1000, 1) for phase, seconds in self.phases.items()}
+    
+    def report(self) -> str:
+        phases = ', '.join(f"{phase} {seconds * 1000:.0f} ms" for phase, seconds in self.phases.items())
+        return f"{phases}; total {self._last - self.started_at:.2f} s"
+
+
+# Какие типы апдейтов нужны каждому виду хендлеров
+HANDLER_UPDATE_TYPES = {
+    CommandHandler: [Update.MESSAGE],
+    MessageHandler: [Update.MESSAGE],
+    CallbackQueryHandler: [Update.CALLBACK_QUERY],
+}
+
+
+def collect_allowed_updates(application: Application):
+    """
+    Типы апдейтов, которые реально обрабатывают зарегистрированные хендлеры
+    Telegram не будет присылать остальное (правки, реакции, смену участников).
+    Неизвестный вид хендлера — на всякий случай получаем всё.
+    """
+    allowed = set()
+    
+    def visit(handler):
+        if isinstance(handler, ConversationHandler):
+            for child in handler.entry_points + handler.fallbacks:
+                visit(child)
+            for state_handlers in handler.states.values():
+                for child in state_handlers:
+                    visit(child)
+            return
+        
+        for handler_type, update_types in HANDLER_UPDATE_TYPES.items():
+            if isinstance(handler, handler_type):
+                allowed.update(update_types)
+                return
+        
+        logger.warning(f"Unknown handler type {type(handler).__name__}: receiving all update types")
+        allowed.update(Update.ALL_TYPES)
+    
+    for group_handlers in application.handlers.values():
+        for handler in group_handlers:
+            visit(handler)
+    
+    return sorted(allowed)
+
+
+def build_callback_router(handlers: Handlers) -> CallbackRouter:
+    """Таблица маршрутов callback_data -> метод Handlers"""
+    router = CallbackRouter()
+    
+    router.add_exact({
+        # Личный кабинет
+        'dm_back': handlers.show_dm_cabinet,
+        'dm_debts': handlers.show_debts_dm,
+        'dm_history': handlers.show_history_dm,
+        'dm_notifications': handlers.show_notifications_settings,
+        'dm_switch_trip': handlers.show_trip_switch,
+        'debts_i_owe': handlers.show_i_owe,
+        'debts_owe_me': handlers.show_owe_me,
+        'debts_refresh': handlers.show_debts_dm,
+        # Меню группы
+        'show_add_expense_info': handlers.show_add_expense_info,
+        'cancel_delete_trip': handlers.cancel_delete_trip,
+        'show_summary': handlers.show_summary_callback,
+        'show_settlement': handlers.show_settlement,
+        'show_participants': handlers.show_participants_callback,
+        'back_to_menu': handlers.back_to_menu,
+    })
+    
+    # Упакованные кнопки (CallbackData): контекст поездки и долга приходит из кнопки
+    router.add_action('dm_debts', handlers.show_debts_dm, 'chat_id')
+    router.add_action('dm_history', handlers.show_history_dm, 'chat_id')
+    router.add_action('debts_i_owe', handlers.show_i_owe, 'chat_id')
+    router.add_action('debts_owe_me', handlers.show_owe_me, 'chat_id')
+    router.add_action('debts_refresh', handlers.show_debts_dm, 'chat_id')
+    router.add_action('show_debt', handlers.show_debt_detail, 'debt_id', 'chat_id')
+    router.add_action('show_debt_creditor', handlers.show_debt_detail_creditor, 'debt_id', 'chat_id')
+    router.add_action('pay_debt', handlers.pay_debt, 'debt_id')
+    router.add_action('confirm_debt', handlers.confirm_debt_return, 'debt_id')
+    router.add_action('switch_trip', handlers.switch_active_trip, 'chat_id')
+    router.add_action('history_older', handlers.show_history_dm, 'chat_id', 'cursor')
+    router.add_action('history_newer', handlers.show_history_newer, 'chat_id', 'cursor')
+    
+    # Строковые префиксы — для кнопок в уже отправленных сообщениях
+    router.add_prefix('switch_trip_', handlers.switch_active_trip, chat_id=int)
+    router.add_prefix('show_debt_', handlers.show_debt_detail, debt_id=str)
+    router.add_prefix('show_debt_creditor_', handlers.show_debt_detail_creditor, debt_id=str)
+    router.add_prefix('pay_debt_', handlers.pay_debt, debt_id=str)
+    router.add_prefix('confirm_debt_', handlers.confirm_debt_return, debt_id=str)
+    router.add_prefix('confirm_delete_trip_', handlers.confirm_delete_trip, chat_id=int)
+    
+    return router
+
+
+def build_service_server(application: Application):
+    """Служебный HTTP-сервер: /healthz и /metrics (Prometheus)"""
+    server = ServiceHttpServer(SERVICE_HTTP_HOST, SERVICE_HTTP_PORT)
+    started_at = time.monotonic()
+    
+    async def healthz():
+        return ServiceHttpServer.json_response({
+            'status': 'ok' if application.running else 'starting',
+            'mode': BOT_MODE,
+            'uptime_seconds': round(time.monotonic() - started_at, 1),
+            'update_queue_size': application.update_queue.qsize(),
+            'startup_ms': application.bot_data['startup_timer'].as_dict(),
+            'callbacks': application.bot_data['callback_router'].stats(),
+            'trip_cache': Database.get_trip_cache_stats(),
+            'known_members': Database.get_known_members_stats()
+        })
+    
+    async def metrics():
+        UPDATE_QUEUE_SIZE.set(application.update_queue.qsize())
+        AUTODELETE_PENDING.set(application.bot_data['handlers'].autodelete.pending_count())
+        return 200, 'text/plain; version=0.0.4', REGISTRY.render()
+    
+    server.add_route('/healthz', healthz)
+    server.add_route('/metrics', metrics)
+    return server
 
 
 async def post_init(application: Application):
-    """Инициализация после запуска бота"""
-    bot = await application.bot.get_me()
+    """Инициализация после запуска бота: хранилище, служебный сервер, отчёт о времени старта"""
+    timer = application.bot_data.setdefault('startup_timer', StartupTimer(STARTED_AT))
+    # getMe уже выполнен в Application.initialize — данные бота закэшированы
+    timer.mark('initialize')
+    bot = application.bot.bot
     logger.info(f"Bot started: @{bot.username} (ID: {bot.id})")
+    
+    # Хранилище (Firebase, gRPC) создаётся здесь, а не при импорте модулей
+    storage_timings = await AsyncDatabase.init_storage(prewarm=STORAGE_PREWARM)
+    if storage_timings is None:
+        timer.mark('storage_failed')
+        logger.error("Storage is not available: it will be initialized on the first request")
+    else:
+        timer.add(storage_timings)
+    
+    server = application.bot_data.get('service_server')
+    if server:
+        await server.start()
+        timer.mark('service_server')
+    
+    logger.info(f"Startup timing: {timer.report()}")
 
 
-def main():
-    """Запуск бота"""
-    logger.info("Starting TripSplit Bot...")
+async def post_shutdown(application: Application):
+    """Остановка служебных компонентов"""
+    server = application.bot_data.get('service_server')
+    if server:
+        await server.stop()
+
+
+async def error_handler(update: Update, context):
+    """Обработка ошибок С ПОЛНЫМ ЛОГИРОВАНИЕМ"""
+    import traceback
     
-    application = Application.builder().token(BOT_TOKEN).build()
+    # ПОЛНЫЙ traceback в лог
+    logger.error("="*50)
+    logger.error("EXCEPTION CAUGHT!")
+    logger.error(f"Update: {update}")
+    logger.error(f"Error: {context.error}")
+    logger.error("Full traceback:")
+    logger.error(''.join(traceback.format_exception(None, context.error, context.error.__traceback__)))
+    logger.error("="*50)
+    
+    try:
+        if update and update.effective_message:
+            # Отправить ошибку в чат ДЛЯ ОТЛАДКИ
+            error_text = (
+                f"❌ Произошла ошибка:\n\n"
+                f"`{type(context.error).__name__}: {str(context.error)}`\n\n"
+                f"Напишите /help для справки"
+            )
+            await update.effective_message.reply_text(
+                error_text,
+                parse_mode='Markdown'
+            )
+    except Exception as e:
+        logger.error(f"Error in error handler: {e}")
+
+
+def build_application(token: str = BOT_TOKEN, request=None) -> Application:
+    """
+    Приложение со всеми хендлерами, без запуска
+    request — свой BaseRequest для Bot API (бенчмарки подменяют им сеть)
+    """
+    # Запросы хендлеров идут через метрики; long polling getUpdates — мимо,
+    # иначе его ожидание забьёт гистограмму задержек Bot API
+    builder = (
+        Application.builder()
+        .token(token)
+        .concurrent_updates(ChatSequentialUpdateProcessor(CONCURRENT_UPDATES))
+        .request(InstrumentedRequest(request or HTTPXRequest(connection_pool_size=256)))
+    )
+    if request is not None:
+        builder = builder.get_updates_request(request)
+    application = builder.build()
     
     bot_username = "dolgotripbot"
     
     handlers = Handlers(bot_username)
+    instrument_handlers(handlers)
     
     # ============ CONVERSATION HANDLERS ============
     
@@ -69,6 +408,7 @@ def main():
     application.add_handler(CommandHandler('summary', handlers.summary_command))
     application.add_handler(CommandHandler('participants', handlers.participants_command))
     application.add_handler(CommandHandler('deletetrip', handlers.delete_trip_command, filters=filters.ChatType.GROUPS))
+    application.add_handler(CommandHandler('rebuildbalances', handlers.rebuild_balances_command, filters=filters.ChatType.GROUPS))
     
     # ============ CONVERSATION HANDLERS ============
     
@@ -81,7 +421,10 @@ def main():
         pattern='^notif_'
     ))
     
-    application.add_handler(CallbackQueryHandler(handlers.callback_handler))
+    callback_router = build_callback_router(handlers)
+    application.bot_data['handlers'] = handlers
+    application.bot_data['callback_router'] = callback_router
+    application.add_handler(CallbackQueryHandler(callback_router.dispatch))
     
     # ============ TEXT HANDLERS ============
     
@@ -105,49 +448,57 @@ def main():
     
     # ============ ERROR HANDLER (УЛУЧШЕННЫЙ!) ============
     
-    async def error_handler(update: Update, context):
-        """Обработка ошибок С ПОЛНЫМ ЛОГИРОВАНИЕМ"""
-        import traceback
-        
-        # ПОЛНЫЙ traceback в лог
-        logger.error("="*50)
-        logger.error("EXCEPTION CAUGHT!")
-        logger.error(f"Update: {update}")
-        logger.error(f"Error: {context.error}")
-        logger.error("Full traceback:")
-        logger.error(''.join(traceback.format_exception(None, context.error, context.error.__traceback__)))
-        logger.error("="*50)
-        
-        try:
-            if update and update.effective_message:
-                # Отправить ошибку в чат ДЛЯ ОТЛАДКИ
-                error_text = (
-                    f"❌ Произошла ошибка:\n\n"
-                    f"`{type(context.error).__name__}: {str(context.error)}`\n\n"
-                    f"Напишите /help для справки"
-                )
-                await update.effective_message.reply_text(
-                    error_text,
-                    parse_mode='Markdown'
-                )
-        except Exception as e:
-            logger.error(f"Error in error handler: {e}")
-    
     application.add_error_handler(error_handler)
     
+    # ============ АВТОУДАЛЕНИЕ СООБЩЕНИЙ ============
+    
+    handlers.autodelete.attach(application)
+    
     # ============ POST INIT ============
     
     application.post_init = post_init
+    application.post_shutdown = post_shutdown
+    
+    return application
+
+
+def main():
+    """Запуск бота"""
+    logger.info("Starting TripSplit Bot...")
+    timer = StartupTimer(STARTED_AT)
+    timer.mark('imports')
+    
+    application = build_application()
+    timer.mark('build')
+    application.bot_data['startup_timer'] = timer
+    
+    if SERVICE_HTTP_PORT:
+        application.bot_data['service_server'] = build_service_server(application)
     
     # ============ ЗАПУСК БОТА ============
     
-    logger.info("Bot handlers configured. Starting polling...")
+    allowed_updates = collect_allowed_updates(application)
+    logger.info(f"Bot handlers configured. Mode: {BOT_MODE}, allowed updates: {allowed_updates}")
     
     try:
-        application.run_polling(
-            allowed_updates=Update.ALL_TYPES,
-            drop_pending_updates=True
-        )
+        if BOT_MODE == 'webhook':
+            if not WEBHOOK_URL:
+                raise ValueError("WEBHOOK_URL is required in webhook mode")
+            
+            application.run_webhook(
+                listen=WEBHOOK_LISTEN,
+                port=WEBHOOK_PORT,
+                url_path=WEBHOOK_PATH,
+                webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+                secret_token=WEBHOOK_SECRET_TOKEN or secrets.token_urlsafe(32),
+                allowed_updates=allowed_updates,
+                drop_pending_updates=True
+            )
+        else:
+            application.run_polling(
+                allowed_updates=allowed_updates,
+                drop_pending_updates=True
+            )
     except KeyboardInterrupt:
         logger.info("Bot stopped by user")
     except Exception as e:
@@ -0,0 +1,183 @@
+import base64
+
+# Префикс упакованного callback_data (в старых строковых ключах не встречается)
+MARKER = '~'
+VERSION = 1
+
+# Коды действий — только дописывать в конец, иначе сломаются кнопки в уже отправленных сообщениях
+ACTIONS = (
+    'dm_debts',
+    'dm_history',
+    'debts_i_owe',
+    'debts_owe_me',
+    'debts_refresh',
+    'show_debt',
+    'show_debt_creditor',
+    'pay_debt',
+    'confirm_debt',
+    'switch_trip',
+    'history_older',
+    'history_newer',
+)
+ACTION_CODES = {action: code for code, action in enumerate(ACTIONS)}
+
+# Флаги в младших битах заголовка
+FLAG_CHAT = 0x1
+FLAG_DEBT = 0x2
+FLAG_DEBT_B62 = 0x4
+FLAG_CURSOR = 0x8
+
+# Автоматические ID Firestore: 20 символов [A-Za-z0-9] -> 15 байт (62**20 < 2**120)
+B62_ALPHABET = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789'
+B62_INDEX = {char: i for i, char in enumerate(B62_ALPHABET)}
+B62_LENGTH = 20
+B62_BYTES = 15
+
+# Лимит Telegram на callback_data
+MAX_LENGTH = 64
+
+
+class CallbackData:
+    """
+    Компактный callback_data с контекстом кнопки: действие, chat_id поездки, курсор, ID долга
+
+    Формат: MARKER + base64url(заголовок | действие | chat_id varint | курсор | ссылка на долг).
+    Курсор страницы истории — (микросекунды varint, ID документа).
+    Заголовок — версия (старшие 4 бита) и флаги полей. Кнопка долга занимает
+    ~32 символа вместо 39 у 'show_debt_creditor_<id>' и уже несёт chat_id,
+    поэтому хендлеру не нужно искать активную поездку пользователя.
+    """
+
+    @staticmethod
+    def encode(action: str, chat_id: int = None, debt_id: str = None, cursor: tuple = None) -> str:
+        header = VERSION << 4
+        body = bytearray([ACTION_CODES[action]])
+
+        if chat_id is not None:
+            header |= FLAG_CHAT
+            CallbackData._write_varint(body, (chat_id << 1) ^ (chat_id >> 63))
+
+        if cursor is not None:
+            header |= FLAG_CURSOR
+            micros, doc_id = cursor
+            CallbackData._write_varint(body, micros)
+            # Длина ссылки и признак base62 в одном varint
+            is_b62 = CallbackData._is_b62_id(doc_id)
+            ref = CallbackData._pack_b62(doc_id) if is_b62 else doc_id.encode('utf-8')
+            CallbackData._write_varint(body, (len(ref) << 1) | is_b62)
+            body += ref
+
+        if debt_id is not None:
+            header |= FLAG_DEBT
+            if CallbackData._is_b62_id(debt_id):
+                header |= FLAG_DEBT_B62
+                body += CallbackData._pack_b62(debt_id)
+            else:
+                body += debt_id.encode('utf-8')
+
+        data = MARKER + base64.urlsafe_b64encode(bytes([header]) + body).rstrip(b'=').decode('ascii')
+        if len(data) > MAX_LENGTH:
+            raise ValueError(f"callback_data for {action} is too long ({len(data)} bytes)")
+        return data
+
+    @staticmethod
+    def is_packed(data: str) -> bool:
+        return data.startswith(MARKER)
+
+    @staticmethod
+    def decode(data: str):
+        """
+        Разобрать упакованный callback_data
+        Возвращает (action, {'chat_id': ..., 'cursor': ..., 'debt_id': ...}) — только присутствующие поля;
+        ValueError, если данные повреждены или версия неизвестна
+        """
+        payload = data[len(MARKER):]
+        try:
+            raw = base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4))
+        except (ValueError, TypeError) as e:
+            raise ValueError(f"Bad callback payload: {e}")
+
+        if len(raw) < 2:
+            raise ValueError("Callback payload is too short")
+
+        header, code = raw[0], raw[1]
+        if header >> 4 != VERSION:
+            raise ValueError(f"Unsupported callback version {header >> 4}")
+        if code >= len(ACTIONS):
+            raise ValueError(f"Unknown callback action {code}")
+
+        fields = {}
+        position = 2
+
+        if header & FLAG_CHAT:
+            value, position = CallbackData._read_varint(raw, position)
+            fields['chat_id'] = (value >> 1) ^ -(value & 1)
+
+        if header & FLAG_CURSOR:
+            micros, position = CallbackData._read_varint(raw, position)
+            value, position = CallbackData._read_varint(raw, position)
+            length = value >> 1
+            ref = raw[position:position + length]
+            if len(ref) != length:
+                raise ValueError("Truncated cursor")
+            position += length
+            if value & 1:
+                if length != B62_BYTES:
+                    raise ValueError("Bad cursor reference")
+                doc_id = CallbackData._unpack_b62(ref)
+            else:
+                doc_id = ref.decode('utf-8')
+            fields['cursor'] = (micros, doc_id)
+
+        if header & FLAG_DEBT:
+            ref = raw[position:]
+            if header & FLAG_DEBT_B62:
+                if len(ref) != B62_BYTES:
+                    raise ValueError("Bad debt reference")
+                fields['debt_id'] = CallbackData._unpack_b62(ref)
+            else:
+                fields['debt_id'] = ref.decode('utf-8')
+
+        return ACTIONS[code], fields
+
+    @staticmethod
+    def _is_b62_id(value: str) -> bool:
+        return len(value) == B62_LENGTH and all(char in B62_INDEX for char in value)
+
+    @staticmethod
+    def _pack_b62(value: str) -> bytes:
+        number = 0
+        for char in value:
+            number = number * 62 + B62_INDEX[char]
+        return number.to_bytes(B62_BYTES, 'big')
+
+    @staticmethod
+    def _unpack_b62(ref: bytes) -> str:
+        number = int.from_bytes(ref, 'big')
+        if number >= 62 ** B62_LENGTH:
+            raise ValueError("Bad base62 reference")
+        chars = []
+        for _ in range(B62_LENGTH):
+            number, index = divmod(number, 62)
+            chars.append(B62_ALPHABET[index])
+        return ''.join(reversed(chars))
+
+    @staticmethod
+    def _write_varint(buffer: bytearray, value: int):
+        while value >= 0x80:
+            buffer.append((value & 0x7F) | 0x80)
+            value >>= 7
+        buffer.append(value)
+
+    @staticmethod
+    def _read_varint(raw: bytes, position: int):
+        value, shift = 0, 0
+        while True:
+            if position >= len(raw):
+                raise ValueError("Truncated varint")
+            byte = raw[position]
+            position += 1
+            value |= (byte & 0x7F) << shift
+            if not byte & 0x80:
+                return value, position
+            shift += 7
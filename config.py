@@ -7,10 +7,72 @@ load_dotenv()
 
 BOT_TOKEN = os.getenv('BOT_TOKEN', '8287466021:AAHsTS7NKl3KirUrk82Q5tIrURd_oIu7srk')
 
+# Режим получения апдейтов: 'polling' или 'webhook'
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+
+# ============ WEBHOOK ============
+
+# Публичный адрес, на который Telegram шлёт апдейты (например, https://bot.example.com)
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', 'telegram')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', os.getenv('PORT', '8443')))
+# Если не задан, генерируется при каждом запуске (вебхук всё равно переустанавливается)
+WEBHOOK_SECRET_TOKEN = os.getenv('WEBHOOK_SECRET_TOKEN', '')
+
+# ============ SERVICE HTTP (health, metrics) ============
+
+# Локальный служебный HTTP-сервер; порт 0 — выключен
+SERVICE_HTTP_HOST = os.getenv('SERVICE_HTTP_HOST', '127.0.0.1')
+SERVICE_HTTP_PORT = int(os.getenv('SERVICE_HTTP_PORT', '8081'))
+
+# ============ LOGGING ============
+
+# Уровень логов модуля handlers (DEBUG — все действия пользователей)
+HANDLERS_LOG_LEVEL = os.getenv('HANDLERS_LOG_LEVEL', 'INFO')
+
+# ============ STORAGE ============
+
+# Хранилище: 'firestore' или 'sqlite' (один сервер, без облака)
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'firestore')
+
+# Файл базы SQLite; ':memory:' — в памяти процесса
+SQLITE_PATH = os.getenv('SQLITE_PATH', 'tripsplit.db')
+
+# Открыть соединение с хранилищем при старте (иначе его установку оплатит первый апдейт)
+STORAGE_PREWARM = os.getenv('STORAGE_PREWARM', '1') == '1'
+
 # ============ FIREBASE ============
 
 FIREBASE_CREDENTIALS_PATH = 'firebase_key.json'
 
+# Размер пула потоков для синхронных вызовов хранилища
+DB_MAX_WORKERS = int(os.getenv('DB_MAX_WORKERS', '16'))
+
+# Время жизни кэша документа поездки (секунды)
+TRIP_CACHE_TTL = float(os.getenv('TRIP_CACHE_TTL', '10'))
+
+# Известные участники чатов: их сообщения не обращаются к хранилищу (секунды, размер)
+KNOWN_MEMBER_TTL = float(os.getenv('KNOWN_MEMBER_TTL', '3600'))
+KNOWN_MEMBERS_CACHE_SIZE = int(os.getenv('KNOWN_MEMBERS_CACHE_SIZE', '50000'))
+
+# Сколько пользователей помнить в кэше связей user_trips (связанные поездки)
+LINKED_TRIPS_CACHE_SIZE = int(os.getenv('LINKED_TRIPS_CACHE_SIZE', '50000'))
+
+# Сколько групп долгов держать в LRU метаданных (описание/категория/валюта)
+GROUP_INFO_CACHE_SIZE = int(os.getenv('GROUP_INFO_CACHE_SIZE', '2048'))
+
+# Событий на странице истории в личке (каждая страница читает O(размера) документов)
+HISTORY_PAGE_SIZE = int(os.getenv('HISTORY_PAGE_SIZE', '15'))
+
+# Сколько батчей (по 500 операций) коммитить параллельно при массовом удалении
+BULK_WRITE_CONCURRENCY = int(os.getenv('BULK_WRITE_CONCURRENCY', '8'))
+
+# ============ UPDATES ============
+
+# Сколько апдейтов обрабатывать одновременно (внутри одного чата — по очереди)
+CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES', '64'))
+
 # ============ CURRENCIES ============
 
 CURRENCIES = ['EUR', 'USD', 'RUB', 'THB', 'GEL', 'TRY', 'CNY']
@@ -18,6 +80,11 @@ DEFAULT_CURRENCY = 'EUR'
 
 # ============ NOTIFICATIONS ============
 
+# Лимиты Telegram: сообщений в секунду на бота и интервал между сообщениями в один чат
+TELEGRAM_GLOBAL_RATE = float(os.getenv('TELEGRAM_GLOBAL_RATE', '30'))
+TELEGRAM_PER_CHAT_INTERVAL = float(os.getenv('TELEGRAM_PER_CHAT_INTERVAL', '1'))
+NOTIFY_MAX_RETRIES = int(os.getenv('NOTIFY_MAX_RETRIES', '3'))
+
 NOTIFICATION_ALL = 'all'
 NOTIFICATION_OFF = 'off'
 
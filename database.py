@@ -1,45 +1,248 @@
-import firebase_admin
-from firebase_admin import credentials, firestore
-from datetime import datetime
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+import asyncio
+import functools
+import heapq
+import itertools
 import logging
-import json
-import os
+import threading
+import time
+
+from config import (
+    DB_MAX_WORKERS,
+    TRIP_CACHE_TTL,
+    GROUP_INFO_CACHE_SIZE,
+    HISTORY_PAGE_SIZE,
+    KNOWN_MEMBER_TTL,
+    KNOWN_MEMBERS_CACHE_SIZE,
+    LINKED_TRIPS_CACHE_SIZE,
+)
+from metrics import DB_LATENCY, DB_ERRORS, STORAGE_READS_AVOIDED, STORAGE_WRITES_AVOIDED, instrument_static_methods
+from storage import get_backend
 
 logger = logging.getLogger(__name__)
 
-def initialize_firebase():
-    """Безопасная инициализация Firebase"""
-    if firebase_admin._apps:
-        logger.info("Firebase already initialized")
-        return firestore.client()
+
+class TripCache:
+    """Короткоживущий write-through кэш поездок (trips/{chat_id})
     
-    firebase_creds = os.getenv('FIREBASE_CREDENTIALS')
+    Один апдейт обычно читает поездку несколько раз (add_participant,
+    get_trip, get_participants) — кэш сводит это к одному чтению.
+    Отсутствие поездки тоже кэшируется, чтобы обычные сообщения в чатах
+    без поездки не ходили в хранилище каждый раз.
+    """
     
-    if firebase_creds:
-        try:
-            cred_dict = json.loads(firebase_creds)
-            cred = credentials.Certificate(cred_dict)
-            logger.info("Firebase credentials loaded from environment variable")
-        except json.JSONDecodeError as e:
-            logger.error(f"Failed to parse FIREBASE_CREDENTIALS: {e}")
-            raise
-    else:
-        try:
-            cred = credentials.Certificate('firebase_key.json')
-            logger.info("Firebase credentials loaded from local file")
-        except FileNotFoundError:
-            logger.error("Firebase credentials not found. Set FIREBASE_CREDENTIALS environment variable.")
-            raise
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._items = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, chat_id: int):
+        """Вернуть (найдено, поездка); поездка может быть None"""
+        with self._lock:
+            item = self._items.get(chat_id)
+            if item is None or item[0] < time.monotonic():
+                self.misses += 1
+                return False, None
+            self.hits += 1
+            STORAGE_READS_AVOIDED.inc(reason='trip_cache')
+            return True, self.snapshot(item[1])
+    
+    def put(self, chat_id: int, trip):
+        with self._lock:
+            self._items[chat_id] = (time.monotonic() + self.ttl, self.snapshot(trip))
+    
+    def invalidate(self, chat_id: int):
+        with self._lock:
+            self._items.pop(chat_id, None)
+    
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
+    
+    def put_participant(self, chat_id: int, participant: dict):
+        """Добавить или обновить участника в закэшированной поездке (атомарно для потоков)"""
+        with self._lock:
+            item = self._items.get(chat_id)
+            if item is None or item[1] is None:
+                return
+            trip = item[1]
+            user_id = participant['user_id']
+            current = trip['participants_by_id'].get(user_id)
+            if current is None:
+                trip['participants'].append(participant)
+            else:
+                participant = {**current, **participant}
+                trip['participants'] = [
+                    participant if p['user_id'] == user_id else p
+                    for p in trip['participants']
+                ]
+            trip['participants_by_id'][user_id] = participant
     
-    firebase_admin.initialize_app(cred)
-    logger.info("Firebase initialized successfully")
-    return firestore.client()
+    @staticmethod
+    def snapshot(trip):
+        """Копия поездки: свой список участников и индекс participants_by_id {user_id: участник}"""
+        if trip is None:
+            return None
+        trip = dict(trip)
+        trip['participants'] = list(trip.get('participants', []))
+        trip['participants_by_id'] = {p['user_id']: p for p in trip['participants']}
+        return trip
+
+
+trip_cache = TripCache(TRIP_CACHE_TTL)
+
 
-db = initialize_firebase()
+# Начало отсчёта курсоров истории (микросекунды)
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# Поля группы долгов, которые не меняются после создания
+GROUP_INFO_FIELDS = ('description', 'category', 'currency')
+
+
+class GroupInfoCache:
+    """LRU неизменяемых метаданных групп долгов (описание, категория, валюта)"""
+    
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, debt_group_id: str):
+        with self._lock:
+            info = self._items.get(debt_group_id)
+            if info is not None:
+                self._items.move_to_end(debt_group_id)
+                return dict(info)
+            return None
+    
+    def put(self, debt_group_id: str, group_data: dict):
+        info = {field: group_data[field] for field in GROUP_INFO_FIELDS if field in group_data}
+        with self._lock:
+            self._items[debt_group_id] = info
+            self._items.move_to_end(debt_group_id)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+
+group_info_cache = GroupInfoCache(GROUP_INFO_CACHE_SIZE)
+
+
+class KnownMembersCache:
+    """Участники, уже записанные в поездку чата: (chat_id, user_id) -> отпечаток имени
+    
+    Сообщение известного участника с прежним именем ничего не меняет в хранилище,
+    поэтому хендлер пропускает add_participant и link_user_to_trip (а без этого
+    каждая реплика в чате — запись user_trips). Новый участник, смена имени или
+    истёкший TTL — обычный путь через хранилище.
+    """
+    
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def fingerprint(username: str, first_name: str) -> int:
+        return hash((username or '', first_name or ''))
+    
+    def is_known(self, chat_id: int, user_id: int, username: str, first_name: str) -> bool:
+        key = (chat_id, user_id)
+        with self._lock:
+            item = self._items.get(key)
+            if item is None or item[0] < time.monotonic() or item[1] != self.fingerprint(username, first_name):
+                self.misses += 1
+                return False
+            self._items.move_to_end(key)
+            self.hits += 1
+        STORAGE_WRITES_AVOIDED.inc(reason='known_member')
+        return True
+    
+    def remember(self, chat_id: int, user_id: int, username: str, first_name: str):
+        key = (chat_id, user_id)
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl, self.fingerprint(username, first_name))
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+    
+    def forget_chat(self, chat_id: int):
+        with self._lock:
+            for key in [key for key in self._items if key[0] == chat_id]:
+                del self._items[key]
+    
+    def stats(self):
+        with self._lock:
+            # Каждое попадание — несостоявшаяся запись user_trips
+            return {'size': len(self._items), 'hits': self.hits, 'misses': self.misses,
+                    'writes_avoided': self.hits}
+
+
+known_members = KnownMembersCache(KNOWN_MEMBER_TTL, KNOWN_MEMBERS_CACHE_SIZE)
+
+
+class LinkedTripsCache:
+    """Подтверждённые связи user_trips: user_id -> {chat_id}
+    
+    Пользователь попадает сюда только вместе с поездкой из его списка, а значит,
+    активная поездка у него уже есть. Для известной пары link_user_to_trip ничего
+    не делает, для известного пользователя — пишет вслепую, без транзакции.
+    Связи исчезают только при удалении поездки (forget_chat).
+    """
+    
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def is_linked(self, user_id: int, chat_id: int) -> bool:
+        with self._lock:
+            trips = self._items.get(user_id)
+            if trips is None or chat_id not in trips:
+                return False
+            self._items.move_to_end(user_id)
+            return True
+    
+    def has_active_trip(self, user_id: int) -> bool:
+        with self._lock:
+            return user_id in self._items
+    
+    def remember(self, user_id: int, chat_ids):
+        with self._lock:
+            self._items.setdefault(user_id, set()).update(chat_ids)
+            self._items.move_to_end(user_id)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+    
+    def remember_user_trips(self, user_id: int, data: dict):
+        """Документ user_trips из хранилища: связи известны, если есть активная поездка"""
+        if data and data.get('active_trip'):
+            self.remember(user_id, [data['active_trip'], *data.get('trips', [])])
+    
+    def forget_chat(self, chat_id: int):
+        # Без поездки активной может стать любая (или никакая) — такие пользователи забываются
+        with self._lock:
+            for user_id in [user_id for user_id, trips in self._items.items() if chat_id in trips]:
+                del self._items[user_id]
+
+
+linked_trips = LinkedTripsCache(LINKED_TRIPS_CACHE_SIZE)
+
+
+# ============ BALANCES ============
+
+# Остаток меньше этой суммы считается погашенным (погрешность float-инкрементов)
+BALANCE_EPSILON = 0.005
 
 
 class Database:
-    """Класс для работы с Firebase Firestore"""
+    """Класс для работы с хранилищем (backend выбирается в storage.get_backend)"""
     
     @staticmethod
     def create_trip(chat_id: int, name: str, currency: str, creator_id: int):
@@ -52,10 +255,12 @@ class Database:
                 'creator_id': creator_id,
                 'created_at': datetime.now(),
                 'participants': [],
-                'is_active': True
+                'is_active': True,
+                'event_log': True
             }
-            doc_ref = db.collection('trips').document(str(chat_id))
-            doc_ref.set(trip_data)
+            get_backend().create_trip(trip_data)
+            trip_cache.put(chat_id, trip_data)
+            known_members.forget_chat(chat_id)
             logger.info(f"Created trip '{name}' for chat {chat_id}")
             return trip_data
         except Exception as e:
@@ -65,47 +270,85 @@ class Database:
     @staticmethod
     def get_trip(chat_id: int):
         """Получить поездку по chat_id"""
+        found, trip = trip_cache.get(chat_id)
+        if found:
+            return trip
+        
         try:
-            doc = db.collection('trips').document(str(chat_id)).get()
-            if doc.exists:
-                return doc.to_dict()
-            return None
+            trip = get_backend().get_trip(chat_id)
+            trip_cache.put(chat_id, trip)
+            return TripCache.snapshot(trip)
         except Exception as e:
             logger.error(f"Error getting trip {chat_id}: {e}")
             return None
     
+    @staticmethod
+    def get_trips_bulk(chat_ids: list):
+        """
+        Несколько поездок: из кэша, остальные — одним запросом к хранилищу
+        Возвращает {chat_id: поездка} только для существующих поездок
+        """
+        result = {}
+        missing = []
+        for chat_id in dict.fromkeys(chat_ids):
+            found, trip = trip_cache.get(chat_id)
+            if not found:
+                missing.append(chat_id)
+            elif trip:
+                result[chat_id] = trip
+        
+        if not missing:
+            return result
+        
+        try:
+            trips = get_backend().get_trips(missing)
+        except Exception as e:
+            logger.error(f"Error getting trips {missing}: {e}")
+            return result
+        
+        for chat_id in missing:
+            trip = trips.get(chat_id)
+            trip_cache.put(chat_id, trip)
+            if trip:
+                result[chat_id] = TripCache.snapshot(trip)
+        return result
+    
     @staticmethod
     def add_participant(chat_id: int, user_id: int, username: str, first_name: str):
-        """Добавить участника в поездку"""
+        """
+        Добавить участника в поездку или обновить его имя
+        Участник ищется по user_id; запись — только его полей, без чтения поездки
+        """
         try:
-            trip_ref = db.collection('trips').document(str(chat_id))
-            trip = trip_ref.get()
+            trip = Database.get_trip(chat_id)
             
-            if trip.exists:
-                participants = trip.to_dict().get('participants', [])
-                
-                if not any(p['user_id'] == user_id for p in participants):
-                    participants.append({
-                        'user_id': user_id,
-                        'username': username or '',
-                        'first_name': first_name,
-                        'joined_at': datetime.now()
-                    })
-                    trip_ref.update({'participants': participants})
-                    logger.info(f"Added participant @{username or user_id} to trip {chat_id}")
-                    return True
-                else:
-                    for p in participants:
-                        if p['user_id'] == user_id:
-                            if p.get('username') != username or p.get('first_name') != first_name:
-                                p['username'] = username or ''
-                                p['first_name'] = first_name
-                                trip_ref.update({'participants': participants})
-                                logger.info(f"Updated participant info for {user_id}")
-                            break
-                    return True
-            return False
+            if not trip:
+                return False
+            
+            current = trip['participants_by_id'].get(user_id)
+            
+            if current is None:
+                participant = {
+                    'user_id': user_id,
+                    'username': username or '',
+                    'first_name': first_name,
+                    'joined_at': datetime.now()
+                }
+                get_backend().save_participant(chat_id, participant)
+                trip_cache.put_participant(chat_id, participant)
+                logger.info(f"Added participant @{username or user_id} to trip {chat_id}")
+            elif current.get('username') != (username or '') or current.get('first_name') != first_name:
+                participant = {
+                    'user_id': user_id,
+                    'username': username or '',
+                    'first_name': first_name
+                }
+                get_backend().save_participant(chat_id, participant)
+                trip_cache.put_participant(chat_id, participant)
+                logger.info(f"Updated participant info for {user_id}")
+            return True
         except Exception as e:
+            trip_cache.invalidate(chat_id)
             logger.error(f"Error adding participant: {e}")
             return False
     
@@ -118,8 +361,8 @@ class Database:
         return []
     
     @staticmethod
-    def create_debt(chat_id: int, amount: float, payer_id: int, 
-                    participants: list, description: str = '', 
+    def create_debt(chat_id: int, amount: float, payer_id: int,
+                    participants: list, description: str = '',
                     category: str = '💸', currency: str = None):
         """
         Создать долг с валютой
@@ -158,13 +401,8 @@ class Database:
                 'is_deleted': False
             }
             
-            debt_group_ref = db.collection('debt_groups').add(debt_group_data)
-            debt_group_id = debt_group_ref[1].id
-            
-            individual_debts = []
-            for debtor_id in debtors:
-                debt_data = {
-                    'debt_group_id': debt_group_id,
+            debts = [
+                {
                     'chat_id': chat_id,
                     'debtor_id': debtor_id,
                     'creditor_id': payer_id,
@@ -174,9 +412,15 @@ class Database:
                     'paid_at': None,
                     'created_at': datetime.now()
                 }
-                debt_ref = db.collection('debts').add(debt_data)
-                debt_data['id'] = debt_ref[1].id
-                individual_debts.append(debt_data)
+                for debtor_id in debtors
+            ]
+            
+            # Группа, долги и баланс пишутся атомарно
+            debt_group_id, debt_ids = get_backend().create_debt_group(debt_group_data, debts)
+            individual_debts = [
+                dict(debt, id=debt_id, debt_group_id=debt_group_id)
+                for debt, debt_id in zip(debts, debt_ids)
+            ]
             
             logger.info(
                 f"Created debt group {debt_group_id}: "
@@ -189,7 +433,7 @@ class Database:
                 'debts': individual_debts,
                 'group_data': debt_group_data
             }
-            
+        
         except Exception as e:
             logger.error(f"Error creating debt: {e}")
             return None
@@ -198,103 +442,135 @@ class Database:
     def get_debt_groups(chat_id: int):
         """Получить все группы долгов поездки (сортировка по дате)"""
         try:
-            debt_groups = db.collection('debt_groups')\
-                .where('chat_id', '==', chat_id)\
-                .where('is_deleted', '==', False)\
-                .order_by('created_at', direction=firestore.Query.DESCENDING)\
-                .stream()
-            
-            result = []
-            for dg in debt_groups:
-                data = dg.to_dict()
-                data['id'] = dg.id
-                result.append(data)
-            return result
+            return get_backend().get_debt_groups(chat_id)
         except Exception as e:
             logger.error(f"Error getting debt groups: {e}")
             return []
     
     @staticmethod
     def get_history_events(chat_id: int, limit: int = 50):
+        """Последние limit событий истории (первая страница get_history_page)"""
+        page = Database.get_history_page(chat_id, limit=limit)
+        return page['events'] if page else []
+    
+    @staticmethod
+    def get_history_page(chat_id: int, cursor: tuple = None, newer: bool = False,
+                         limit: int = HISTORY_PAGE_SIZE):
         """
-        Получить историю ВСЕХ событий (создание + погашение долгов)
-        Как банковская выписка
+        Страница истории событий поездки, новые сверху — как банковская выписка
+        Читается limit + 1 записей журнала событий после курсора — O(limit) документов.
+        У старых поездок без журнала группы и погашенные долги читаются так же
+        и сливаются кучей.
+        cursor — (микросекунды, id) крайнего события соседней страницы,
+        newer — листать к более новым событиям.
+        Возвращает {'events': [...], 'older': курсор или None, 'newer': курсор или None}
         """
         try:
-            events = []
-            
-            # 1. Получаем все debt_groups (создание долгов)
-            debt_groups = db.collection('debt_groups')\
-                .where('chat_id', '==', chat_id)\
-                .where('is_deleted', '==', False)\
-                .stream()
-            
-            for dg in debt_groups:
-                data = dg.to_dict()
-                events.append({
-                    'type': 'debt_created',
-                    'timestamp': data['created_at'],
-                    'debt_group_id': dg.id,
-                    'payer_id': data['payer_id'],
-                    'total_amount': data['total_amount'],
-                    'currency': data.get('currency', 'EUR'),  # ВАЛЮТА!
-                    'description': data.get('description', 'Долг'),
-                    'category': data.get('category', '💸'),
-                    'participants': data['all_participants']
-                })
-            
-            # 2. Получаем все погашенные долги (события погашения)
-            paid_debts = db.collection('debts')\
-                .where('chat_id', '==', chat_id)\
-                .where('is_paid', '==', True)\
-                .stream()
+            backend = get_backend()
+            after = None
+            if cursor is not None:
+                after = (EPOCH + timedelta(microseconds=cursor[0]), cursor[1])
             
-            for debt in paid_debts:
-                data = debt.to_dict()
-                if data.get('paid_at'):
-                    # Получаем инфу о debt_group
-                    debt_group = db.collection('debt_groups').document(data['debt_group_id']).get()
-                    if debt_group.exists:
-                        dg_data = debt_group.to_dict()
-                        events.append({
-                            'type': 'debt_paid',
-                            'timestamp': data['paid_at'],
-                            'debt_id': debt.id,
-                            'debtor_id': data['debtor_id'],
-                            'creditor_id': data['creditor_id'],
-                            'amount': data['amount'],
-                            'currency': data.get('currency', dg_data.get('currency', 'EUR')),  # ВАЛЮТА!
-                            'description': dg_data.get('description', 'Долг'),
-                            'category': dg_data.get('category', '💸')
-                        })
+            trip = Database.get_trip(chat_id)
+            if trip and trip.get('event_log'):
+                # Журнал trips/{chat_id}/events — одна упорядоченная выборка
+                events = [
+                    Database._log_event(data)
+                    for data in backend.get_events_page(chat_id, limit + 1, after, newer)
+                ]
+                for event in events:
+                    if event['type'] == 'debt_created':
+                        group_info_cache.put(event['debt_group_id'], event)
+            else:
+                # Поездки, созданные до журнала: создание и погашения сливаются из двух источников
+                groups = backend.get_debt_groups_page(chat_id, limit + 1, after, newer)
+                paid_debts = backend.get_paid_debts_page(chat_id, limit + 1, after, newer)
+                for data in groups:
+                    group_info_cache.put(data['id'], data)
+                
+                created_events = (Database._debt_created_event(data) for data in groups)
+                paid_events = (Database._debt_paid_event(data) for data in paid_debts)
+                merged = heapq.merge(created_events, paid_events, key=Database._history_key, reverse=not newer)
+                events = list(itertools.islice(merged, limit + 1))
             
-            # 3. Сортируем все события по времени (новые сверху)
-            events.sort(key=lambda x: x['timestamp'], reverse=True)
+            has_more = len(events) > limit
+            if cursor is not None and len(events) < limit and (newer or not events):
+                # Дошли до края (или курсор устарел) — показываем первую страницу целиком
+                return Database.get_history_page(chat_id, limit=limit)
+            events = events[:limit]
+            if newer:
+                events.reverse()
             
-            # 4. Ограничиваем количество
-            return events[:limit]
+            # Описание и категория погашенных долгов — из LRU групп, недостающие одним запросом
+            paid_on_page = [event for event in events if event['type'] == 'debt_paid']
+            for event in Database.hydrate_group_info(paid_on_page):
+                info = event.pop('group_info')
+                event['currency'] = event['currency'] or info.get('currency', 'EUR')
+                event['description'] = info.get('description', 'Долг')
+                event['category'] = info.get('category', '💸')
             
+            if not events:
+                return {'events': [], 'older': None, 'newer': None}
+            first, last = Database._history_key(events[0]), Database._history_key(events[-1])
+            return {
+                'events': events,
+                'older': last if has_more or newer else None,
+                'newer': first if cursor is not None and (has_more or not newer) else None
+            }
+        
         except Exception as e:
-            logger.error(f"Error getting history events: {e}")
-            return []
+            logger.error(f"Error getting history page: {e}")
+            return None
+    
+    @staticmethod
+    def _history_key(event: dict):
+        """Ключ сортировки и курсор события: (микросекунды, id документа)"""
+        return round(event['timestamp'].timestamp() * 1_000_000), event['id']
+    
+    @staticmethod
+    def _log_event(data: dict):
+        """Событие журнала -> событие истории"""
+        event = dict(data, timestamp=data['created_at'])
+        if event['type'] in ('debt_created', 'debt_deleted'):
+            event['description'] = event.get('description') or 'Долг'
+            event['category'] = event.get('category') or '💸'
+        return event
+    
+    @staticmethod
+    def _debt_created_event(data: dict):
+        return {
+            'type': 'debt_created',
+            'id': data['id'],
+            'timestamp': data['created_at'],
+            'debt_group_id': data['id'],
+            'payer_id': data['payer_id'],
+            'total_amount': data['total_amount'],
+            'currency': data.get('currency', 'EUR'),  # ВАЛЮТА!
+            'description': data.get('description', 'Долг'),
+            'category': data.get('category', '💸'),
+            'participants': data['all_participants']
+        }
+    
+    @staticmethod
+    def _debt_paid_event(data: dict):
+        """Описание и категория дописываются из группы после выбора страницы"""
+        return {
+            'type': 'debt_paid',
+            'id': data['id'],
+            'timestamp': data['paid_at'],
+            'debt_id': data['id'],
+            'debt_group_id': data['debt_group_id'],
+            'debtor_id': data['debtor_id'],
+            'creditor_id': data['creditor_id'],
+            'amount': data['amount'],
+            'currency': data.get('currency')  # ВАЛЮТА!
+        }
     
     @staticmethod
     def get_individual_debts(chat_id: int, user_id: int = None):
         """Получить индивидуальные долги"""
         try:
-            query = db.collection('debts').where('chat_id', '==', chat_id)
-            
-            if user_id:
-                query = query.where('debtor_id', '==', user_id)
-            
-            debts = query.order_by('created_at', direction=firestore.Query.DESCENDING).stream()
-            
-            result = []
-            for debt in debts:
-                data = debt.to_dict()
-                data['id'] = debt.id
-                result.append(data)
-            return result
+            return get_backend().query_debts(chat_id, debtor_id=user_id or None, newest_first=True)
         except Exception as e:
             logger.error(f"Error getting individual debts: {e}")
             return []
@@ -303,37 +579,41 @@ class Database:
     def get_debts_to_user(chat_id: int, user_id: int):
         """Получить долги, где user_id - кредитор"""
         try:
-            debts = db.collection('debts')\
-                .where('chat_id', '==', chat_id)\
-                .where('creditor_id', '==', user_id)\
-                .where('is_paid', '==', False)\
-                .stream()
-            
-            result = []
-            for debt in debts:
-                data = debt.to_dict()
-                data['id'] = debt.id
-                result.append(data)
-            return result
+            return get_backend().query_debts(chat_id, creditor_id=user_id, is_paid=False)
         except Exception as e:
             logger.error(f"Error getting debts to user: {e}")
             return []
     
     @staticmethod
-    def mark_debt_paid(debt_id: str):
-        """Отметить долг как возвращенный"""
+    def get_debt(debt_id: str):
+        """Получить индивидуальный долг по id"""
         try:
-            debt_ref = db.collection('debts').document(debt_id)
-            debt_ref.update({
-                'is_paid': True,
-                'paid_at': datetime.now()
-            })
-            logger.info(f"Marked debt {debt_id} as paid")
-            
-            debt = debt_ref.get()
-            if debt.exists:
-                return debt.to_dict()
+            return get_backend().get_debt(debt_id)
+        except Exception as e:
+            logger.error(f"Error getting debt {debt_id}: {e}")
             return None
+    
+    @staticmethod
+    def get_debt_group(debt_group_id: str):
+        """Получить группу долгов по id"""
+        try:
+            data = get_backend().get_debt_group(debt_group_id)
+            if data is not None:
+                group_info_cache.put(debt_group_id, data)
+                data['id'] = debt_group_id
+            return data
+        except Exception as e:
+            logger.error(f"Error getting debt group {debt_group_id}: {e}")
+            return None
+    
+    @staticmethod
+    def mark_debt_paid(debt_id: str):
+        """Отметить долг как возвращенный (вместе с балансом поездки — атомарно)"""
+        try:
+            data = get_backend().mark_debt_paid(debt_id, datetime.now())
+            if data:
+                logger.info(f"Marked debt {debt_id} as paid")
+            return data
         except Exception as e:
             logger.error(f"Error marking debt as paid: {e}")
             return None
@@ -342,76 +622,103 @@ class Database:
     def get_my_debts(chat_id: int, user_id: int):
         """Получить мои непогашенные долги"""
         try:
-            debts = db.collection('debts')\
-                .where('chat_id', '==', chat_id)\
-                .where('debtor_id', '==', user_id)\
-                .where('is_paid', '==', False)\
-                .stream()
-            
-            result = []
-            for debt in debts:
-                data = debt.to_dict()
-                data['id'] = debt.id
-                
-                try:
-                    debt_group = db.collection('debt_groups').document(data['debt_group_id']).get()
-                    if debt_group.exists:
-                        data['group_info'] = debt_group.to_dict()
-                except Exception as e:
-                    logger.error(f"Error getting debt group info: {e}")
-                    data['group_info'] = {
-                        'description': 'Без описания',
-                        'category': '💸'
-                    }
-                
-                result.append(data)
-            return result
+            result = get_backend().query_debts(chat_id, debtor_id=user_id, is_paid=False)
+            return Database.hydrate_group_info(result)
         except Exception as e:
             logger.error(f"Error getting my debts: {e}")
             return []
     
+    @staticmethod
+    def hydrate_group_info(debts: list):
+        """
+        Заполнить debt['group_info'] (описание, категория, валюта) для списка долгов.
+        Неизвестные группы читаются одним запросом, остальные берутся из LRU.
+        """
+        infos = {}
+        missing_ids = []
+        for debt in debts:
+            group_id = debt['debt_group_id']
+            if group_id not in infos:
+                infos[group_id] = group_info_cache.get(group_id)
+                if infos[group_id] is None:
+                    missing_ids.append(group_id)
+        
+        try:
+            for group_id, group_data in get_backend().get_debt_groups_by_ids(missing_ids).items():
+                group_info_cache.put(group_id, group_data)
+                infos[group_id] = {field: group_data[field] for field in GROUP_INFO_FIELDS if field in group_data}
+        except Exception as e:
+            logger.error(f"Error getting debt group info: {e}")
+        
+        for debt in debts:
+            debt['group_info'] = dict(infos.get(debt['debt_group_id']) or {
+                'description': 'Долг',
+                'category': '💸'
+            })
+        return debts
+    
     @staticmethod
     def get_debts_summary(chat_id: int):
-        """Получить общую сводку долгов (группировка по валютам)"""
+        """
+        Получить общую сводку долгов (группировка по валютам)
+        Читается сохранённый баланс поездки; при его отсутствии баланс пересчитывается
+        """
         try:
-            all_debts = db.collection('debts')\
-                .where('chat_id', '==', chat_id)\
-                .where('is_paid', '==', False)\
-                .stream()
-            
-            summary = {}
-            
-            for debt in all_debts:
-                data = debt.to_dict()
-                debtor_id = data['debtor_id']
-                creditor_id = data['creditor_id']
-                amount = data['amount']
-                currency = data.get('currency', 'EUR')
-                
-                key = f"{debtor_id}_{creditor_id}_{currency}"
-                
-                if key not in summary:
-                    summary[key] = {
-                        'debtor_id': debtor_id,
-                        'creditor_id': creditor_id,
-                        'currency': currency,
-                        'total_amount': 0
-                    }
-                
-                summary[key]['total_amount'] += amount
+            backend = get_backend()
+            pairs = backend.get_balances(chat_id)
+            if pairs is None:
+                try:
+                    pairs = Database.rebuild_balances(chat_id)
+                except Exception as e:
+                    # Пересчёт конфликтует с записями; сводку всё равно отдаём по сырым долгам
+                    logger.warning(f"Rebuilding balances for chat {chat_id} failed, computing directly: {e}")
+                    pairs = backend.compute_balances(chat_id)
             
-            return list(summary.values())
+            return [
+                dict(pair) for pair in pairs.values()
+                if pair.get('total_amount', 0) > BALANCE_EPSILON
+            ]
         except Exception as e:
             logger.error(f"Error getting debts summary: {e}")
             return []
     
+    @staticmethod
+    def rebuild_balances(chat_id: int):
+        """Пересчитать баланс поездки по сырым долгам и перезаписать его"""
+        pairs = get_backend().rebuild_balances(chat_id)
+        logger.info(f"Rebuilt balances for chat {chat_id}: {len(pairs)} pairs")
+        return pairs
+    
+    @staticmethod
+    def verify_balances(chat_id: int):
+        """
+        Сверить сохранённый баланс поездки с сырыми долгами
+        Возвращает {'ok': bool, 'mismatches': [{'key', 'stored', 'actual'}]}
+        """
+        backend = get_backend()
+        stored = backend.get_balances(chat_id) or {}
+        actual = backend.compute_balances(chat_id)
+        
+        mismatches = []
+        for key in set(stored) | set(actual):
+            stored_amount = stored.get(key, {}).get('total_amount', 0)
+            actual_amount = actual.get(key, {}).get('total_amount', 0)
+            if abs(stored_amount - actual_amount) > BALANCE_EPSILON:
+                mismatches.append({
+                    'key': key,
+                    'stored': stored_amount,
+                    'actual': actual_amount
+                })
+        
+        return {'ok': not mismatches, 'mismatches': mismatches}
+    
     @staticmethod
     def get_user_settings(user_id: int):
         """Получить настройки пользователя"""
         try:
-            doc = db.collection('user_settings').document(str(user_id)).get()
-            if doc.exists:
-                return doc.to_dict()
+            settings = get_backend().get_user_settings(user_id)
+            if settings:
+                return settings
         except Exception as e:
             logger.error(f"Error getting user settings: {e}")
         
@@ -420,12 +727,28 @@ class Database:
             'language': 'ru'
         }
     
+    @staticmethod
+    def get_user_settings_bulk(user_ids: list):
+        """Получить настройки нескольких пользователей одним запросом -> {user_id: settings}"""
+        settings = {}
+        try:
+            settings = get_backend().get_user_settings_bulk(user_ids)
+        except Exception as e:
+            logger.error(f"Error getting user settings in bulk: {e}")
+        
+        return {
+            user_id: settings.get(user_id) or {
+                'notification_type': 'all',
+                'language': 'ru'
+            }
+            for user_id in user_ids
+        }
+    
     @staticmethod
     def update_user_settings(user_id: int, **kwargs):
         """Обновить настройки пользователя"""
         try:
-            doc_ref = db.collection('user_settings').document(str(user_id))
-            doc_ref.set(kwargs, merge=True)
+            get_backend().update_user_settings(user_id, kwargs)
             logger.info(f"Updated settings for user {user_id}: {kwargs}")
             return True
         except Exception as e:
@@ -434,36 +757,19 @@ class Database:
     
     @staticmethod
     def link_user_to_trip(user_id: int, chat_id: int):
-        """Связать пользователя с поездкой"""
+        """
+        Связать пользователя с поездкой
+        Уже связан — без обращений к хранилищу; есть активная поездка — одна запись
+        """
+        if linked_trips.is_linked(user_id, chat_id):
+            STORAGE_WRITES_AVOIDED.inc(reason='linked_trip')
+            return True
+        
         try:
-            doc_ref = db.collection('user_trips').document(str(user_id))
-            doc = doc_ref.get()
-            
-            if doc.exists:
-                data = doc.to_dict()
-                trips = data.get('trips', [])
-                
-                if chat_id not in trips:
-                    trips.append(chat_id)
-                
-                if not data.get('active_trip'):
-                    doc_ref.update({
-                        'active_trip': chat_id,
-                        'trips': trips,
-                        'updated_at': datetime.now()
-                    })
-                else:
-                    doc_ref.update({
-                        'trips': trips,
-                        'updated_at': datetime.now()
-                    })
-            else:
-                doc_ref.set({
-                    'active_trip': chat_id,
-                    'trips': [chat_id],
-                    'updated_at': datetime.now()
-                })
-            
+            get_backend().link_user_to_trip(
+                user_id, chat_id, has_active_trip=linked_trips.has_active_trip(user_id)
+            )
+            linked_trips.remember(user_id, [chat_id])
             logger.info(f"Linked user {user_id} to trip {chat_id}")
             return True
         except Exception as e:
@@ -474,10 +780,9 @@ class Database:
     def get_user_active_trip(user_id: int):
         """Получить активную поездку пользователя"""
         try:
-            doc = db.collection('user_trips').document(str(user_id)).get()
-            if doc.exists:
-                return doc.to_dict().get('active_trip')
-            return None
+            data = get_backend().get_user_trips(user_id)
+            linked_trips.remember_user_trips(user_id, data)
+            return data.get('active_trip') if data else None
         except Exception as e:
             logger.error(f"Error getting user active trip: {e}")
             return None
@@ -486,23 +791,36 @@ class Database:
     def get_user_trips(user_id: int):
         """Получить все поездки пользователя"""
         try:
-            doc = db.collection('user_trips').document(str(user_id)).get()
-            if doc.exists:
-                return doc.to_dict()
-            return None
+            data = get_backend().get_user_trips(user_id)
+            linked_trips.remember_user_trips(user_id, data)
+            return data
         except Exception as e:
             logger.error(f"Error getting user trips: {e}")
             return None
     
+    @staticmethod
+    def get_cabinet(user_id: int):
+        """
+        Данные личного кабинета одним вызовом: документ user_trips и все его поездки
+        -> {'active_trip': id или None, 'trip_ids': [id], 'trips': {id: поездка}}
+        """
+        try:
+            data = get_backend().get_user_trips(user_id) or {}
+        except Exception as e:
+            logger.error(f"Error getting cabinet for user {user_id}: {e}")
+            return {'active_trip': None, 'trip_ids': [], 'trips': {}}
+        
+        linked_trips.remember_user_trips(user_id, data)
+        active_trip_id = data.get('active_trip')
+        trip_ids = data.get('trips', [])
+        trips = Database.get_trips_bulk([active_trip_id, *trip_ids] if active_trip_id else trip_ids)
+        return {'active_trip': active_trip_id, 'trip_ids': trip_ids, 'trips': trips}
+    
     @staticmethod
     def set_active_trip(user_id: int, chat_id: int):
         """Установить активную поездку"""
         try:
-            doc_ref = db.collection('user_trips').document(str(user_id))
-            doc_ref.update({
-                'active_trip': chat_id,
-                'updated_at': datetime.now()
-            })
+            get_backend().set_active_trip(user_id, chat_id)
             logger.info(f"Set active trip {chat_id} for user {user_id}")
             return True
         except Exception as e:
@@ -511,70 +829,269 @@ class Database:
     
     @staticmethod
     def delete_debt_group(debt_group_id: str):
-        """Удалить группу долгов"""
+        """Удалить группу долгов (её непогашенные долги уходят из баланса — атомарно)"""
         try:
-            db.collection('debt_groups').document(debt_group_id).update({
-                'is_deleted': True,
-                'deleted_at': datetime.now()
-            })
-            logger.info(f"Soft-deleted debt group {debt_group_id}")
-            return True
+            deleted = get_backend().delete_debt_group(debt_group_id)
+            if deleted:
+                logger.info(f"Soft-deleted debt group {debt_group_id}")
+            return deleted
         except Exception as e:
             logger.error(f"Error deleting debt group: {e}")
             return False
     
     @staticmethod
-    def delete_trip_completely(chat_id: int):
-        """Полностью удалить поездку и все связанные данные"""
+    def delete_trip_completely(chat_id: int, progress_callback=None):
+        """
+        Полностью удалить поездку и все связанные данные
+        progress_callback(done, total) — прогресс удаления (вызывается из рабочего потока)
+        """
         try:
-            debts = db.collection('debts').where('chat_id', '==', chat_id).stream()
-            deleted_debts = 0
-            for debt in debts:
-                db.collection('debts').document(debt.id).delete()
-                deleted_debts += 1
-            
-            debt_groups = db.collection('debt_groups').where('chat_id', '==', chat_id).stream()
-            deleted_groups = 0
-            for dg in debt_groups:
-                db.collection('debt_groups').document(dg.id).delete()
-                deleted_groups += 1
-            
             trip = Database.get_trip(chat_id)
-            if trip:
-                participants = trip.get('participants', [])
-                for p in participants:
-                    user_id = p['user_id']
-                    user_trips_ref = db.collection('user_trips').document(str(user_id))
-                    user_trips_doc = user_trips_ref.get()
-                    
-                    if user_trips_doc.exists:
-                        data = user_trips_doc.to_dict()
-                        trips = data.get('trips', [])
-                        
-                        if chat_id in trips:
-                            trips.remove(chat_id)
-                        
-                        if data.get('active_trip') == chat_id:
-                            new_active = trips[0] if trips else None
-                            user_trips_ref.update({
-                                'active_trip': new_active,
-                                'trips': trips,
-                                'updated_at': datetime.now()
-                            })
-                        else:
-                            user_trips_ref.update({
-                                'trips': trips,
-                                'updated_at': datetime.now()
-                            })
+            user_ids = [p['user_id'] for p in trip.get('participants', [])] if trip else []
             
-            db.collection('trips').document(str(chat_id)).delete()
+            debts_count, groups_count = get_backend().delete_trip(chat_id, user_ids, progress_callback)
+            trip_cache.invalidate(chat_id)
+            known_members.forget_chat(chat_id)
+            linked_trips.forget_chat(chat_id)
             
             logger.info(
                 f"Completely deleted trip {chat_id}: "
-                f"{deleted_debts} debts, {deleted_groups} debt groups"
+                f"{debts_count} debts, {groups_count} debt groups"
             )
             return True
-            
+        
         except Exception as e:
+            trip_cache.invalidate(chat_id)
             logger.error(f"Error deleting trip {chat_id}: {e}")
             return False
+    
+    @staticmethod
+    def add_pending_deletions(chat_id: int, messages: dict):
+        """
+        Запомнить сообщения для отложенного удаления
+        messages: {message_id: due_at (unix time)}
+        """
+        try:
+            get_backend().add_pending_deletions(chat_id, messages)
+            return True
+        except Exception as e:
+            logger.error(f"Error saving pending deletions for chat {chat_id}: {e}")
+            return False
+    
+    @staticmethod
+    def get_pending_deletions():
+        """Все отложенные удаления: {chat_id: {message_id: due_at}}"""
+        try:
+            return get_backend().get_pending_deletions()
+        except Exception as e:
+            logger.error(f"Error getting pending deletions: {e}")
+            return {}
+    
+    @staticmethod
+    def remove_pending_deletions(chat_id: int, message_ids: list):
+        """Убрать обработанные сообщения из отложенного удаления (только перечисленные)"""
+        try:
+            get_backend().remove_pending_deletions(chat_id, message_ids)
+            return True
+        except Exception as e:
+            logger.error(f"Error removing pending deletions for chat {chat_id}: {e}")
+            return False
+    
+    @staticmethod
+    def init_storage(prewarm: bool = False):
+        """
+        Создать backend при старте, а не на первом апдейте; prewarm — ещё и открыть соединение
+        Возвращает время этапов {этап: секунды} или None при ошибке
+        """
+        timings = {}
+        try:
+            started = time.perf_counter()
+            backend = get_backend()
+            timings['storage_init'] = time.perf_counter() - started
+            
+            if prewarm:
+                started = time.perf_counter()
+                backend.warm_up()
+                timings['storage_prewarm'] = time.perf_counter() - started
+            return timings
+        except Exception as e:
+            logger.error(f"Error initializing storage: {e}")
+            return None
+    
+    @staticmethod
+    def get_trip_cache_stats():
+        """Статистика кэша поездок: попадания — сэкономленные чтения хранилища"""
+        return trip_cache.stats()
+    
+    @staticmethod
+    def is_known_member(chat_id: int, user_id: int, username: str, first_name: str):
+        """Участник уже записан в поездку под этим именем — обращаться к хранилищу незачем"""
+        return known_members.is_known(chat_id, user_id, username, first_name)
+    
+    @staticmethod
+    def remember_member(chat_id: int, user_id: int, username: str, first_name: str):
+        known_members.remember(chat_id, user_id, username, first_name)
+    
+    @staticmethod
+    def get_known_members_stats():
+        """Статистика быстрого пути для известных участников (сколько записей сэкономлено)"""
+        return known_members.stats()
+
+
+# Время и исключения каждого метода -> метрики tripsplit_db_method_*
+instrument_static_methods(Database, DB_LATENCY, DB_ERRORS, 'method')
+
+
+# ============ ASYNC ============
+
+# Клиенты хранилищ синхронные: каждый запрос к Firestore или SQLite блокирует поток.
+# Вызовы уходят в ограниченный пул, чтобы event loop продолжал обслуживать
+# другие апдейты, пока идёт запрос к хранилищу.
+_executor = ThreadPoolExecutor(max_workers=DB_MAX_WORKERS, thread_name_prefix='storage')
+
+
+async def _run(func, *args, **kwargs):
+    """Выполнить синхронный метод Database в пуле потоков"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+
+class AsyncDatabase:
+    """Неблокирующая обёртка над Database для использования в хендлерах"""
+    
+    @staticmethod
+    async def create_trip(chat_id: int, name: str, currency: str, creator_id: int):
+        return await _run(Database.create_trip, chat_id, name, currency, creator_id)
+    
+    @staticmethod
+    async def get_trip(chat_id: int):
+        return await _run(Database.get_trip, chat_id)
+    
+    @staticmethod
+    async def get_trips_bulk(chat_ids: list):
+        return await _run(Database.get_trips_bulk, chat_ids)
+    
+    @staticmethod
+    async def add_participant(chat_id: int, user_id: int, username: str, first_name: str):
+        return await _run(Database.add_participant, chat_id, user_id, username, first_name)
+    
+    @staticmethod
+    async def get_participants(chat_id: int):
+        return await _run(Database.get_participants, chat_id)
+    
+    @staticmethod
+    async def create_debt(chat_id: int, amount: float, payer_id: int,
+                          participants: list, description: str = '',
+                          category: str = '💸', currency: str = None):
+        return await _run(
+            Database.create_debt, chat_id, amount, payer_id, participants,
+            description=description, category=category, currency=currency
+        )
+    
+    @staticmethod
+    async def get_debt_groups(chat_id: int):
+        return await _run(Database.get_debt_groups, chat_id)
+    
+    @staticmethod
+    async def get_history_events(chat_id: int, limit: int = 50):
+        return await _run(Database.get_history_events, chat_id, limit)
+    
+    @staticmethod
+    async def get_history_page(chat_id: int, cursor: tuple = None, newer: bool = False):
+        return await _run(Database.get_history_page, chat_id, cursor, newer)
+    
+    @staticmethod
+    async def get_individual_debts(chat_id: int, user_id: int = None):
+        return await _run(Database.get_individual_debts, chat_id, user_id)
+    
+    @staticmethod
+    async def get_debts_to_user(chat_id: int, user_id: int):
+        return await _run(Database.get_debts_to_user, chat_id, user_id)
+    
+    @staticmethod
+    async def get_debt(debt_id: str):
+        return await _run(Database.get_debt, debt_id)
+    
+    @staticmethod
+    async def get_debt_group(debt_group_id: str):
+        return await _run(Database.get_debt_group, debt_group_id)
+    
+    @staticmethod
+    async def mark_debt_paid(debt_id: str):
+        return await _run(Database.mark_debt_paid, debt_id)
+    
+    @staticmethod
+    async def get_my_debts(chat_id: int, user_id: int):
+        return await _run(Database.get_my_debts, chat_id, user_id)
+    
+    @staticmethod
+    async def hydrate_group_info(debts: list):
+        return await _run(Database.hydrate_group_info, debts)
+    
+    @staticmethod
+    async def get_debts_summary(chat_id: int):
+        return await _run(Database.get_debts_summary, chat_id)
+    
+    @staticmethod
+    async def rebuild_balances(chat_id: int):
+        return await _run(Database.rebuild_balances, chat_id)
+    
+    @staticmethod
+    async def verify_balances(chat_id: int):
+        return await _run(Database.verify_balances, chat_id)
+    
+    @staticmethod
+    async def get_user_settings(user_id: int):
+        return await _run(Database.get_user_settings, user_id)
+    
+    @staticmethod
+    async def get_user_settings_bulk(user_ids: list):
+        return await _run(Database.get_user_settings_bulk, user_ids)
+    
+    @staticmethod
+    async def update_user_settings(user_id: int, **kwargs):
+        return await _run(Database.update_user_settings, user_id, **kwargs)
+    
+    @staticmethod
+    async def link_user_to_trip(user_id: int, chat_id: int):
+        return await _run(Database.link_user_to_trip, user_id, chat_id)
+    
+    @staticmethod
+    async def get_user_active_trip(user_id: int):
+        return await _run(Database.get_user_active_trip, user_id)
+    
+    @staticmethod
+    async def get_user_trips(user_id: int):
+        return await _run(Database.get_user_trips, user_id)
+    
+    @staticmethod
+    async def get_cabinet(user_id: int):
+        return await _run(Database.get_cabinet, user_id)
+    
+    @staticmethod
+    async def set_active_trip(user_id: int, chat_id: int):
+        return await _run(Database.set_active_trip, user_id, chat_id)
+    
+    @staticmethod
+    async def delete_debt_group(debt_group_id: str):
+        return await _run(Database.delete_debt_group, debt_group_id)
+    
+    @staticmethod
+    async def delete_trip_completely(chat_id: int, progress_callback=None):
+        return await _run(Database.delete_trip_completely, chat_id, progress_callback)
+    
+    @staticmethod
+    async def add_pending_deletions(chat_id: int, messages: dict):
+        return await _run(Database.add_pending_deletions, chat_id, messages)
+    
+    @staticmethod
+    async def get_pending_deletions():
+        return await _run(Database.get_pending_deletions)
+    
+    @staticmethod
+    async def remove_pending_deletions(chat_id: int, message_ids: list):
+        return await _run(Database.remove_pending_deletions, chat_id, message_ids)
+    
+    @staticmethod
+    async def init_storage(prewarm: bool = False):
+        return await _run(Database.init_storage, prewarm)
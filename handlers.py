@@ -1,11 +1,16 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler
 from telegram.constants import ParseMode
-from database import Database
+from telegram.error import TelegramError
+from database import AsyncDatabase, Database
 from keyboards import Keyboards
 from utils import Utils
+from settlement import Settlement
+from autodelete import DeletionScheduler
+from notifications import NotificationDispatcher
 import logging
 import asyncio
+import time
 
 logger = logging.getLogger(__name__)
 
@@ -17,6 +22,8 @@ class Handlers:
     
     def __init__(self, bot_username: str):
         self.bot_username = bot_username
+        self.autodelete = DeletionScheduler()
+        self.notifier = NotificationDispatcher()
     
     async def handle_group_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработка сообщений в группе для автодобавления участников"""
@@ -26,15 +33,25 @@ class Handlers:
         if user.is_bot:
             return
         
-        trip = Database.get_trip(chat.id)
+        # Известный участник с прежним именем — ни одного обращения к хранилищу
+        if Database.is_known_member(chat.id, user.id, user.username, user.first_name):
+            return
+        
+        trip = await AsyncDatabase.get_trip(chat.id)
         if trip:
-            Database.add_participant(
-                chat_id=chat.id,
-                user_id=user.id,
-                username=user.username,
-                first_name=user.first_name
-            )
-            Database.link_user_to_trip(user.id, chat.id)
+            await self._register_member(chat.id, user)
+    
+    async def _register_member(self, chat_id: int, user):
+        """Записать участника в поездку и связать с ней; при успехе запомнить как известного"""
+        added = await AsyncDatabase.add_participant(
+            chat_id=chat_id,
+            user_id=user.id,
+            username=user.username,
+            first_name=user.first_name
+        )
+        linked = await AsyncDatabase.link_user_to_trip(user.id, chat_id)
+        if added and linked:
+            Database.remember_member(chat_id, user.id, user.username, user.first_name)
     
     async def handle_private_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработка обычных сообщений в ЛС"""
@@ -60,10 +77,12 @@ class Handlers:
                     chat_id = int(arg.split('_')[1])
                     return await self.show_history_dm(update, context, chat_id)
             
-            active_trip_id = Database.get_user_active_trip(user.id)
+            # Одним вызовом, как в кабинете: user_trips и поездки пачкой
+            cabinet = await AsyncDatabase.get_cabinet(user.id)
+            active_trip_id = cabinet['active_trip']
             
             if active_trip_id:
-                trip = Database.get_trip(active_trip_id)
+                trip = cabinet['trips'].get(active_trip_id)
                 if trip:
                     text = (
                         f"👤 Личный кабинет\n\n"
@@ -73,7 +92,7 @@ class Handlers:
                     )
                     await update.message.reply_text(
                         text,
-                        reply_markup=Keyboards.dm_main_menu()
+                        reply_markup=Keyboards.dm_main_menu(active_trip_id)
                     )
                     return
             
@@ -95,15 +114,15 @@ class Handlers:
             await update.message.reply_text(text)
         
         else:
-            Database.add_participant(
+            await AsyncDatabase.add_participant(
                 chat_id=chat.id,
                 user_id=user.id,
                 username=user.username,
                 first_name=user.first_name
             )
-            Database.link_user_to_trip(user.id, chat.id)
+            await AsyncDatabase.link_user_to_trip(user.id, chat.id)
             
-            trip = Database.get_trip(chat.id)
+            trip = await AsyncDatabase.get_trip(chat.id)
             if trip:
                 text = (
                     f"🎒 {trip['name']}\n"
@@ -131,7 +150,8 @@ class Handlers:
             "/start — Показать меню поездки\n"
             "/summary — Показать сводку долгов\n"
             "/participants — Показать участников\n"
-            "/deletetrip — Удалить поездку и все данные\n\n"
+            "/deletetrip — Удалить поездку и все данные\n"
+            "/rebuildbalances — Пересчитать сводку долгов\n\n"
             "Быстрое добавление долга В ГРУППЕ:\n"
             "2000 @участник1 @участник2 описание\n"
             "2000 THB @участник такси (с валютой)\n\n"
@@ -159,38 +179,28 @@ class Handlers:
             )
             return
         
-        trip = Database.get_trip(chat.id)
+        trip = await AsyncDatabase.get_trip(chat.id)
         if not trip:
             sent = await update.message.reply_text(
                 "❌ Поездка не создана. Используйте /newtrip"
             )
-            await asyncio.sleep(5)
-            try:
-                await update.message.delete()
-                await sent.delete()
-            except:
-                pass
+            self.autodelete.schedule(chat.id, [update.message.message_id, sent.message_id], delay=5)
             return
         
-        Database.add_participant(
+        await AsyncDatabase.add_participant(
             chat_id=chat.id,
             user_id=user.id,
             username=user.username,
             first_name=user.first_name
         )
-        Database.link_user_to_trip(user.id, chat.id)
+        await AsyncDatabase.link_user_to_trip(user.id, chat.id)
         
         username_display = f"@{user.username}" if user.username else user.first_name
         sent = await update.message.reply_text(
             f"✅ {username_display} добавлен в поездку {trip['name']}!"
         )
         
-        await asyncio.sleep(3)
-        try:
-            await update.message.delete()
-            await sent.delete()
-        except Exception as e:
-            logger.error(f"Failed to delete join messages: {e}")
+        self.autodelete.schedule(chat.id, [update.message.message_id, sent.message_id], delay=3)
     
     async def newtrip_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Создание новой поездки"""
@@ -203,15 +213,15 @@ class Handlers:
             )
             return ConversationHandler.END
         
-        Database.add_participant(
+        await AsyncDatabase.add_participant(
             chat_id=chat.id,
             user_id=user.id,
             username=user.username,
             first_name=user.first_name
         )
-        Database.link_user_to_trip(user.id, chat.id)
+        await AsyncDatabase.link_user_to_trip(user.id, chat.id)
         
-        existing_trip = Database.get_trip(chat.id)
+        existing_trip = await AsyncDatabase.get_trip(chat.id)
         if existing_trip:
             text = (
                 f"ℹ️ Поездка {existing_trip['name']} уже создана для этого чата.\n\n"
@@ -301,20 +311,20 @@ class Handlers:
         chat = query.message.chat
         user = query.from_user
         
-        trip = Database.create_trip(
+        trip = await AsyncDatabase.create_trip(
             chat_id=chat.id,
             name=context.user_data['trip_name'],
             currency=currency,
             creator_id=user.id
         )
         
-        Database.add_participant(
+        await AsyncDatabase.add_participant(
             chat_id=chat.id,
             user_id=user.id,
             username=user.username,
             first_name=user.first_name
         )
-        Database.link_user_to_trip(user.id, chat.id)
+        await AsyncDatabase.link_user_to_trip(user.id, chat.id)
         
         text = (
             f"✅ Поездка {trip['name']} ({currency}) создана!\n\n"
@@ -354,7 +364,7 @@ class Handlers:
         chat = update.effective_chat
         user = update.effective_user
         
-        trip = Database.get_trip(chat.id)
+        trip = await AsyncDatabase.get_trip(chat.id)
         if not trip:
             await update.message.reply_text("❌ Поездка не найдена")
             return
@@ -387,6 +397,38 @@ class Handlers:
             reply_markup=InlineKeyboardMarkup(keyboard)
         )
     
+    async def rebuild_balances_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Сверить и при необходимости пересчитать баланс поездки по сырым долгам"""
+        chat = update.effective_chat
+        user = update.effective_user
+        
+        trip = await AsyncDatabase.get_trip(chat.id)
+        if not trip:
+            await update.message.reply_text("❌ Поездка не найдена")
+            return
+        
+        if trip['creator_id'] != user.id:
+            # Не удалось проверить права — команду не выполняем
+            try:
+                member = await context.bot.get_chat_member(chat.id, user.id)
+                allowed = member.status in ['creator', 'administrator']
+            except TelegramError as e:
+                logger.warning(f"Cannot check admin rights of {user.id} in chat {chat.id}: {e}")
+                allowed = False
+            if not allowed:
+                await update.message.reply_text("❌ Только создатель поездки или админы могут пересчитать баланс")
+                return
+        
+        result = await AsyncDatabase.verify_balances(chat.id)
+        if result['ok']:
+            await update.message.reply_text("✅ Сводка совпадает с долгами, пересчёт не нужен")
+            return
+        
+        await AsyncDatabase.rebuild_balances(chat.id)
+        await update.message.reply_text(
+            f"🔧 Сводка пересчитана: исправлено расхождений — {len(result['mismatches'])}"
+        )
+    
     async def summary_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Показать сводку долгов"""
         chat = update.effective_chat
@@ -398,22 +440,23 @@ class Handlers:
             )
             return
         
-        Database.add_participant(
+        await AsyncDatabase.add_participant(
             chat_id=chat.id,
             user_id=user.id,
             username=user.username,
             first_name=user.first_name
         )
-        Database.link_user_to_trip(user.id, chat.id)
+        await AsyncDatabase.link_user_to_trip(user.id, chat.id)
         
-        trip = Database.get_trip(chat.id)
+        trip = await AsyncDatabase.get_trip(chat.id)
         if not trip:
             await update.message.reply_text(
                 "❌ Поездка не найдена. Создайте её командой /newtrip"
             )
             return
         
-        summary_text = Utils.format_summary(chat.id)
+        summary = await AsyncDatabase.get_debts_summary(chat.id)
+        summary_text = Utils.format_summary(trip, summary, trip.get('participants', []))
         
         await update.message.reply_text(
             summary_text,
@@ -432,22 +475,22 @@ class Handlers:
             )
             return
         
-        Database.add_participant(
+        await AsyncDatabase.add_participant(
             chat_id=chat.id,
             user_id=user.id,
             username=user.username,
             first_name=user.first_name
         )
-        Database.link_user_to_trip(user.id, chat.id)
+        await AsyncDatabase.link_user_to_trip(user.id, chat.id)
         
-        trip = Database.get_trip(chat.id)
+        trip = await AsyncDatabase.get_trip(chat.id)
         if not trip:
             await update.message.reply_text(
                 "❌ Поездка не найдена. Создайте её командой /newtrip"
             )
             return
         
-        participants = Database.get_participants(chat.id)
+        participants = await AsyncDatabase.get_participants(chat.id)
         
         if not participants:
             text = "👥 Участников пока нет."
@@ -472,13 +515,13 @@ class Handlers:
             user = update.effective_user
             message = update.message
         
-        active_trip_id = Database.get_user_active_trip(user.id)
+        # user_trips и поездки — одним вызовом (поездки читаются пачкой)
+        cabinet = await AsyncDatabase.get_cabinet(user.id)
+        active_trip_id = cabinet['active_trip']
+        trip = cabinet['trips'].get(active_trip_id)
         
-        if active_trip_id:
-            trip = Database.get_trip(active_trip_id)
-            
-            user_trips_doc = Database.get_user_trips(user.id)
-            trip_count = len(user_trips_doc.get('trips', [])) if user_trips_doc else 1
+        if trip:
+            trip_count = len(cabinet['trip_ids']) or 1
             
             text = (
                 f"👤 Личный кабинет\n\n"
@@ -491,7 +534,7 @@ class Handlers:
             
             text += "\nВыберите действие:"
             
-            keyboard_markup = Keyboards.dm_main_menu(show_switch_trip=(trip_count > 1))
+            keyboard_markup = Keyboards.dm_main_menu(active_trip_id, show_switch_trip=(trip_count > 1))
         else:
             text = (
                 "👤 Личный кабинет\n\n"
@@ -520,9 +563,9 @@ class Handlers:
         await query.answer()
         
         user = query.from_user
-        user_trips_doc = Database.get_user_trips(user.id)
+        cabinet = await AsyncDatabase.get_cabinet(user.id)
         
-        if not user_trips_doc or not user_trips_doc.get('trips'):
+        if not cabinet['trip_ids']:
             await query.edit_message_text(
                 "❌ У вас нет других поездок",
                 reply_markup=InlineKeyboardMarkup([[
@@ -531,40 +574,31 @@ class Handlers:
             )
             return
         
-        active_trip_id = user_trips_doc.get('active_trip')
-        trip_ids = user_trips_doc.get('trips', [])
+        active_trip_id = cabinet['active_trip']
         
         text = "🔄 Переключение поездки\n\nВыберите активную поездку:\n\n"
         
-        keyboard = []
-        for trip_id in trip_ids:
-            trip = Database.get_trip(trip_id)
+        trips = []
+        for trip_id in cabinet['trip_ids']:
+            trip = cabinet['trips'].get(trip_id)
             if trip:
                 is_active = "✅ " if trip_id == active_trip_id else ""
                 text += f"{is_active}{trip['name']} ({trip['currency']})\n"
-                keyboard.append([
-                    InlineKeyboardButton(
-                        f"{is_active}{trip['name']}",
-                        callback_data=f"switch_trip_{trip_id}"
-                    )
-                ])
-        
-        keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="dm_back")])
+                trips.append(trip)
         
         await query.edit_message_text(
             text,
-            reply_markup=InlineKeyboardMarkup(keyboard)
+            reply_markup=Keyboards.trip_switch_list(trips, active_trip_id)
         )
     
-    async def switch_active_trip(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    async def switch_active_trip(self, update: Update, context: ContextTypes.DEFAULT_TYPE, chat_id: int):
         """Переключить активную поездку"""
         query = update.callback_query
         await query.answer("✅ Поездка переключена!")
         
         user = query.from_user
-        trip_id = int(query.data.split('_')[2])
         
-        Database.set_active_trip(user.id, trip_id)
+        await AsyncDatabase.set_active_trip(user.id, chat_id)
         
         return await self.show_dm_cabinet(update, context)
     
@@ -578,7 +612,7 @@ class Handlers:
             user = update.effective_user
         
         if not chat_id:
-            chat_id = Database.get_user_active_trip(user.id)
+            chat_id = await AsyncDatabase.get_user_active_trip(user.id)
         
         if not chat_id:
             text = "❌ Активная поездка не найдена"
@@ -588,96 +622,95 @@ class Handlers:
                 await update.message.reply_text(text)
             return
         
-        trip = Database.get_trip(chat_id)
+        trip = await AsyncDatabase.get_trip(chat_id)
         if trip:
-            Database.add_participant(chat_id, user.id, user.username, user.first_name)
-            Database.link_user_to_trip(user.id, chat_id)
+            await AsyncDatabase.add_participant(chat_id, user.id, user.username, user.first_name)
+            await AsyncDatabase.link_user_to_trip(user.id, chat_id)
         
         text = "📌 Мои долги\n\nВыберите вкладку:"
         
         if query:
             await query.edit_message_text(
                 text,
-                reply_markup=Keyboards.debts_tabs()
+                reply_markup=Keyboards.debts_tabs(chat_id)
             )
         else:
             await update.message.reply_text(
                 text,
-                reply_markup=Keyboards.debts_tabs()
+                reply_markup=Keyboards.debts_tabs(chat_id)
             )
     
-    async def show_i_owe(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    async def show_i_owe(self, update: Update, context: ContextTypes.DEFAULT_TYPE, chat_id: int = None):
         """Показать мои долги с кнопками"""
         query = update.callback_query
         await query.answer()
         
         user = query.from_user
-        chat_id = Database.get_user_active_trip(user.id)
+        if not chat_id:
+            # Старые кнопки без контекста поездки
+            chat_id = await AsyncDatabase.get_user_active_trip(user.id)
         
         if not chat_id:
             await query.edit_message_text("❌ Активная поездка не найдена")
             return
         
-        my_debts = Database.get_my_debts(chat_id, user.id)
+        my_debts = await AsyncDatabase.get_my_debts(chat_id, user.id)
         
         if not my_debts:
             text = "✅ У вас нет долгов!"
             await query.edit_message_text(
                 text,
-                reply_markup=Keyboards.debts_tabs()
+                reply_markup=Keyboards.debts_tabs(chat_id)
             )
             return
         
-        text = Utils.format_my_debts(chat_id, user.id)
+        participants = await AsyncDatabase.get_participants(chat_id)
+        text = Utils.format_my_debts(my_debts, participants)
         
         await query.edit_message_text(
             text,
             parse_mode=ParseMode.MARKDOWN,
-            reply_markup=Keyboards.my_debts_list(my_debts)
+            reply_markup=Keyboards.my_debts_list(chat_id, my_debts)
         )
     
-    async def show_owe_me(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    async def show_owe_me(self, update: Update, context: ContextTypes.DEFAULT_TYPE, chat_id: int = None):
         """Показать кто мне должен (С КНОПКАМИ!)"""
         query = update.callback_query
         await query.answer()
         
         user = query.from_user
-        chat_id = Database.get_user_active_trip(user.id)
+        if not chat_id:
+            # Старые кнопки без контекста поездки
+            chat_id = await AsyncDatabase.get_user_active_trip(user.id)
         
         if not chat_id:
             await query.edit_message_text("❌ Активная поездка не найдена")
             return
         
-        debts_to_me = Database.get_debts_to_user(chat_id, user.id)
+        debts_to_me = await AsyncDatabase.get_debts_to_user(chat_id, user.id)
         
         if not debts_to_me:
             text = "✅ Вам никто не должен!"
             await query.edit_message_text(
                 text,
-                reply_markup=Keyboards.debts_tabs()
+                reply_markup=Keyboards.debts_tabs(chat_id)
             )
             return
         
-        for debt in debts_to_me:
-            try:
-                from firebase_admin import firestore
-                db_instance = firestore.client()
-                debt_group = db_instance.collection('debt_groups').document(debt['debt_group_id']).get()
-                if debt_group.exists:
-                    debt['group_info'] = debt_group.to_dict()
-            except:
-                debt['group_info'] = {'description': 'Долг', 'category': '💸'}
+        await AsyncDatabase.hydrate_group_info(debts_to_me)
         
-        text = Utils.format_debts_to_me(chat_id, user.id)
+        participants = await AsyncDatabase.get_participants(chat_id)
+        text = Utils.format_debts_to_me(debts_to_me, participants)
         
         await query.edit_message_text(
             text,
             parse_mode=ParseMode.MARKDOWN,
-            reply_markup=Keyboards.debts_to_me_list(debts_to_me)
+            reply_markup=Keyboards.debts_to_me_list(chat_id, debts_to_me)
         )
     
-    async def show_history_dm(self, update: Update, context: ContextTypes.DEFAULT_TYPE, chat_id: int = None):
-        """Показать историю долгов"""
+    async def show_history_dm(self, update: Update, context: ContextTypes.DEFAULT_TYPE, chat_id: int = None,
+                              cursor: tuple = None, newer: bool = False):
+        """Показать страницу истории долгов; cursor — с кнопок листания"""
         if update.callback_query:
             query = update.callback_query
             await query.answer()
@@ -686,35 +719,44 @@ class Handlers:
             user = update.effective_user
         
         if not chat_id:
-            chat_id = Database.get_user_active_trip(user.id)
+            chat_id = await AsyncDatabase.get_user_active_trip(user.id)
         
-        if not chat_id:
+        trip = await AsyncDatabase.get_trip(chat_id) if chat_id else None
+        
+        if not trip:
             text = "❌ Активная поездка не найдена"
             keyboard = None
         else:
-            text = Utils.format_history(chat_id)
-            keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="dm_back")]]
+            page = await AsyncDatabase.get_history_page(chat_id, cursor, newer)
+            events = page['events'] if page else []
+            text = Utils.format_history(trip, events, trip.get('participants', []))
+            keyboard = Keyboards.history_pages(chat_id, page)
         
         if update.callback_query:
             await query.edit_message_text(
                 text,
                 parse_mode=ParseMode.MARKDOWN,
-                reply_markup=InlineKeyboardMarkup(keyboard) if keyboard else None
+                reply_markup=keyboard
             )
         else:
             await update.message.reply_text(
                 text,
                 parse_mode=ParseMode.MARKDOWN,
-                reply_markup=InlineKeyboardMarkup(keyboard) if keyboard else None
+                reply_markup=keyboard
             )
     
+    async def show_history_newer(self, update: Update, context: ContextTypes.DEFAULT_TYPE, chat_id: int,
+                                 cursor: tuple):
+        """Кнопка «Новее»: страница истории перед курсором"""
+        await self.show_history_dm(update, context, chat_id=chat_id, cursor=cursor, newer=True)
+    
     async def show_notifications_settings(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Показать настройки уведомлений"""
         query = update.callback_query
         await query.answer()
         
         user = query.from_user
-        settings = Database.get_user_settings(user.id)
+        settings = await AsyncDatabase.get_user_settings(user.id)
         current_type = settings.get('notification_type', 'all')
         
         text = (
@@ -735,7 +777,7 @@ class Handlers:
         user = query.from_user
         notif_type = query.data.split('_')[1]
         
-        Database.update_user_settings(user.id, notification_type=notif_type)
+        await AsyncDatabase.update_user_settings(user.id, notification_type=notif_type)
         
         await self.show_notifications_settings(update, context)
     
@@ -745,19 +787,14 @@ class Handlers:
         chat = update.effective_chat
         user = update.effective_user
         
-        Database.add_participant(
-            chat_id=chat.id,
-            user_id=user.id,
-            username=user.username,
-            first_name=user.first_name
-        )
-        Database.link_user_to_trip(user.id, chat.id)
+        if not Database.is_known_member(chat.id, user.id, user.username, user.first_name):
+            await self._register_member(chat.id, user)
         
-        trip = Database.get_trip(chat.id)
+        trip = await AsyncDatabase.get_trip(chat.id)
         if not trip:
             return
         
-        participants = Database.get_participants(chat.id)
+        participants = await AsyncDatabase.get_participants(chat.id)
         
         amount, currency, remaining_text = Utils.parse_currency_from_text(text)
         
@@ -766,12 +803,7 @@ class Handlers:
                 "❌ Неверный формат. Используйте:\n2000 @user описание или\n2000 THB @user описание",
                 reply_to_message_id=update.message.message_id
             )
-            await asyncio.sleep(5)
-            try:
-                await sent.delete()
-                await update.message.delete()
-            except:
-                pass
+            self.autodelete.schedule(chat.id, [sent.message_id, update.message.message_id], delay=5)
             return
         
         if currency is None:
@@ -790,12 +822,7 @@ class Handlers:
                 "Укажите минимум 1 другого участника через @",
                 reply_to_message_id=update.message.message_id
             )
-            await asyncio.sleep(5)
-            try:
-                await sent.delete()
-                await update.message.delete()
-            except:
-                pass
+            self.autodelete.schedule(chat.id, [sent.message_id, update.message.message_id], delay=5)
             return
         
         description_parts = []
@@ -805,7 +832,7 @@ class Handlers:
         
         description = ' '.join(description_parts) if description_parts else "Общий расход"
         
-        debt_result = Database.create_debt(
+        debt_result = await AsyncDatabase.create_debt(
             chat_id=chat.id,
             amount=amount,
             payer_id=payer_id,
@@ -820,12 +847,7 @@ class Handlers:
                 "❌ Ошибка создания долга",
                 reply_to_message_id=update.message.message_id
             )
-            await asyncio.sleep(5)
-            try:
-                await sent.delete()
-                await update.message.delete()
-            except:
-                pass
+            self.autodelete.schedule(chat.id, [sent.message_id, update.message.message_id], delay=5)
             return
         
         debtors = [p for p in mentioned_ids if p != payer_id]
@@ -848,14 +870,10 @@ class Handlers:
             reply_to_message_id=update.message.message_id
         )
         
-        await asyncio.sleep(10)
-        try:
-            await update.message.delete()
-            await sent_response.delete()
-        except:
-            pass
+        self.autodelete.schedule(chat.id, [update.message.message_id, sent_response.message_id], delay=10)
         
-        summary_text = Utils.format_summary(chat.id)
+        summary = await AsyncDatabase.get_debts_summary(chat.id)
+        summary_text = Utils.format_summary(trip, summary, participants)
         await context.bot.send_message(
             chat_id=chat.id,
             text=summary_text,
@@ -863,7 +881,11 @@ class Handlers:
             reply_markup=Keyboards.summary_actions(self.bot_username, chat.id)
         )
         
-        await self.send_debt_notifications(context, chat.id, debt_result, participants, trip)
+        # Рассылка в ЛС — в фоне, чтобы не задерживать следующие апдейты чата
+        context.application.create_task(
+            self.send_debt_notifications(context, chat.id, debt_result, participants, trip),
+            update=update
+        )
     
     async def send_debt_notifications(self, context: ContextTypes.DEFAULT_TYPE, 
                                       chat_id: int, debt_result: dict, 
@@ -878,68 +900,73 @@ class Handlers:
         category = group_data.get('category', '💸')
         currency = group_data.get('currency', trip['currency'])
         
+        # Настройки всех должников — одним запросом
+        settings = await AsyncDatabase.get_user_settings_bulk(
+            [debt['debtor_id'] for debt in individual_debts]
+        )
+        
+        messages = []
         for debt in individual_debts:
             debtor_id = debt['debtor_id']
-            amount = debt['amount']
-            
-            settings = Database.get_user_settings(debtor_id)
-            if settings.get('notification_type') == 'off':
+            if settings[debtor_id].get('notification_type') == 'off':
                 continue
             
-            try:
-                text = (
-                    f"🔔 Новый долг в \"{trip['name']}\"\n\n"
-                    f"{category} {description}\n"
-                    f"💰 Вы должны {payer_name}: {Utils.format_amount(amount, currency)}\n\n"
-                    f"Нажмите /start чтобы посмотреть все долги"
-                )
-                
-                await context.bot.send_message(
-                    chat_id=debtor_id,
-                    text=text
-                )
-            except Exception as e:
-                logger.error(f"Failed to send notification to {debtor_id}: {e}")
-        
-        try:
-            total_owed = sum(d['amount'] for d in individual_debts)
-            text = (
-                f"✅ Долг создан в \"{trip['name']}\"\n\n"
+            messages.append((debtor_id, (
+                f"🔔 Новый долг в \"{trip['name']}\"\n\n"
                 f"{category} {description}\n"
-                f"💰 Вам должны: {Utils.format_amount(total_owed, currency)}\n"
-                f"👥 Должников: {len(individual_debts)}"
-            )
-            
-            await context.bot.send_message(
-                chat_id=payer_id,
-                text=text
+                f"💰 Вы должны {payer_name}: {Utils.format_amount(debt['amount'], currency)}\n\n"
+                f"Нажмите /start чтобы посмотреть все долги"
+            )))
+        
+        total_owed = sum(d['amount'] for d in individual_debts)
+        messages.append((payer_id, (
+            f"✅ Долг создан в \"{trip['name']}\"\n\n"
+            f"{category} {description}\n"
+            f"💰 Вам должны: {Utils.format_amount(total_owed, currency)}\n"
+            f"👥 Должников: {len(individual_debts)}"
+        )))
+        
+        delivered = await self.notifier.send_many(context.bot, messages)
+        logger.debug(f"Debt notifications for chat {chat_id}: {delivered}/{len(messages)} delivered")
+    
+    async def _load_debt_context(self, debt_id: str, chat_id: int = None):
+        """
+        Долг, поездка и участники для карточки долга
+        Если кнопка несёт chat_id, все три чтения идут параллельно
+        """
+        if chat_id:
+            debt, trip, participants = await asyncio.gather(
+                AsyncDatabase.get_debt(debt_id),
+                AsyncDatabase.get_trip(chat_id),
+                AsyncDatabase.get_participants(chat_id)
             )
-        except Exception as e:
-            logger.error(f"Failed to send notification to payer {payer_id}: {e}")
+            if not debt or debt['chat_id'] == chat_id:
+                return debt, trip, participants
+        else:
+            debt = await AsyncDatabase.get_debt(debt_id)
+            if not debt:
+                return None, None, []
+        
+        chat_id = debt['chat_id']
+        trip = await AsyncDatabase.get_trip(chat_id)
+        participants = await AsyncDatabase.get_participants(chat_id)
+        return debt, trip, participants
     
-    async def show_debt_detail(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    async def show_debt_detail(self, update: Update, context: ContextTypes.DEFAULT_TYPE, debt_id: str,
+                               chat_id: int = None):
         """Показать детали конкретного долга с кнопкой оплаты (ДЛЯ ДОЛЖНИКА)"""
         query = update.callback_query
         await query.answer()
         
-        debt_id = query.data.split('_')[2]
-        
-        from firebase_admin import firestore
-        db_instance = firestore.client()
-        
-        debt_doc = db_instance.collection('debts').document(debt_id).get()
-        if not debt_doc.exists:
+        debt, trip, participants = await self._load_debt_context(debt_id, chat_id)
+        if not debt:
             await query.edit_message_text("❌ Долг не найден")
             return
         
-        debt = debt_doc.to_dict()
         chat_id = debt['chat_id']
-        trip = Database.get_trip(chat_id)
-        participants = Database.get_participants(chat_id)
         
-        debt_group = db_instance.collection('debt_groups').document(debt['debt_group_id']).get()
-        if debt_group.exists:
-            group_data = debt_group.to_dict()
+        group_data = await AsyncDatabase.get_debt_group(debt['debt_group_id'])
+        if group_data:
             description = group_data.get('description', 'Долг')
             category = group_data.get('category', '💸')
             currency = group_data.get('currency', trip['currency'])
@@ -961,32 +988,24 @@ class Handlers:
         
         await query.edit_message_text(
             text,
-            reply_markup=Keyboards.debt_pay_button(debt_id)
+            reply_markup=Keyboards.debt_pay_button(chat_id, debt_id)
         )
     
-    async def show_debt_detail_creditor(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    async def show_debt_detail_creditor(self, update: Update, context: ContextTypes.DEFAULT_TYPE, debt_id: str,
+                                        chat_id: int = None):
         """Показать детали долга для КРЕДИТОРА с кнопкой подтверждения"""
         query = update.callback_query
         await query.answer()
         
-        debt_id = query.data.split('_')[3]
-        
-        from firebase_admin import firestore
-        db_instance = firestore.client()
-        
-        debt_doc = db_instance.collection('debts').document(debt_id).get()
-        if not debt_doc.exists:
+        debt, trip, participants = await self._load_debt_context(debt_id, chat_id)
+        if not debt:
             await query.edit_message_text("❌ Долг не найден")
             return
         
-        debt = debt_doc.to_dict()
         chat_id = debt['chat_id']
-        trip = Database.get_trip(chat_id)
-        participants = Database.get_participants(chat_id)
         
-        debt_group = db_instance.collection('debt_groups').document(debt['debt_group_id']).get()
-        if debt_group.exists:
-            group_data = debt_group.to_dict()
+        group_data = await AsyncDatabase.get_debt_group(debt['debt_group_id'])
+        if group_data:
             description = group_data.get('description', 'Долг')
             category = group_data.get('category', '💸')
             currency = group_data.get('currency', trip['currency'])
@@ -1008,17 +1027,15 @@ class Handlers:
         
         await query.edit_message_text(
             text,
-            reply_markup=Keyboards.debt_confirm_button(debt_id)
+            reply_markup=Keyboards.debt_confirm_button(chat_id, debt_id)
         )
     
-    async def pay_debt(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    async def pay_debt(self, update: Update, context: ContextTypes.DEFAULT_TYPE, debt_id: str):
         """Отметить долг как возвращенный (ДОЛЖНИК НАЖАЛ)"""
         query = update.callback_query
         await query.answer("✅ Долг отмечен как возвращенный!")
         
-        debt_id = query.data.split('_')[2]
-        
-        debt_data = Database.mark_debt_paid(debt_id)
+        debt_data = await AsyncDatabase.mark_debt_paid(debt_id)
         
         if not debt_data:
             await query.edit_message_text("❌ Ошибка при обновлении долга")
@@ -1029,21 +1046,17 @@ class Handlers:
         debtor_id = debt_data['debtor_id']
         amount = debt_data['amount']
         
-        trip = Database.get_trip(chat_id)
-        participants = Database.get_participants(chat_id)
+        trip = await AsyncDatabase.get_trip(chat_id)
+        participants = await AsyncDatabase.get_participants(chat_id)
         
         debtor_name = Utils.get_participant_name(debtor_id, participants)
         creditor_name = Utils.get_participant_name(creditor_id, participants)
         
-        from firebase_admin import firestore
-        db_instance = firestore.client()
-        
-        debt_group = db_instance.collection('debt_groups').document(debt_data['debt_group_id']).get()
+        group_data = await AsyncDatabase.get_debt_group(debt_data['debt_group_id'])
         description = "Долг"
         category = "💸"
         currency = trip['currency']
-        if debt_group.exists:
-            group_data = debt_group.to_dict()
+        if group_data:
             description = group_data.get('description', 'Долг')
             category = group_data.get('category', '💸')
             currency = group_data.get('currency', trip['currency'])
@@ -1056,40 +1069,39 @@ class Handlers:
             f"Спасибо за честность! 🎉"
         )
         
-        try:
-            text = (
-                f"💰 Долг возвращен!\n\n"
-                f"👤 {debtor_name} вернул вам долг:\n"
-                f"{category} {description}\n"
-                f"💵 Сумма: {Utils.format_amount(amount, currency)}\n\n"
-                f"Поездка: {trip['name']}"
-            )
-            
-            await context.bot.send_message(
-                chat_id=creditor_id,
-                text=text
-            )
-        except Exception as e:
-            logger.error(f"Failed to notify creditor: {e}")
+        text = (
+            f"💰 Долг возвращен!\n\n"
+            f"👤 {debtor_name} вернул вам долг:\n"
+            f"{category} {description}\n"
+            f"💵 Сумма: {Utils.format_amount(amount, currency)}\n\n"
+            f"Поездка: {trip['name']}"
+        )
+        # В фоне: повторы при RetryAfter/NetworkError не держат очередь чата
+        context.application.create_task(
+            self.notifier.send(context.bot, creditor_id, text),
+            update=update
+        )
         
         try:
-            summary_text = Utils.format_summary(chat_id)
+            summary = await AsyncDatabase.get_debts_summary(chat_id)
+            summary_text = Utils.format_summary(trip, summary, participants)
             await context.bot.send_message(
                 chat_id=chat_id,
-                text=f"✅ {debtor_name} вернул долг {creditor_name}\n\n{summary_text}",
+                text=(
+                    f"✅ {Utils.escape_markdown(debtor_name)} вернул долг "
+                    f"{Utils.escape_markdown(creditor_name)}\n\n{summary_text}"
+                ),
                 parse_mode=ParseMode.MARKDOWN
             )
         except Exception as e:
             logger.error(f"Failed to update group: {e}")
     
-    async def confirm_debt_return(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    async def confirm_debt_return(self, update: Update, context: ContextTypes.DEFAULT_TYPE, debt_id: str):
         """Кредитор подтверждает возврат долга"""
         query = update.callback_query
         await query.answer("✅ Возврат подтверждён!")
         
-        debt_id = query.data.split('_')[2]
-        
-        debt_data = Database.mark_debt_paid(debt_id)
+        debt_data = await AsyncDatabase.mark_debt_paid(debt_id)
         
         if not debt_data:
             await query.edit_message_text("❌ Ошибка при обновлении долга")
@@ -1100,21 +1112,17 @@ class Handlers:
         debtor_id = debt_data['debtor_id']
         amount = debt_data['amount']
         
-        trip = Database.get_trip(chat_id)
-        participants = Database.get_participants(chat_id)
+        trip = await AsyncDatabase.get_trip(chat_id)
+        participants = await AsyncDatabase.get_participants(chat_id)
         
         debtor_name = Utils.get_participant_name(debtor_id, participants)
         creditor_name = Utils.get_participant_name(creditor_id, participants)
         
-        from firebase_admin import firestore
-        db_instance = firestore.client()
-        
-        debt_group = db_instance.collection('debt_groups').document(debt_data['debt_group_id']).get()
+        group_data = await AsyncDatabase.get_debt_group(debt_data['debt_group_id'])
         description = "Долг"
         category = "💸"
         currency = trip['currency']
-        if debt_group.exists:
-            group_data = debt_group.to_dict()
+        if group_data:
             description = group_data.get('description', 'Долг')
             category = group_data.get('category', '💸')
             currency = group_data.get('currency', trip['currency'])
@@ -1127,163 +1135,179 @@ class Handlers:
             f"Спасибо за подтверждение! 🎉"
         )
         
-        try:
-            text = (
-                f"✅ {creditor_name} подтвердил возврат долга\n\n"
-                f"{category} {description}\n"
-                f"💵 Сумма: {Utils.format_amount(amount, currency)}\n\n"
-                f"Поездка: {trip['name']}"
-            )
-            
-            await context.bot.send_message(
-                chat_id=debtor_id,
-                text=text
-            )
-        except Exception as e:
-            logger.error(f"Failed to notify debtor: {e}")
+        text = (
+            f"✅ {creditor_name} подтвердил возврат долга\n\n"
+            f"{category} {description}\n"
+            f"💵 Сумма: {Utils.format_amount(amount, currency)}\n\n"
+            f"Поездка: {trip['name']}"
+        )
+        # В фоне: повторы при RetryAfter/NetworkError не держат очередь чата
+        context.application.create_task(
+            self.notifier.send(context.bot, debtor_id, text),
+            update=update
+        )
         
         try:
-            summary_text = Utils.format_summary(chat_id)
+            summary = await AsyncDatabase.get_debts_summary(chat_id)
+            summary_text = Utils.format_summary(trip, summary, participants)
             await context.bot.send_message(
                 chat_id=chat_id,
-                text=f"✅ {creditor_name} подтвердил возврат от {debtor_name}\n\n{summary_text}",
+                text=(
+                    f"✅ {Utils.escape_markdown(creditor_name)} подтвердил возврат от "
+                    f"{Utils.escape_markdown(debtor_name)}\n\n{summary_text}"
+                ),
                 parse_mode=ParseMode.MARKDOWN
             )
         except Exception as e:
             logger.error(f"Failed to update group: {e}")
     
-    async def callback_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Общий обработчик callback'ов"""
+    async def show_settlement(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Показать упрощённый расчёт: минимум переводов, чтобы закрыть все долги"""
         query = update.callback_query
-        data = query.data
-        
-        if data == "dm_back":
-            return await self.show_dm_cabinet(update, context)
-        
-        elif data == "dm_debts":
-            return await self.show_debts_dm(update, context)
-        
-        elif data == "dm_history":
-            return await self.show_history_dm(update, context)
-        
-        elif data == "dm_notifications":
-            return await self.show_notifications_settings(update, context)
-        
-        elif data == "dm_switch_trip":
-            return await self.show_trip_switch(update, context)
-        
-        elif data.startswith("switch_trip_"):
-            return await self.switch_active_trip(update, context)
-        
-        elif data == "debts_i_owe":
-            return await self.show_i_owe(update, context)
-        
-        elif data == "debts_owe_me":
-            return await self.show_owe_me(update, context)
-        
-        elif data == "debts_refresh":
-            return await self.show_debts_dm(update, context)
-        
-        elif data.startswith("show_debt_creditor_"):
-            return await self.show_debt_detail_creditor(update, context)
+        await query.answer()
         
-        elif data.startswith("confirm_debt_"):
-            return await self.confirm_debt_return(update, context)
+        chat = query.message.chat
+        trip = await AsyncDatabase.get_trip(chat.id)
+        if not trip:
+            return
         
-        elif data.startswith("show_debt_"):
-            return await self.show_debt_detail(update, context)
+        summary = await AsyncDatabase.get_debts_summary(chat.id)
+        transfers = Settlement.simplify(summary)
+        text = Utils.format_settlement(transfers, len(summary), trip.get('participants', []))
         
-        elif data.startswith("pay_debt_"):
-            return await self.pay_debt(update, context)
-
-        elif data == "show_add_expense_info":
-            await query.answer()
-            chat = query.message.chat
-            trip = Database.get_trip(chat.id)
-            if trip:
-                text = (
-                    "➕ *Как добавить долг:*\n\n"
-                    "Просто напишите в чат:\n"
-                    "`сумма @участник1 @участник2 описание`\n\n"
-                    "💡 *Примеры:*\n"
-                    "`2000 @никита @саша такси`\n"
-                    "`500 @катя кофе`\n"
-                    "`15000 @петя @маша @иван отель`\n\n"
-                    "💱 *С другой валютой:*\n"
-                    "`2000 THB @никита такси`\n"
-                    "`500 RUB @катя кофе`\n"
-                    "`1000 CNY @петя сувениры`\n\n"
-                    "Вы автоматически становитесь плательщиком!"
-                )
-                await query.edit_message_text(
-                    text,
-                    parse_mode=ParseMode.MARKDOWN,
-                    reply_markup=InlineKeyboardMarkup([[
-                        InlineKeyboardButton("🔙 На главную", callback_data="back_to_menu")
-                    ]])
-                )
+        await query.edit_message_text(
+            text,
+            reply_markup=InlineKeyboardMarkup([[
+                InlineKeyboardButton("🔙 К сводке", callback_data="show_summary")
+            ]])
+        )
+    
+    async def _report_delete_progress(self, query, done: int, total: int):
+        """Показать прогресс удаления поездки"""
+        try:
+            await query.edit_message_text(f"🗑 Удаляю поездку... {done}/{total}")
+        except Exception as e:
+            logger.debug(f"Failed to report delete progress: {e}")
+    
+    # ============ CALLBACK'И ГРУППОВОГО МЕНЮ ============
+    
+    async def show_add_expense_info(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Подсказка, как добавить долг"""
+        query = update.callback_query
+        await query.answer()
+        chat = query.message.chat
+        trip = await AsyncDatabase.get_trip(chat.id)
+        if trip:
+            text = (
+                "➕ *Как добавить долг:*\n\n"
+                "Просто напишите в чат:\n"
+                "`сумма @участник1 @участник2 описание`\n\n"
+                "💡 *Примеры:*\n"
+                "`2000 @никита @саша такси`\n"
+                "`500 @катя кофе`\n"
+                "`15000 @петя @маша @иван отель`\n\n"
+                "💱 *С другой валютой:*\n"
+                "`2000 THB @никита такси`\n"
+                "`500 RUB @катя кофе`\n"
+                "`1000 CNY @петя сувениры`\n\n"
+                "Вы автоматически становитесь плательщиком!"
+            )
+            await query.edit_message_text(
+                text,
+                parse_mode=ParseMode.MARKDOWN,
+                reply_markup=InlineKeyboardMarkup([[
+                    InlineKeyboardButton("🔙 На главную", callback_data="back_to_menu")
+                ]])
+            )
+    
+    async def confirm_delete_trip(self, update: Update, context: ContextTypes.DEFAULT_TYPE, chat_id: int):
+        """Удалить поездку после подтверждения"""
+        query = update.callback_query
+        await query.answer()
         
-        elif data.startswith("confirm_delete_trip_"):
-            await query.answer()
-            chat_id = int(data.split('_')[3])
-            
-            success = Database.delete_trip_completely(chat_id)
-            
-            if success:
-                await query.edit_message_text(
-                    "✅ *Поездка удалена*\n\n"
-                    "Все долги, история и участники удалены из базы данных.",
-                    parse_mode=ParseMode.MARKDOWN
-                )
-            else:
-                await query.edit_message_text("❌ Ошибка удаления поездки")
+        await query.edit_message_text("🗑 Удаляю поездку...")
         
-        elif data == "cancel_delete_trip":
-            await query.answer()
-            await query.edit_message_text("❌ Удаление отменено")
+        loop = asyncio.get_running_loop()
+        progress_futures = []
+        last_report = [0.0]
         
-        elif data == "show_summary":
-            chat = query.message.chat
-            trip = Database.get_trip(chat.id)
-            if trip:
-                summary_text = Utils.format_summary(chat.id)
-                await query.edit_message_text(
-                    summary_text,
-                    parse_mode=ParseMode.MARKDOWN,
-                    reply_markup=Keyboards.summary_actions(self.bot_username, chat.id)
-                )
-            await query.answer()
+        def on_progress(done, total):
+            # Вызывается из потока БД: не чаще раза в пару секунд
+            now = time.monotonic()
+            if done >= total or now - last_report[0] < 2:
+                return
+            last_report[0] = now
+            progress_futures.append(asyncio.run_coroutine_threadsafe(
+                self._report_delete_progress(query, done, total), loop
+            ))
         
-        elif data == "show_participants":
-            await query.answer()
-            chat = query.message.chat
-            trip = Database.get_trip(chat.id)
-            if trip:
-                participants = Database.get_participants(chat.id)
-                text = f"👥 *Участники* ({len(participants)}):\n\n"
-                for p in participants:
-                    if p.get('username'):
-                        text += f"• @{p['username']} ({p['first_name']})\n"
-                    else:
-                        text += f"• {p['first_name']}\n"
-                await query.edit_message_text(
-                    text,
-                    parse_mode=ParseMode.MARKDOWN,
-                    reply_markup=InlineKeyboardMarkup([[
-                        InlineKeyboardButton("🔙 На главную", callback_data="back_to_menu")
-                    ]])
-                )
+        success = await AsyncDatabase.delete_trip_completely(chat_id, progress_callback=on_progress)
         
-        elif data == "back_to_menu":
-            await query.answer()
-            chat = query.message.chat
-            trip = Database.get_trip(chat.id)
-            if trip:
-                await query.edit_message_text(
-                    f"🎯 *{trip['name']}* — управление:",
-                    parse_mode=ParseMode.MARKDOWN,
-                    reply_markup=Keyboards.main_group_menu()
-                )
+        if progress_futures:
+            await asyncio.gather(*(asyncio.wrap_future(f) for f in progress_futures))
         
+        if success:
+            await query.edit_message_text(
+                "✅ *Поездка удалена*\n\n"
+                "Все долги, история и участники удалены из базы данных.",
+                parse_mode=ParseMode.MARKDOWN
+            )
         else:
-            await query.answer()
+            await query.edit_message_text("❌ Ошибка удаления поездки")
+    
+    async def cancel_delete_trip(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Отмена удаления поездки"""
+        query = update.callback_query
+        await query.answer()
+        await query.edit_message_text("❌ Удаление отменено")
+    
+    async def show_summary_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Сводка долгов по кнопке"""
+        query = update.callback_query
+        chat = query.message.chat
+        trip = await AsyncDatabase.get_trip(chat.id)
+        if trip:
+            summary = await AsyncDatabase.get_debts_summary(chat.id)
+            summary_text = Utils.format_summary(trip, summary, trip.get('participants', []))
+            await query.edit_message_text(
+                summary_text,
+                parse_mode=ParseMode.MARKDOWN,
+                reply_markup=Keyboards.summary_actions(self.bot_username, chat.id)
+            )
+        await query.answer()
+    
+    async def show_participants_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Список участников по кнопке"""
+        query = update.callback_query
+        await query.answer()
+        chat = query.message.chat
+        trip = await AsyncDatabase.get_trip(chat.id)
+        if trip:
+            participants = await AsyncDatabase.get_participants(chat.id)
+            text = f"👥 *Участники* ({len(participants)}):\n\n"
+            for p in participants:
+                first_name = Utils.escape_markdown(p['first_name'])
+                if p.get('username'):
+                    text += f"• @{Utils.escape_markdown(p['username'])} ({first_name})\n"
+                else:
+                    text += f"• {first_name}\n"
+            await query.edit_message_text(
+                text,
+                parse_mode=ParseMode.MARKDOWN,
+                reply_markup=InlineKeyboardMarkup([[
+                    InlineKeyboardButton("🔙 На главную", callback_data="back_to_menu")
+                ]])
+            )
+    
+    async def back_to_menu(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Вернуться в главное меню группы"""
+        query = update.callback_query
+        await query.answer()
+        chat = query.message.chat
+        trip = await AsyncDatabase.get_trip(chat.id)
+        if trip:
+            await query.edit_message_text(
+                f"🎯 *{trip['name']}* — управление:",
+                parse_mode=ParseMode.MARKDOWN,
+                reply_markup=Keyboards.main_group_menu()
+            )
@@ -0,0 +1,78 @@
+import asyncio
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+STATUS_TEXT = {200: 'OK', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+class ServiceHttpServer:
+    """
+    Минимальный служебный HTTP-сервер на asyncio (health, метрики)
+
+    Обработчик маршрута — корутина без аргументов, возвращающая
+    (status, content_type, body). Сервер слушает локальный адрес и
+    не принимает апдейты Telegram — для них есть вебхук PTB.
+    """
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self._routes = {}
+        self._server = None
+
+    def add_route(self, path: str, handler):
+        self._routes[path] = handler
+
+    @staticmethod
+    def json_response(data: dict, status: int = 200):
+        return status, 'application/json', json.dumps(data)
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info(f"Service HTTP server listening on {self.host}:{self.port} ({', '.join(self._routes)})")
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            # Заголовки не нужны, но их надо дочитать до пустой строки
+            while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b'\r\n', b'\n', b''):
+                pass
+
+            parts = request_line.decode('latin-1').split()
+            if len(parts) < 2:
+                return
+            method, path = parts[0], parts[1].split('?', 1)[0]
+
+            handler = self._routes.get(path)
+            if handler is None:
+                status, content_type, body = 404, 'text/plain', 'not found\n'
+            elif method not in ('GET', 'HEAD'):
+                status, content_type, body = 405, 'text/plain', 'method not allowed\n'
+            else:
+                try:
+                    status, content_type, body = await handler()
+                except Exception as e:
+                    logger.error(f"Error in service route {path}: {e}")
+                    status, content_type, body = 500, 'text/plain', 'internal error\n'
+
+            payload = body.encode('utf-8')
+            head = (
+                f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+                f"Content-Type: {content_type}; charset=utf-8\r\n"
+                f"Content-Length: {len(payload)}\r\n"
+                f"Connection: close\r\n\r\n"
+            ).encode('latin-1')
+            writer.write(head if method == 'HEAD' else head + payload)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
@@ -1,5 +1,6 @@
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 from config import CURRENCIES
+from callback_data import CallbackData
 
 
 class Keyboards:
@@ -31,11 +32,11 @@ class Keyboards:
         return InlineKeyboardMarkup(keyboard)
     
     @staticmethod
-    def dm_main_menu(show_switch_trip=False):
-        """Главное меню личного кабинета"""
+    def dm_main_menu(chat_id, show_switch_trip=False):
+        """Главное меню личного кабинета (кнопки несут chat_id активной поездки)"""
         keyboard = [
-            [InlineKeyboardButton("📌 Долги", callback_data="dm_debts")],
-            [InlineKeyboardButton("🧾 История", callback_data="dm_history")],
+            [InlineKeyboardButton("📌 Долги", callback_data=CallbackData.encode('dm_debts', chat_id))],
+            [InlineKeyboardButton("🧾 История", callback_data=CallbackData.encode('dm_history', chat_id))],
         ]
         
         if show_switch_trip:
@@ -46,14 +47,14 @@ class Keyboards:
         return InlineKeyboardMarkup(keyboard)
     
     @staticmethod
-    def debts_tabs():
+    def debts_tabs(chat_id):
         """Вкладки долгов"""
         keyboard = [
             [
-                InlineKeyboardButton("💰 Я должен", callback_data="debts_i_owe"),
-                InlineKeyboardButton("💵 Мне должны", callback_data="debts_owe_me")
+                InlineKeyboardButton("💰 Я должен", callback_data=CallbackData.encode('debts_i_owe', chat_id)),
+                InlineKeyboardButton("💵 Мне должны", callback_data=CallbackData.encode('debts_owe_me', chat_id))
             ],
-            [InlineKeyboardButton("🔄 Обновить", callback_data="debts_refresh")],
+            [InlineKeyboardButton("🔄 Обновить", callback_data=CallbackData.encode('debts_refresh', chat_id))],
             [InlineKeyboardButton("🔙 На главную", callback_data="dm_back")]
         ]
         return InlineKeyboardMarkup(keyboard)
@@ -95,6 +96,7 @@ class Keyboards:
         """Действия под сводкой"""
         keyboard = [
             [InlineKeyboardButton("🔄 Обновить", callback_data="show_summary")],
+            [InlineKeyboardButton("🧮 Как рассчитаться", callback_data="show_settlement")],
             [
                 InlineKeyboardButton(
                     "📌 Мои долги",
@@ -110,17 +112,17 @@ class Keyboards:
         return InlineKeyboardMarkup(keyboard)
     
     @staticmethod
-    def debt_pay_button(debt_id):
+    def debt_pay_button(chat_id, debt_id):
         """Кнопка оплаты долга (для должника)"""
         keyboard = [
-            [InlineKeyboardButton("✅ Вернул долг", callback_data=f"pay_debt_{debt_id}")],
-            [InlineKeyboardButton("🔙 К долгам", callback_data="debts_i_owe")],
+            [InlineKeyboardButton("✅ Вернул долг", callback_data=CallbackData.encode('pay_debt', chat_id, debt_id))],
+            [InlineKeyboardButton("🔙 К долгам", callback_data=CallbackData.encode('debts_i_owe', chat_id))],
             [InlineKeyboardButton("🏠 На главную", callback_data="dm_back")]
         ]
         return InlineKeyboardMarkup(keyboard)
     
     @staticmethod
-    def my_debts_list(debts):
+    def my_debts_list(chat_id, debts):
         """Список моих долгов с кнопками оплаты (должник)"""
         keyboard = []
         
@@ -136,7 +138,7 @@ class Keyboards:
             keyboard.append([
                 InlineKeyboardButton(
                     f"{category} {description}",
-                    callback_data=f"show_debt_{debt['id']}"
+                    callback_data=CallbackData.encode('show_debt', chat_id, debt['id'])
                 )
             ])
         
@@ -144,7 +146,7 @@ class Keyboards:
         return InlineKeyboardMarkup(keyboard)
     
     @staticmethod
-    def debts_to_me_list(debts):
+    def debts_to_me_list(chat_id, debts):
         """Список долгов мне с кнопками подтверждения (кредитор)"""
         keyboard = []
         
@@ -160,7 +162,7 @@ class Keyboards:
             keyboard.append([
                 InlineKeyboardButton(
                     f"{category} {description}",
-                    callback_data=f"show_debt_creditor_{debt['id']}"
+                    callback_data=CallbackData.encode('show_debt_creditor', chat_id, debt['id'])
                 )
             ])
         
@@ -168,11 +170,45 @@ class Keyboards:
         return InlineKeyboardMarkup(keyboard)
     
     @staticmethod
-    def debt_confirm_button(debt_id):
+    def history_pages(chat_id, page):
+        """Листание истории: кнопки несут курсор соседней страницы"""
+        keyboard = []
+        row = []
+        if page and page['newer']:
+            row.append(InlineKeyboardButton(
+                "⬅️ Новее", callback_data=CallbackData.encode('history_newer', chat_id, cursor=page['newer'])
+            ))
+        if page and page['older']:
+            row.append(InlineKeyboardButton(
+                "Раньше ➡️", callback_data=CallbackData.encode('history_older', chat_id, cursor=page['older'])
+            ))
+        if row:
+            keyboard.append(row)
+        keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="dm_back")])
+        return InlineKeyboardMarkup(keyboard)
+    
+    @staticmethod
+    def debt_confirm_button(chat_id, debt_id):
         """Кнопка подтверждения возврата долга (для кредитора)"""
         keyboard = [
-            [InlineKeyboardButton("✅ Подтвердить возврат", callback_data=f"confirm_debt_{debt_id}")],
-            [InlineKeyboardButton("🔙 К долгам", callback_data="debts_owe_me")],
+            [InlineKeyboardButton("✅ Подтвердить возврат", callback_data=CallbackData.encode('confirm_debt', chat_id, debt_id))],
+            [InlineKeyboardButton("🔙 К долгам", callback_data=CallbackData.encode('debts_owe_me', chat_id))],
             [InlineKeyboardButton("🏠 На главную", callback_data="dm_back")]
         ]
         return InlineKeyboardMarkup(keyboard)
+    
+    @staticmethod
+    def trip_switch_list(trips, active_trip_id):
+        """Список поездок для переключения; trips — документы поездок"""
+        keyboard = []
+        for trip in trips:
+            is_active = "✅ " if trip['chat_id'] == active_trip_id else ""
+            keyboard.append([
+                InlineKeyboardButton(
+                    f"{is_active}{trip['name']}",
+                    callback_data=CallbackData.encode('switch_trip', trip['chat_id'])
+                )
+            ])
+        
+        keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="dm_back")])
+        return InlineKeyboardMarkup(keyboard)
@@ -0,0 +1,262 @@
+import asyncio
+import functools
+import threading
+import time
+
+# Границы корзин гистограмм задержки (секунды)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    """Метрика с метками; значения по наборам меток, запись потокобезопасна"""
+
+    type_name = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: expected labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self):
+        """[(суффикс имени, метки, значение)]"""
+        raise NotImplementedError
+
+    def render(self) -> list:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}"
+        ]
+        for suffix, labels, value in self._samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    """Монотонный счётчик (имя по соглашению оканчивается на _total)"""
+
+    type_name = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [('', dict(zip(self.labelnames, key)), value) for key, value in items]
+
+
+class Gauge(Metric):
+    """Текущее значение (обновляется перед выдачей /metrics)"""
+
+    type_name = 'gauge'
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def _samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [('', dict(zip(self.labelnames, key)), value) for key, value in items]
+
+
+class Histogram(Metric):
+    """Гистограмма: накопительные корзины, сумма и количество наблюдений"""
+
+    type_name = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # [счётчики по корзинам (не накопительные), сумма, количество]
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def count(self, **labels) -> int:
+        entry = self._values.get(self._key(labels))
+        return entry[2] if entry else 0
+
+    def _samples(self):
+        with self._lock:
+            items = sorted((key, (list(entry[0]), entry[1], entry[2])) for key, entry in self._values.items())
+
+        samples = []
+        for key, (bucket_counts, total, count) in items:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                samples.append(('_bucket', {**labels, 'le': _format_value(bound)}, cumulative))
+            samples.append(('_bucket', {**labels, 'le': '+Inf'}, count))
+            samples.append(('_sum', labels, total))
+            samples.append(('_count', labels, count))
+        return samples
+
+
+class MetricsRegistry:
+    """Набор метрик процесса и их выдача в текстовом формате Prometheus"""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames=()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames=()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+# ============ МЕТРИКИ БОТА ============
+
+HANDLER_LATENCY = REGISTRY.histogram(
+    'tripsplit_handler_duration_seconds', 'Время работы хендлера', ('handler',))
+HANDLER_ERRORS = REGISTRY.counter(
+    'tripsplit_handler_errors_total', 'Исключения, вылетевшие из хендлера', ('handler',))
+
+DB_LATENCY = REGISTRY.histogram(
+    'tripsplit_db_method_duration_seconds', 'Время выполнения метода Database (в пуле потоков)', ('method',))
+DB_ERRORS = REGISTRY.counter(
+    'tripsplit_db_method_errors_total', 'Исключения, вылетевшие из метода Database', ('method',))
+
+STORAGE_LATENCY = REGISTRY.histogram(
+    'tripsplit_storage_operation_duration_seconds', 'Время операции backend хранилища', ('operation',))
+STORAGE_ERRORS = REGISTRY.counter(
+    'tripsplit_storage_operation_errors_total', 'Сбои операций backend хранилища', ('operation',))
+
+TELEGRAM_LATENCY = REGISTRY.histogram(
+    'tripsplit_telegram_api_duration_seconds', 'Время запроса к Bot API', ('method',))
+TELEGRAM_ERRORS = REGISTRY.counter(
+    'tripsplit_telegram_api_errors_total', 'Неуспешные запросы к Bot API (HTTP-статус или network)',
+    ('method', 'status'))
+TELEGRAM_RETRY_AFTER = REGISTRY.counter(
+    'tripsplit_telegram_retry_after_total', 'Ответы Bot API с флуд-контролем (429 RetryAfter)', ('method',))
+TELEGRAM_RETRY_AFTER_SECONDS = REGISTRY.counter(
+    'tripsplit_telegram_retry_after_seconds_total', 'Суммарное ожидание, назначенное RetryAfter')
+
+STORAGE_WRITES_AVOIDED = REGISTRY.counter(
+    'tripsplit_storage_writes_avoided_total', 'Записи в хранилище, которые не понадобились', ('reason',))
+STORAGE_READS_AVOIDED = REGISTRY.counter(
+    'tripsplit_storage_reads_avoided_total', 'Чтения хранилища, обслуженные из кэша', ('reason',))
+
+UPDATE_QUEUE_SIZE = REGISTRY.gauge(
+    'tripsplit_update_queue_size', 'Апдейты, ожидающие обработки')
+AUTODELETE_PENDING = REGISTRY.gauge(
+    'tripsplit_autodelete_pending', 'Сообщения в очереди на автоудаление')
+
+
+# ============ ИНСТРУМЕНТИРОВАНИЕ ============
+
+def instrument(func, histogram: Histogram, errors: Counter, **labels):
+    """Обернуть функцию или корутину: время в histogram, исключения в errors"""
+    if getattr(func, '_instrumented', False):
+        return func
+
+    if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                errors.inc(**labels)
+                raise
+            finally:
+                histogram.observe(time.perf_counter() - started, **labels)
+    else:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                errors.inc(**labels)
+                raise
+            finally:
+                histogram.observe(time.perf_counter() - started, **labels)
+
+    wrapper._instrumented = True
+    return wrapper
+
+
+def instrument_handlers(handlers):
+    """Все публичные корутины экземпляра Handlers -> метрики tripsplit_handler_*"""
+    for name in dir(type(handlers)):
+        if name.startswith('_'):
+            continue
+        method = getattr(handlers, name)
+        if asyncio.iscoroutinefunction(method):
+            setattr(handlers, name, instrument(method, HANDLER_LATENCY, HANDLER_ERRORS, handler=name))
+
+
+def instrument_static_methods(cls, histogram: Histogram, errors: Counter, label: str):
+    """Статические методы класса (Database) -> метрики; повторный вызов ничего не меняет"""
+    for name, value in list(vars(cls).items()):
+        if isinstance(value, staticmethod) and not name.startswith('_'):
+            setattr(cls, name, staticmethod(instrument(value.__func__, histogram, errors, **{label: name})))
+
+
+def instrument_methods(obj, names, histogram: Histogram, errors: Counter, label: str):
+    """Перечисленные методы объекта (backend хранилища) -> метрики"""
+    for name in names:
+        method = getattr(obj, name, None)
+        if callable(method):
+            setattr(obj, name, instrument(method, histogram, errors, **{label: name}))
@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import time
+
+from telegram.error import Forbidden, BadRequest, NetworkError, RetryAfter
+
+from config import TELEGRAM_GLOBAL_RATE, TELEGRAM_PER_CHAT_INTERVAL, NOTIFY_MAX_RETRIES
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Токен-бакет: не больше rate операций в секунду, всплеск до capacity"""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class NotificationDispatcher:
+    """
+    Параллельная рассылка личных сообщений с учётом лимитов Telegram:
+    ~30 сообщений в секунду на бота и ~1 сообщение в секунду в один чат.
+    RetryAfter и сетевые ошибки повторяются с ожиданием, а не теряются.
+    """
+
+    def __init__(self, global_rate: float = TELEGRAM_GLOBAL_RATE,
+                 per_chat_interval: float = TELEGRAM_PER_CHAT_INTERVAL,
+                 max_retries: int = NOTIFY_MAX_RETRIES):
+        self.global_bucket = TokenBucket(global_rate)
+        self.per_chat_interval = per_chat_interval
+        self.max_retries = max_retries
+        # chat_id -> [lock, время последней отправки]
+        self._chats = {}
+        # RetryAfter — флуд-контроль всего бота: до этого момента не шлём никому
+        self._paused_until = 0.0
+
+    async def _wait_chat_slot(self, chat_id: int):
+        if len(self._chats) > 10000:
+            self._prune_chats()
+        entry = self._chats.setdefault(chat_id, [asyncio.Lock(), 0.0])
+        async with entry[0]:
+            delay = entry[1] + self.per_chat_interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            entry[1] = time.monotonic()
+
+    def _prune_chats(self):
+        """Забыть чаты, в которые давно ничего не отправлялось"""
+        threshold = time.monotonic() - self.per_chat_interval
+        for chat_id, (lock, last_sent) in list(self._chats.items()):
+            if not lock.locked() and last_sent < threshold:
+                del self._chats[chat_id]
+
+    async def send(self, bot, chat_id: int, text: str, **kwargs) -> bool:
+        """Отправить сообщение с ретраями; True, если доставлено"""
+        for attempt in range(self.max_retries + 1):
+            await self._wait_chat_slot(chat_id)
+            pause = self._paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            await self.global_bucket.acquire()
+            try:
+                await bot.send_message(chat_id=chat_id, text=text, **kwargs)
+                return True
+            except RetryAfter as e:
+                logger.warning(f"RetryAfter {e.retry_after}s while notifying {chat_id}")
+                self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+            except (Forbidden, BadRequest) as e:
+                # Пользователь не запускал бота или заблокировал его — повтор не поможет
+                logger.info(f"Cannot notify {chat_id}: {e}")
+                return False
+            except NetworkError as e:
+                backoff = min(2 ** attempt, 30)
+                logger.warning(f"Network error while notifying {chat_id}: {e}, retry in {backoff}s")
+                await asyncio.sleep(backoff)
+            except Exception as e:
+                logger.error(f"Failed to send notification to {chat_id}: {e}")
+                return False
+
+        logger.error(f"Giving up notifying {chat_id} after {self.max_retries} retries")
+        return False
+
+    async def send_many(self, bot, messages: list) -> int:
+        """
+        Разослать сообщения параллельно (в рамках лимитов)
+        messages: [(chat_id, text)]; возвращает количество доставленных
+        """
+        results = await asyncio.gather(*(
+            self.send(bot, chat_id, text) for chat_id, text in messages
+        ))
+        return sum(results)
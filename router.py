@@ -0,0 +1,147 @@
+import logging
+import time
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from callback_data import CallbackData
+
+logger = logging.getLogger(__name__)
+
+# Ключ узла trie, под которым лежит маршрут (символ, которого нет в callback_data)
+ROUTE_KEY = '\0'
+
+
+class CallbackRoute:
+    """Маршрут callback'а: хендлер, типы аргументов и статистика времени"""
+
+    def __init__(self, name: str, handler, arg_types: dict = None):
+        self.name = name
+        self.handler = handler
+        self.arg_types = arg_types or {}
+        self.count = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def parse_args(self, raw: str) -> dict:
+        """'123' -> {'trip_id': 123}; несколько аргументов разделяются '_'"""
+        if not self.arg_types:
+            return {}
+        values = raw.split('_', len(self.arg_types) - 1)
+        if len(values) != len(self.arg_types):
+            raise ValueError(f"Expected {len(self.arg_types)} args for {self.name}, got {raw!r}")
+        return {
+            name: arg_type(value)
+            for (name, arg_type), value in zip(self.arg_types.items(), values)
+        }
+
+    def record(self, seconds: float, failed: bool):
+        self.count += 1
+        self.errors += failed
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+
+    def stats(self) -> dict:
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'avg_ms': round(self.total_seconds / self.count * 1000, 2) if self.count else 0.0,
+            'max_ms': round(self.max_seconds * 1000, 2)
+        }
+
+
+class CallbackRouter:
+    """
+    Маршрутизация callback_data: точные ключи — словарь, префиксы — trie
+    Побеждает самый длинный подходящий префикс, поэтому порядок регистрации
+    не важен ('show_debt_creditor_' не перекрывается 'show_debt_').
+    Упакованные кнопки (CallbackData) маршрутизируются по коду действия.
+    """
+
+    def __init__(self):
+        self._exact = {}
+        self._trie = {}
+        self._actions = {}
+        self._routes = []
+
+    def add_exact(self, routes: dict):
+        """Зарегистрировать точные ключи: {callback_data: handler}"""
+        for key, handler in routes.items():
+            route = CallbackRoute(key, handler)
+            self._exact[key] = route
+            self._routes.append(route)
+
+    def add_prefix(self, prefix: str, handler, **arg_types):
+        """Зарегистрировать префикс; остаток callback_data разбирается в arg_types по порядку"""
+        route = CallbackRoute(f"{prefix}*", handler, arg_types)
+        node = self._trie
+        for char in prefix:
+            node = node.setdefault(char, {})
+        node[ROUTE_KEY] = route
+        self._routes.append(route)
+
+    def add_action(self, action: str, handler, *fields):
+        """
+        Зарегистрировать действие упакованных кнопок
+        fields — поля контекста кнопки ('chat_id', 'debt_id', 'cursor'), которые получит хендлер
+        """
+        route = CallbackRoute(f"{action}#", handler)
+        self._actions[action] = (route, fields)
+        self._routes.append(route)
+
+    def resolve(self, data: str):
+        """Найти маршрут: (route, kwargs) или (None, None); O(длины ключа)"""
+        if CallbackData.is_packed(data):
+            action, values = CallbackData.decode(data)
+            if action not in self._actions:
+                return None, None
+            route, fields = self._actions[action]
+            return route, {field: values[field] for field in fields if field in values}
+
+        route = self._exact.get(data)
+        if route:
+            return route, {}
+
+        node = self._trie
+        match, match_length = None, 0
+        for i, char in enumerate(data):
+            node = node.get(char)
+            if node is None:
+                break
+            if ROUTE_KEY in node:
+                match, match_length = node[ROUTE_KEY], i + 1
+
+        if match is None:
+            return None, None
+        return match, match.parse_args(data[match_length:])
+
+    async def dispatch(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Хендлер для CallbackQueryHandler"""
+        query = update.callback_query
+        data = query.data or ''
+
+        try:
+            route, kwargs = self.resolve(data)
+        except ValueError as e:
+            logger.warning(f"Bad callback data {data!r}: {e}")
+            route = None
+
+        if route is None:
+            await query.answer()
+            return
+
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = await route.handler(update, context, **kwargs)
+            failed = False
+            return result
+        finally:
+            elapsed = time.perf_counter() - started
+            route.record(elapsed, failed)
+            logger.debug(f"Callback {route.name} handled in {elapsed * 1000:.1f} ms")
+
+    def stats(self) -> dict:
+        """Статистика по маршрутам: {name: {'count', 'errors', 'avg_ms', 'max_ms'}}"""
+        return {route.name: route.stats() for route in self._routes}
@@ -0,0 +1,99 @@
+class Settlement:
+    """Упрощение долгов: минимальный набор переводов, закрывающий все балансы"""
+
+    @staticmethod
+    def net_balances(summary: list):
+        """
+        Чистый баланс каждого участника по валютам (в центах)
+        summary: результат Database.get_debts_summary
+        Возвращает {currency: {user_id: cents}}, > 0 — ему должны, < 0 — должен он
+        """
+        totals = {}
+        for item in summary:
+            currency_totals = totals.get(item['currency'])
+            if currency_totals is None:
+                currency_totals = totals[item['currency']] = {}
+            amount = item['total_amount']
+            debtor_id = item['debtor_id']
+            creditor_id = item['creditor_id']
+            currency_totals[debtor_id] = currency_totals.get(debtor_id, 0) - amount
+            currency_totals[creditor_id] = currency_totals.get(creditor_id, 0) + amount
+
+        # Округляем один раз на участника, а не на каждую пару;
+        # остаток округления достаётся участнику с самым большим балансом,
+        # чтобы сумма по валюте оставалась нулевой
+        balances = {}
+        for currency, currency_totals in totals.items():
+            cents = {user_id: round(total * 100) for user_id, total in currency_totals.items()}
+            residue = sum(cents.values())
+            if residue:
+                user_id = max(cents, key=lambda u: abs(cents[u]))
+                cents[user_id] -= residue
+            balances[currency] = {user_id: value for user_id, value in cents.items() if value}
+        return balances
+
+    @staticmethod
+    def settle_currency(balances: dict):
+        """
+        Переводы для одной валюты: [(debtor_id, creditor_id, cents)]
+        Сначала закрываются точные совпадения сумм, остальное — жадно:
+        крупнейшие должники платят крупнейшим кредиторам (не больше n - 1 переводов)
+        """
+        transfers = []
+
+        creditors_by_amount = {}
+        for user_id, cents in balances.items():
+            if cents > 0:
+                creditors_by_amount.setdefault(cents, []).append(user_id)
+
+        debtors = []
+        for user_id, cents in balances.items():
+            if cents < 0:
+                matched = creditors_by_amount.get(-cents)
+                if matched:
+                    transfers.append((user_id, matched.pop(), -cents))
+                else:
+                    debtors.append([-cents, user_id])
+
+        creditors = [
+            [cents, user_id]
+            for cents, user_ids in creditors_by_amount.items()
+            for user_id in user_ids
+        ]
+        debtors.sort(reverse=True)
+        creditors.sort(reverse=True)
+
+        i = j = 0
+        while i < len(debtors) and j < len(creditors):
+            debtor = debtors[i]
+            creditor = creditors[j]
+            cents = min(debtor[0], creditor[0])
+            transfers.append((debtor[1], creditor[1], cents))
+
+            debtor[0] -= cents
+            creditor[0] -= cents
+            if not debtor[0]:
+                i += 1
+            if not creditor[0]:
+                j += 1
+
+        return transfers
+
+    @staticmethod
+    def simplify(summary: list):
+        """
+        Упрощённый расчёт по сводке долгов
+        Возвращает [{'debtor_id', 'creditor_id', 'currency', 'amount'}], отсортировано по валюте и сумме
+        """
+        result = []
+        for currency, balances in sorted(Settlement.net_balances(summary).items()):
+            transfers = Settlement.settle_currency(balances)
+            transfers.sort(key=lambda transfer: -transfer[2])
+            for debtor_id, creditor_id, cents in transfers:
+                result.append({
+                    'debtor_id': debtor_id,
+                    'creditor_id': creditor_id,
+                    'currency': currency,
+                    'amount': cents / 100
+                })
+        return result
@@ -0,0 +1,299 @@
+import logging
+import threading
+
+from config import STORAGE_BACKEND
+from metrics import STORAGE_LATENCY, STORAGE_ERRORS, instrument_methods
+
+logger = logging.getLogger(__name__)
+
+
+# ============ BALANCES ============
+
+def balance_key(debtor_id: int, creditor_id: int, currency: str):
+    return f"{debtor_id}_{creditor_id}_{currency}"
+
+
+def balance_pairs(debts):
+    """Сгруппировать долги по (должник, кредитор, валюта) -> {key: pair}"""
+    pairs = {}
+    for debt in debts:
+        currency = debt.get('currency', 'EUR')
+        key = balance_key(debt['debtor_id'], debt['creditor_id'], currency)
+        if key not in pairs:
+            pairs[key] = {
+                'debtor_id': debt['debtor_id'],
+                'creditor_id': debt['creditor_id'],
+                'currency': currency,
+                'total_amount': 0
+            }
+        pairs[key]['total_amount'] += debt['amount']
+    return pairs
+
+
+# ============ ЖУРНАЛ СОБЫТИЙ ============
+# trips/{chat_id}/events: только дописывается, в той же транзакции/батче, что и изменение.
+# События самодостаточны (кроме описания группы у погашения), по ним можно восстановить состояние.
+
+def trip_created_event(trip_data: dict) -> dict:
+    return {
+        'type': 'trip_created',
+        'created_at': trip_data.get('created_at'),
+        'name': trip_data['name'],
+        'currency': trip_data['currency'],
+        'creator_id': trip_data.get('creator_id')
+    }
+
+
+def member_joined_event(participant: dict) -> dict:
+    return {
+        'type': 'member_joined',
+        'created_at': participant['joined_at'],
+        'user_id': participant['user_id'],
+        'username': participant.get('username') or '',
+        'first_name': participant.get('first_name')
+    }
+
+
+def debt_created_event(group_id: str, group_data: dict, debts: list, debt_ids: list) -> dict:
+    return {
+        'type': 'debt_created',
+        'created_at': group_data.get('created_at'),
+        'debt_group_id': group_id,
+        'payer_id': group_data['payer_id'],
+        'total_amount': group_data['total_amount'],
+        'currency': group_data['currency'],
+        'description': group_data.get('description'),
+        'category': group_data.get('category'),
+        'participants': group_data['all_participants'],
+        'debts': [
+            {'id': debt_id, 'debtor_id': debt['debtor_id'], 'creditor_id': debt['creditor_id'],
+             'amount': debt['amount']}
+            for debt_id, debt in zip(debt_ids, debts)
+        ]
+    }
+
+
+def debt_paid_event(debt_id: str, debt: dict, paid_at) -> dict:
+    return {
+        'type': 'debt_paid',
+        'created_at': paid_at,
+        'debt_id': debt_id,
+        'debt_group_id': debt['debt_group_id'],
+        'debtor_id': debt['debtor_id'],
+        'creditor_id': debt['creditor_id'],
+        'amount': debt['amount'],
+        'currency': debt.get('currency', 'EUR')
+    }
+
+
+def debt_deleted_event(group_id: str, group_data: dict, cancelled_ids: list, deleted_at) -> dict:
+    """cancelled_ids — непогашенные долги группы, которые удаление списало"""
+    return {
+        'type': 'debt_deleted',
+        'created_at': deleted_at,
+        'debt_group_id': group_id,
+        'payer_id': group_data['payer_id'],
+        'total_amount': group_data['total_amount'],
+        'currency': group_data.get('currency', 'EUR'),
+        'description': group_data.get('description'),
+        'category': group_data.get('category'),
+        'debt_ids': cancelled_ids
+    }
+
+
+# ============ INTERFACE ============
+
+class StorageBackend:
+    """
+    Хранилище данных бота: поездки, долги, балансы, настройки пользователей
+
+    Backend только читает и пишет данные и бросает исключения при сбоях;
+    кэши, значения по умолчанию и логирование ошибок — в database.Database.
+    Методы синхронные и вызываются из пула потоков AsyncDatabase.
+    Документы возвращаются словарями в формате Firestore (даты — datetime,
+    у долгов и групп — поле 'id').
+    """
+
+    name = 'base'
+
+    # ---- Поездки ----
+
+    def create_trip(self, trip_data: dict):
+        """Записать поездку вместе с событием trip_created"""
+        raise NotImplementedError
+
+    def get_trip(self, chat_id: int):
+        """
+        Поездка со списком participants или None
+        event_log=True — поездка создана с журналом событий (у старых поездок его нет)
+        """
+        raise NotImplementedError
+
+    def get_trips(self, chat_ids: list):
+        """Несколько поездок одним запросом -> {chat_id: поездка}; отсутствующих нет в ответе"""
+        raise NotImplementedError
+
+    def save_participant(self, chat_id: int, participant: dict):
+        """
+        Добавить участника или обновить его поля — одной записью по user_id, без чтения поездки
+        participant: user_id и записываемые поля (при вступлении — все, включая joined_at)
+        Вступление (есть joined_at) пишет в той же записи событие member_joined.
+        """
+        raise NotImplementedError
+
+    def delete_trip(self, chat_id: int, user_ids: list, progress_callback=None):
+        """
+        Удалить поездку со всеми долгами и балансом, убрать её из user_trips участников
+        Возвращает (количество долгов, количество групп)
+        """
+        raise NotImplementedError
+
+    # ---- Долги ----
+
+    def create_debt_group(self, group_data: dict, debts: list):
+        """Атомарно записать группу, её долги, изменение баланса и событие -> (group_id, [debt_id])"""
+        raise NotImplementedError
+
+    def get_debt_groups(self, chat_id: int):
+        """Неудалённые группы поездки, новые первыми"""
+        raise NotImplementedError
+
+    def get_debt_groups_page(self, chat_id: int, limit: int, after: tuple = None, newer: bool = False):
+        """
+        Страница неудалённых групп поездки по (created_at, id): новые первыми, при newer — старые первыми
+        after — (created_at, id) последней показанной записи; сама она в страницу не входит
+        """
+        raise NotImplementedError
+
+    def get_paid_debts_page(self, chat_id: int, limit: int, after: tuple = None, newer: bool = False):
+        """Страница погашенных долгов поездки по (paid_at, id) — как get_debt_groups_page"""
+        raise NotImplementedError
+
+    def get_events_page(self, chat_id: int, limit: int, after: tuple = None, newer: bool = False):
+        """Страница журнала событий поездки по (created_at, id) — как get_debt_groups_page"""
+        raise NotImplementedError
+
+    def get_debt_group(self, debt_group_id: str):
+        raise NotImplementedError
+
+    def get_debt_groups_by_ids(self, debt_group_ids: list):
+        """Несколько групп одним запросом -> {id: data}"""
+        raise NotImplementedError
+
+    def query_debts(self, chat_id: int, debtor_id: int = None, creditor_id: int = None,
+                    is_paid: bool = None, newest_first: bool = False):
+        """Индивидуальные долги поездки с фильтрами (None — без фильтра)"""
+        raise NotImplementedError
+
+    def get_debt(self, debt_id: str):
+        raise NotImplementedError
+
+    def mark_debt_paid(self, debt_id: str, paid_at):
+        """Атомарно отметить долг погашенным, уменьшить баланс и записать событие -> данные долга или None"""
+        raise NotImplementedError
+
+    def delete_debt_group(self, debt_group_id: str):
+        """Атомарно пометить группу и её непогашенные долги удалёнными, записать событие -> найдена ли группа"""
+        raise NotImplementedError
+
+    # ---- Балансы ----
+
+    def get_balances(self, chat_id: int):
+        """Сохранённый баланс поездки {key: pair} или None, если его нужно пересчитать"""
+        raise NotImplementedError
+
+    def compute_balances(self, chat_id: int):
+        """Баланс по сырым непогашенным долгам"""
+        raise NotImplementedError
+
+    def rebuild_balances(self, chat_id: int):
+        """Пересчитать и сохранить баланс -> {key: pair}"""
+        raise NotImplementedError
+
+    # ---- Пользователи ----
+
+    def get_user_settings(self, user_id: int):
+        raise NotImplementedError
+
+    def get_user_settings_bulk(self, user_ids: list):
+        """-> {user_id: settings} только для найденных"""
+        raise NotImplementedError
+
+    def update_user_settings(self, user_id: int, fields: dict):
+        raise NotImplementedError
+
+    def get_user_trips(self, user_id: int):
+        """{'active_trip', 'trips', 'updated_at'} или None"""
+        raise NotImplementedError
+
+    def link_user_to_trip(self, user_id: int, chat_id: int, has_active_trip: bool = False):
+        """
+        Добавить поездку в список пользователя; активной она становится, если активной нет
+        has_active_trip=True — вызывающий знает, что активная поездка уже есть (запись без чтения)
+        """
+        raise NotImplementedError
+
+    def set_active_trip(self, user_id: int, chat_id: int):
+        raise NotImplementedError
+
+    # ---- Отложенное удаление сообщений ----
+
+    def add_pending_deletions(self, chat_id: int, messages: dict):
+        raise NotImplementedError
+
+    def get_pending_deletions(self):
+        """{chat_id: {message_id: due_at}}"""
+        raise NotImplementedError
+
+    def remove_pending_deletions(self, chat_id: int, message_ids: list):
+        """Удалить записи перечисленных сообщений; остальные сообщения чата не трогаются"""
+        raise NotImplementedError
+
+    # ---- Служебное ----
+
+    def warm_up(self):
+        """Открыть соединение заранее, чтобы первый апдейт не платил за его установку"""
+
+
+# ============ ВЫБОР BACKEND ============
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def create_backend(name: str) -> StorageBackend:
+    """Создать backend по имени; зависимости импортируются только для выбранного"""
+    if name == 'firestore':
+        from storage_firestore import FirestoreBackend
+        return FirestoreBackend()
+    if name == 'sqlite':
+        from config import SQLITE_PATH
+        from storage_sqlite import SqliteBackend
+        return SqliteBackend(SQLITE_PATH)
+    raise ValueError(f"Unknown storage backend: {name}")
+
+
+def _instrumented(backend: StorageBackend) -> StorageBackend:
+    """Операции интерфейса StorageBackend -> метрики tripsplit_storage_operation_*"""
+    operations = [name for name, value in vars(StorageBackend).items()
+                  if callable(value) and not name.startswith('_')]
+    instrument_methods(backend, operations, STORAGE_LATENCY, STORAGE_ERRORS, 'operation')
+    return backend
+
+
+def get_backend() -> StorageBackend:
+    """Текущий backend; создаётся при первом обращении (STORAGE_BACKEND)"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = _instrumented(create_backend(STORAGE_BACKEND))
+                logger.info(f"Storage backend: {_backend.name}")
+    return _backend
+
+
+def set_backend(backend: StorageBackend):
+    """Подменить backend (локальный запуск, бенчмарки)"""
+    global _backend
+    with _backend_lock:
+        _backend = _instrumented(backend)
@@ -0,0 +1,514 @@
+import firebase_admin
+from firebase_admin import credentials, firestore
+from google.cloud.firestore_v1.field_path import FieldPath
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+import json
+import logging
+import os
+
+from config import BULK_WRITE_CONCURRENCY
+from storage import (
+    StorageBackend,
+    balance_pairs,
+    debt_created_event,
+    debt_deleted_event,
+    debt_paid_event,
+    member_joined_event,
+    trip_created_event,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def initialize_firebase():
+    """Безопасная инициализация Firebase"""
+    if firebase_admin._apps:
+        logger.info("Firebase already initialized")
+        return firestore.client()
+
+    firebase_creds = os.getenv('FIREBASE_CREDENTIALS')
+
+    if firebase_creds:
+        try:
+            cred_dict = json.loads(firebase_creds)
+            cred = credentials.Certificate(cred_dict)
+            logger.info("Firebase credentials loaded from environment variable")
+        except json.JSONDecodeError as e:
+            logger.error(f"Failed to parse FIREBASE_CREDENTIALS: {e}")
+            raise
+    else:
+        try:
+            cred = credentials.Certificate('firebase_key.json')
+            logger.info("Firebase credentials loaded from local file")
+        except FileNotFoundError:
+            logger.error("Firebase credentials not found. Set FIREBASE_CREDENTIALS environment variable.")
+            raise
+
+    firebase_admin.initialize_app(cred)
+    logger.info("Firebase initialized successfully")
+    return firestore.client()
+
+
+# Лимит операций в одном WriteBatch Firestore
+BATCH_MAX_OPS = 500
+
+
+class FirestoreBackend(StorageBackend):
+    """Хранилище в Firebase Firestore"""
+
+    name = 'firestore'
+
+    def __init__(self, client=None):
+        self.db = client or initialize_firebase()
+        # Отдельный пул для параллельных коммитов батчей: сам bulk-метод уже
+        # выполняется в пуле AsyncDatabase, и ожидание задач из того же пула могло бы его занять
+        self._bulk_executor = ThreadPoolExecutor(
+            max_workers=BULK_WRITE_CONCURRENCY, thread_name_prefix='firestore-bulk'
+        )
+
+    def warm_up(self):
+        # Любой запрос поднимает gRPC-канал и получает токен доступа
+        self.db.collection('trips').document('_warmup').get()
+
+    # ============ HELPERS ============
+
+    def _docs_by_ids(self, collection: str, doc_ids):
+        """Прочитать несколько документов одним запросом get_all -> {id: data}"""
+        doc_ids = [doc_id for doc_id in dict.fromkeys(doc_ids) if doc_id]
+        if not doc_ids:
+            return {}
+
+        refs = [self.db.collection(collection).document(doc_id) for doc_id in doc_ids]
+        return {
+            doc.id: doc.to_dict()
+            for doc in self.db.get_all(refs)
+            if doc.exists
+        }
+
+    def _commit_bulk(self, ops, progress_callback=None):
+        """
+        Выполнить операции пачками по BATCH_MAX_OPS, коммитя батчи параллельно.
+        ops: список ('delete', ref) или ('update', ref, data)
+        progress_callback(done, total) вызывается после каждого батча (из рабочего потока)
+        """
+        total = len(ops)
+        if not total:
+            return 0
+
+        def commit_chunk(chunk):
+            batch = self.db.batch()
+            for op in chunk:
+                if op[0] == 'delete':
+                    batch.delete(op[1])
+                else:
+                    batch.update(op[1], op[2])
+            batch.commit()
+            return len(chunk)
+
+        chunks = [ops[i:i + BATCH_MAX_OPS] for i in range(0, total, BATCH_MAX_OPS)]
+        futures = [self._bulk_executor.submit(commit_chunk, chunk) for chunk in chunks]
+
+        done = 0
+        for future in as_completed(futures):
+            done += future.result()
+            if progress_callback:
+                try:
+                    progress_callback(done, total)
+                except Exception as e:
+                    logger.error(f"Error in bulk progress callback: {e}")
+        return done
+
+    @staticmethod
+    def _with_id(doc):
+        data = doc.to_dict()
+        data['id'] = doc.id
+        return data
+
+    def _balance_ref(self, chat_id: int):
+        return self.db.collection('balances').document(str(chat_id))
+
+    def _events(self, chat_id: int):
+        return self.db.collection('trips').document(str(chat_id)).collection('events')
+
+    @staticmethod
+    def _balance_delta(chat_id: int, debts, sign: int):
+        """Инкрементальное изменение balances/{chat_id} для set(..., merge=True)"""
+        pairs = balance_pairs(debts)
+        for pair in pairs.values():
+            pair['total_amount'] = firestore.Increment(sign * pair['total_amount'])
+        return {
+            'chat_id': chat_id,
+            'pairs': pairs,
+            'updated_at': datetime.now()
+        }
+
+    # ============ ПОЕЗДКИ ============
+
+    def create_trip(self, trip_data: dict):
+        data = {key: value for key, value in trip_data.items() if key != 'participants'}
+        data['members'] = {str(p['user_id']): p for p in trip_data.get('participants', [])}
+        chat_id = trip_data['chat_id']
+
+        batch = self.db.batch()
+        batch.set(self.db.collection('trips').document(str(chat_id)), data)
+        # Пустой инициализированный баланс: новой поездке не нужен пересчёт по всем долгам
+        batch.set(self._balance_ref(chat_id), {
+            'chat_id': chat_id,
+            'pairs': {},
+            'initialized': True,
+            'updated_at': datetime.now()
+        })
+        batch.set(self._events(chat_id).document(), trip_created_event(trip_data))
+        batch.commit()
+
+    def get_trip(self, chat_id: int):
+        doc = self.db.collection('trips').document(str(chat_id)).get()
+        return self._trip_from_doc(doc.to_dict()) if doc.exists else None
+
+    def get_trips(self, chat_ids: list):
+        docs = self._docs_by_ids('trips', [str(chat_id) for chat_id in chat_ids])
+        return {int(doc_id): self._trip_from_doc(data) for doc_id, data in docs.items()}
+
+    @staticmethod
+    def _trip_from_doc(data: dict) -> dict:
+        """
+        Участники хранятся картой members {user_id: участник}; у старых поездок —
+        ещё и массивом participants. Записи members дополняют и перекрывают массив,
+        наружу отдаётся список participants в порядке вступления.
+        """
+        members = data.pop('members', None) or {}
+        by_id = {p['user_id']: p for p in data.get('participants') or []}
+
+        joined = []
+        for key, member in members.items():
+            user_id = member.setdefault('user_id', int(key))
+            if user_id in by_id:
+                by_id[user_id] = {**by_id[user_id], **member}
+            else:
+                joined.append(member)
+        joined.sort(key=lambda m: (m.get('joined_at') is None, m.get('joined_at') or 0))
+
+        data['participants'] = list(by_id.values()) + joined
+        return data
+
+    def save_participant(self, chat_id: int, participant: dict):
+        # Пишутся только поля members.<user_id>.*: без чтения документа,
+        # одновременные вступления не затирают друг друга
+        user_id = str(participant['user_id'])
+        fields = {
+            FieldPath('members', user_id, field).to_api_repr(): value
+            for field, value in participant.items()
+        }
+        trip_ref = self.db.collection('trips').document(str(chat_id))
+        if 'joined_at' not in participant:
+            trip_ref.update(fields)
+            return
+
+        batch = self.db.batch()
+        batch.update(trip_ref, fields)
+        batch.set(self._events(chat_id).document(), member_joined_event(participant))
+        batch.commit()
+
+    def delete_trip(self, chat_id: int, user_ids: list, progress_callback=None):
+        # Только ссылки на документы, без содержимого
+        debts = self.db.collection('debts')\
+            .where('chat_id', '==', chat_id)\
+            .select(['__name__'])\
+            .stream()
+        debt_refs = [debt.reference for debt in debts]
+
+        debt_groups = self.db.collection('debt_groups')\
+            .where('chat_id', '==', chat_id)\
+            .select(['__name__'])\
+            .stream()
+        group_refs = [dg.reference for dg in debt_groups]
+
+        # Подколлекции не удаляются вместе с документом поездки
+        event_refs = [event.reference for event in self._events(chat_id).select(['__name__']).stream()]
+
+        ops = [('delete', ref) for ref in debt_refs + group_refs + event_refs + [self._balance_ref(chat_id)]]
+
+        user_trips = self._docs_by_ids('user_trips', [str(user_id) for user_id in user_ids])
+        for user_id, data in user_trips.items():
+            update = {
+                'trips': firestore.ArrayRemove([chat_id]),
+                'updated_at': datetime.now()
+            }
+            if data.get('active_trip') == chat_id:
+                remaining = [t for t in data.get('trips', []) if t != chat_id]
+                update['active_trip'] = remaining[0] if remaining else None
+            ops.append(('update', self.db.collection('user_trips').document(user_id), update))
+
+        self._commit_bulk(ops, progress_callback)
+
+        # Документ поездки — последним, чтобы при сбое удаление можно было повторить
+        self.db.collection('trips').document(str(chat_id)).delete()
+        return len(debt_refs), len(group_refs)
+
+    # ============ ДОЛГИ ============
+
+    def create_debt_group(self, group_data: dict, debts: list):
+        # Группа и все индивидуальные долги пишутся одним батчем:
+        # один сетевой запрос и никаких "половинчатых" групп при сбое
+        batch = self.db.batch()
+
+        debt_group_ref = self.db.collection('debt_groups').document()
+        batch.set(debt_group_ref, group_data)
+
+        debt_ids = []
+        for debt_data in debts:
+            debt_ref = self.db.collection('debts').document()
+            batch.set(debt_ref, dict(debt_data, debt_group_id=debt_group_ref.id))
+            debt_ids.append(debt_ref.id)
+
+        chat_id = group_data['chat_id']
+        batch.set(self._balance_ref(chat_id), self._balance_delta(chat_id, debts, 1), merge=True)
+        batch.set(self._events(chat_id).document(),
+                  debt_created_event(debt_group_ref.id, group_data, debts, debt_ids))
+
+        batch.commit()
+        return debt_group_ref.id, debt_ids
+
+    def get_debt_groups(self, chat_id: int):
+        debt_groups = self.db.collection('debt_groups')\
+            .where('chat_id', '==', chat_id)\
+            .where('is_deleted', '==', False)\
+            .order_by('created_at', direction=firestore.Query.DESCENDING)\
+            .stream()
+        return [self._with_id(dg) for dg in debt_groups]
+
+    def get_debt_groups_page(self, chat_id: int, limit: int, after: tuple = None, newer: bool = False):
+        query = self.db.collection('debt_groups')\
+            .where('chat_id', '==', chat_id)\
+            .where('is_deleted', '==', False)
+        return self._page(query, 'created_at', limit, after, newer)
+
+    def get_paid_debts_page(self, chat_id: int, limit: int, after: tuple = None, newer: bool = False):
+        query = self.db.collection('debts')\
+            .where('chat_id', '==', chat_id)\
+            .where('is_paid', '==', True)
+        return self._page(query, 'paid_at', limit, after, newer)
+
+    def get_events_page(self, chat_id: int, limit: int, after: tuple = None, newer: bool = False):
+        # Подколлекция одной поездки: хватает автоматических индексов по одному полю
+        return self._page(self._events(chat_id), 'created_at', limit, after, newer)
+
+    def _page(self, query, field: str, limit: int, after: tuple, newer: bool):
+        """
+        Keyset-пагинация: order_by(field, ID документа) + start_after(курсор) + limit
+        Составные индексы для debt_groups и debts — в firestore.indexes.json
+        (firebase deploy --only firestore:indexes), без них запрос падает с FAILED_PRECONDITION
+        """
+        direction = firestore.Query.ASCENDING if newer else firestore.Query.DESCENDING
+        query = query.order_by(field, direction=direction)\
+            .order_by(FieldPath.document_id(), direction=direction)
+        if after is not None:
+            query = query.start_after({field: after[0], FieldPath.document_id(): after[1]})
+        return [self._with_id(doc) for doc in query.limit(limit).stream()]
+
+    def get_debt_group(self, debt_group_id: str):
+        doc = self.db.collection('debt_groups').document(debt_group_id).get()
+        return doc.to_dict() if doc.exists else None
+
+    def get_debt_groups_by_ids(self, debt_group_ids: list):
+        return self._docs_by_ids('debt_groups', debt_group_ids)
+
+    def query_debts(self, chat_id: int, debtor_id: int = None, creditor_id: int = None,
+                    is_paid: bool = None, newest_first: bool = False):
+        query = self.db.collection('debts').where('chat_id', '==', chat_id)
+        if debtor_id is not None:
+            query = query.where('debtor_id', '==', debtor_id)
+        if creditor_id is not None:
+            query = query.where('creditor_id', '==', creditor_id)
+        if is_paid is not None:
+            query = query.where('is_paid', '==', is_paid)
+        if newest_first:
+            query = query.order_by('created_at', direction=firestore.Query.DESCENDING)
+        return [self._with_id(debt) for debt in query.stream()]
+
+    def get_debt(self, debt_id: str):
+        doc = self.db.collection('debts').document(debt_id).get()
+        return self._with_id(doc) if doc.exists else None
+
+    def mark_debt_paid(self, debt_id: str, paid_at):
+        debt_ref = self.db.collection('debts').document(debt_id)
+
+        @firestore.transactional
+        def pay(transaction):
+            snapshot = debt_ref.get(transaction=transaction)
+            if not snapshot.exists:
+                return None
+
+            data = snapshot.to_dict()
+            if data.get('is_paid'):
+                return data
+
+            transaction.update(debt_ref, {
+                'is_paid': True,
+                'paid_at': paid_at
+            })
+            if not data.get('is_deleted'):
+                transaction.set(
+                    self._balance_ref(data['chat_id']),
+                    self._balance_delta(data['chat_id'], [data], -1),
+                    merge=True
+                )
+            transaction.set(self._events(data['chat_id']).document(), debt_paid_event(debt_id, data, paid_at))
+            data['is_paid'] = True
+            data['paid_at'] = paid_at
+            return data
+
+        return pay(self.db.transaction())
+
+    def delete_debt_group(self, debt_group_id: str):
+        group_ref = self.db.collection('debt_groups').document(debt_group_id)
+
+        @firestore.transactional
+        def delete(transaction):
+            group = group_ref.get(transaction=transaction)
+            if not group.exists:
+                return False
+
+            group_data = group.to_dict()
+            if group_data.get('is_deleted'):
+                return True
+
+            unpaid = self.db.collection('debts')\
+                .where('debt_group_id', '==', debt_group_id)\
+                .where('is_paid', '==', False)\
+                .stream(transaction=transaction)
+            unpaid = [(debt.reference, debt.to_dict()) for debt in unpaid]
+
+            deleted_at = datetime.now()
+            transaction.update(group_ref, {
+                'is_deleted': True,
+                'deleted_at': deleted_at
+            })
+            for debt_ref, _ in unpaid:
+                transaction.update(debt_ref, {'is_deleted': True})
+            chat_id = group_data['chat_id']
+            transaction.set(
+                self._events(chat_id).document(),
+                debt_deleted_event(debt_group_id, group_data, [ref.id for ref, _ in unpaid], deleted_at)
+            )
+            if unpaid:
+                transaction.set(
+                    self._balance_ref(chat_id),
+                    self._balance_delta(chat_id, [data for _, data in unpaid], -1),
+                    merge=True
+                )
+            return True
+
+        return delete(self.db.transaction())
+
+    # ============ БАЛАНСЫ ============
+
+    def get_balances(self, chat_id: int):
+        doc = self._balance_ref(chat_id).get()
+        data = doc.to_dict() if doc.exists else None
+        if data and data.get('initialized'):
+            return data.get('pairs', {})
+        return None
+
+    def compute_balances(self, chat_id: int, transaction=None):
+        debts = self.db.collection('debts')\
+            .where('chat_id', '==', chat_id)\
+            .where('is_paid', '==', False)\
+            .stream(transaction=transaction)
+
+        return balance_pairs(
+            data for data in (debt.to_dict() for debt in debts)
+            if not data.get('is_deleted')
+        )
+
+    def rebuild_balances(self, chat_id: int):
+        balance_ref = self._balance_ref(chat_id)
+
+        @firestore.transactional
+        def rebuild(transaction):
+            pairs = self.compute_balances(chat_id, transaction=transaction)
+            transaction.set(balance_ref, {
+                'chat_id': chat_id,
+                'pairs': pairs,
+                'initialized': True,
+                'updated_at': datetime.now()
+            })
+            return pairs
+
+        return rebuild(self.db.transaction())
+
+    # ============ ПОЛЬЗОВАТЕЛИ ============
+
+    def get_user_settings(self, user_id: int):
+        doc = self.db.collection('user_settings').document(str(user_id)).get()
+        return doc.to_dict() if doc.exists else None
+
+    def get_user_settings_bulk(self, user_ids: list):
+        docs = self._docs_by_ids('user_settings', [str(user_id) for user_id in user_ids])
+        return {int(user_id): data for user_id, data in docs.items()}
+
+    def update_user_settings(self, user_id: int, fields: dict):
+        self.db.collection('user_settings').document(str(user_id)).set(fields, merge=True)
+
+    def get_user_trips(self, user_id: int):
+        doc = self.db.collection('user_trips').document(str(user_id)).get()
+        return doc.to_dict() if doc.exists else None
+
+    def link_user_to_trip(self, user_id: int, chat_id: int, has_active_trip: bool = False):
+        doc_ref = self.db.collection('user_trips').document(str(user_id))
+
+        def trips_update():
+            return {
+                'trips': firestore.ArrayUnion([chat_id]),
+                'updated_at': datetime.now()
+            }
+
+        # Активная поездка уже есть — одна запись без чтения, ArrayUnion не теряет
+        # поездки при одновременных вызовах
+        if has_active_trip:
+            doc_ref.set(trips_update(), merge=True)
+            return
+
+        # Иначе active_trip ставится, только если пуст: чтение и запись в транзакции.
+        # Изменение собирается заново на каждой попытке: повтор после конфликта
+        # не должен нести active_trip из предыдущего чтения
+        @firestore.transactional
+        def link(transaction):
+            snapshot = doc_ref.get(transaction=transaction)
+            data = snapshot.to_dict() if snapshot.exists else {}
+            update = trips_update()
+            if not data.get('active_trip'):
+                update['active_trip'] = chat_id
+            transaction.set(doc_ref, update, merge=True)
+
+        link(self.db.transaction())
+
+    def set_active_trip(self, user_id: int, chat_id: int):
+        self.db.collection('user_trips').document(str(user_id)).update({
+            'active_trip': chat_id,
+            'updated_at': datetime.now()
+        })
+
+    # ============ ОТЛОЖЕННОЕ УДАЛЕНИЕ ============
+
+    def add_pending_deletions(self, chat_id: int, messages: dict):
+        self.db.collection('pending_deletions').document(str(chat_id)).set({
+            'chat_id': chat_id,
+            'messages': {str(message_id): due_at for message_id, due_at in messages.items()}
+        }, merge=True)
+
+    def get_pending_deletions(self):
+        result = {}
+        for doc in self.db.collection('pending_deletions').stream():
+            data = doc.to_dict()
+            messages = {int(mid): due_at for mid, due_at in data.get('messages', {}).items()}
+            if messages:
+                result[data['chat_id']] = messages
+        return result
+
+    def remove_pending_deletions(self, chat_id: int, message_ids: list):
+        # set(merge=True), а не update: не падает, если документ ещё не записан
+        self.db.collection('pending_deletions').document(str(chat_id)).set({
+            'messages': {str(message_id): firestore.DELETE_FIELD for message_id in message_ids}
+        }, merge=True)
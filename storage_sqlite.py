@@ -0,0 +1,627 @@
+import json
+import logging
+import secrets
+import sqlite3
+import string
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+from storage import (
+    StorageBackend,
+    balance_key,
+    debt_created_event,
+    debt_deleted_event,
+    debt_paid_event,
+    member_joined_event,
+    trip_created_event,
+)
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS trips (
+    chat_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    currency TEXT NOT NULL,
+    creator_id INTEGER,
+    created_at REAL,
+    is_active INTEGER NOT NULL DEFAULT 1
+);
+
+CREATE TABLE IF NOT EXISTS participants (
+    chat_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    username TEXT NOT NULL DEFAULT '',
+    first_name TEXT,
+    joined_at REAL,
+    PRIMARY KEY (chat_id, user_id)
+);
+
+CREATE TABLE IF NOT EXISTS debt_groups (
+    id TEXT PRIMARY KEY,
+    chat_id INTEGER NOT NULL,
+    total_amount REAL NOT NULL,
+    currency TEXT NOT NULL,
+    payer_id INTEGER NOT NULL,
+    all_participants TEXT NOT NULL,
+    description TEXT,
+    category TEXT,
+    created_at REAL,
+    is_deleted INTEGER NOT NULL DEFAULT 0,
+    deleted_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_debt_groups_chat ON debt_groups (chat_id, is_deleted, created_at);
+
+CREATE TABLE IF NOT EXISTS debts (
+    id TEXT PRIMARY KEY,
+    debt_group_id TEXT NOT NULL,
+    chat_id INTEGER NOT NULL,
+    debtor_id INTEGER NOT NULL,
+    creditor_id INTEGER NOT NULL,
+    amount REAL NOT NULL,
+    currency TEXT NOT NULL,
+    is_paid INTEGER NOT NULL DEFAULT 0,
+    paid_at REAL,
+    created_at REAL,
+    is_deleted INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_debts_chat_paid ON debts (chat_id, is_paid);
+CREATE INDEX IF NOT EXISTS idx_debts_paid_at ON debts (chat_id, is_paid, paid_at);
+CREATE INDEX IF NOT EXISTS idx_debts_debtor ON debts (chat_id, debtor_id, is_paid);
+CREATE INDEX IF NOT EXISTS idx_debts_creditor ON debts (chat_id, creditor_id, is_paid);
+CREATE INDEX IF NOT EXISTS idx_debts_group ON debts (debt_group_id, is_paid);
+
+CREATE TABLE IF NOT EXISTS trip_events (
+    id TEXT PRIMARY KEY,
+    chat_id INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    created_at REAL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_trip_events_chat ON trip_events (chat_id, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_trip_events_type ON trip_events (chat_id, type);
+
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    active_trip INTEGER,
+    updated_at REAL
+);
+
+CREATE TABLE IF NOT EXISTS user_trips (
+    user_id INTEGER NOT NULL,
+    chat_id INTEGER NOT NULL,
+    PRIMARY KEY (user_id, chat_id)
+);
+CREATE INDEX IF NOT EXISTS idx_user_trips_chat ON user_trips (chat_id);
+
+CREATE TABLE IF NOT EXISTS user_settings (
+    user_id INTEGER PRIMARY KEY,
+    data TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS pending_deletions (
+    chat_id INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    due_at REAL NOT NULL,
+    PRIMARY KEY (chat_id, message_id)
+);
+"""
+
+# ID документов в формате автоматических ID Firestore (упаковываются в CallbackData)
+ID_ALPHABET = string.ascii_letters + string.digits
+ID_LENGTH = 20
+
+# Максимум параметров в одном IN (...)
+MAX_VARIABLES = 500
+
+
+def _new_id():
+    return ''.join(secrets.choice(ID_ALPHABET) for _ in range(ID_LENGTH))
+
+
+def _ts(value):
+    return value.timestamp() if value is not None else None
+
+
+def _dt(value):
+    return datetime.fromtimestamp(value) if value is not None else None
+
+
+def _insert_event(conn, chat_id: int, event: dict):
+    """Дописать событие в журнал поездки (внутри транзакции изменения)"""
+    data = {key: value for key, value in event.items() if key not in ('type', 'created_at')}
+    conn.execute(
+        "INSERT INTO trip_events (id, chat_id, type, created_at, data) VALUES (?, ?, ?, ?, ?)",
+        (_new_id(), chat_id, event['type'], _ts(event['created_at']), json.dumps(data))
+    )
+
+
+def _event_from_row(row):
+    return dict(json.loads(row['data']), id=row['id'], type=row['type'], created_at=_dt(row['created_at']))
+
+
+def _page_condition(column: str, after: tuple, newer: bool):
+    """
+    Условие keyset-пагинации по (column, id) после курсора (дата, id) -> (SQL, параметры)
+    Даты хранятся как REAL, поэтому сравнение идёт с точностью до микросекунды:
+    курсор, прошедший через datetime, может отличаться от записанного значения в последнем бите.
+    """
+    if after is None:
+        return '', ()
+    micros = round(after[0].timestamp() * 1_000_000)
+    low, high = (micros - 0.5) / 1_000_000, (micros + 0.5) / 1_000_000
+    if newer:
+        return f" AND ({column} > ? OR ({column} > ? AND id > ?))", (high, low, after[1])
+    return f" AND ({column} < ? OR ({column} < ? AND id < ?))", (low, high, after[1])
+
+
+def _placeholders(count: int):
+    return ','.join('?' * count)
+
+
+def _chunks(values: list):
+    return [values[i:i + MAX_VARIABLES] for i in range(0, len(values), MAX_VARIABLES)]
+
+
+def _debt_from_row(row):
+    return {
+        'id': row['id'],
+        'debt_group_id': row['debt_group_id'],
+        'chat_id': row['chat_id'],
+        'debtor_id': row['debtor_id'],
+        'creditor_id': row['creditor_id'],
+        'amount': row['amount'],
+        'currency': row['currency'],
+        'is_paid': bool(row['is_paid']),
+        'paid_at': _dt(row['paid_at']),
+        'created_at': _dt(row['created_at']),
+        'is_deleted': bool(row['is_deleted'])
+    }
+
+
+def _group_from_row(row):
+    group = {
+        'chat_id': row['chat_id'],
+        'total_amount': row['total_amount'],
+        'currency': row['currency'],
+        'payer_id': row['payer_id'],
+        'all_participants': json.loads(row['all_participants']),
+        'description': row['description'],
+        'category': row['category'],
+        'created_at': _dt(row['created_at']),
+        'is_deleted': bool(row['is_deleted'])
+    }
+    if row['deleted_at'] is not None:
+        group['deleted_at'] = _dt(row['deleted_at'])
+    return group
+
+
+class SqliteBackend(StorageBackend):
+    """
+    Локальное хранилище в SQLite для установки на одном сервере
+
+    WAL: читатели не блокируют писателя, у каждого потока пула своё соединение.
+    Балансы не хранятся отдельно — это агрегат SUM(...) GROUP BY по индексу
+    (chat_id, is_paid), поэтому пересчитывать и сверять их не нужно.
+    ':memory:' — одна общая база в памяти под блокировкой (бенчмарки, локальный запуск).
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, path: str):
+        self.path = path
+        self._memory = path == ':memory:'
+        self._local = threading.local()
+        self._lock = threading.RLock()
+        self._shared = self._connect() if self._memory else None
+
+        with self._conn() as conn:
+            conn.executescript(SCHEMA)
+        logger.info(f"SQLite storage ready: {path}")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        if not self._memory:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA busy_timeout=5000')
+        return conn
+
+    @contextmanager
+    def _conn(self):
+        """Соединение текущего потока (или общее — для базы в памяти)"""
+        if self._memory:
+            with self._lock:
+                yield self._shared
+            return
+
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        yield conn
+
+    @contextmanager
+    def _transaction(self):
+        """Пишущая транзакция: BEGIN IMMEDIATE сразу берёт блокировку записи"""
+        with self._conn() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+
+    def warm_up(self):
+        with self._conn() as conn:
+            conn.execute('SELECT 1 FROM trips LIMIT 1').fetchall()
+
+    # ============ ПОЕЗДКИ ============
+
+    def create_trip(self, trip_data: dict):
+        chat_id = trip_data['chat_id']
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO trips (chat_id, name, currency, creator_id, created_at, is_active) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (chat_id, trip_data['name'], trip_data['currency'], trip_data.get('creator_id'),
+                 _ts(trip_data.get('created_at')), int(trip_data.get('is_active', True)))
+            )
+            conn.execute("DELETE FROM participants WHERE chat_id = ?", (chat_id,))
+            for participant in trip_data.get('participants', []):
+                self._upsert_participant(conn, chat_id, participant)
+            _insert_event(conn, chat_id, trip_created_event(trip_data))
+
+    def get_trip(self, chat_id: int):
+        return self.get_trips([chat_id]).get(chat_id)
+
+    def get_trips(self, chat_ids: list):
+        ids = list(dict.fromkeys(chat_ids))
+        trips = {}
+        with self._conn() as conn:
+            for chunk in _chunks(ids):
+                placeholders = _placeholders(len(chunk))
+                # Поездки с журналом событий начинаются с trip_created
+                rows = conn.execute(
+                    "SELECT *, EXISTS (SELECT 1 FROM trip_events e WHERE e.chat_id = trips.chat_id "
+                    f"AND e.type = 'trip_created') AS event_log FROM trips WHERE chat_id IN ({placeholders})",
+                    chunk
+                )
+                for row in rows:
+                    trips[row['chat_id']] = {
+                        'chat_id': row['chat_id'],
+                        'name': row['name'],
+                        'currency': row['currency'],
+                        'creator_id': row['creator_id'],
+                        'created_at': _dt(row['created_at']),
+                        'is_active': bool(row['is_active']),
+                        'participants': []
+                    }
+                    if row['event_log']:
+                        trips[row['chat_id']]['event_log'] = True
+                participants = conn.execute(
+                    "SELECT chat_id, user_id, username, first_name, joined_at FROM participants "
+                    f"WHERE chat_id IN ({placeholders}) ORDER BY rowid",
+                    chunk
+                )
+                for p in participants:
+                    if p['chat_id'] in trips:
+                        trips[p['chat_id']]['participants'].append({
+                            'user_id': p['user_id'],
+                            'username': p['username'],
+                            'first_name': p['first_name'],
+                            'joined_at': _dt(p['joined_at'])
+                        })
+        return trips
+
+    @staticmethod
+    def _upsert_participant(conn, chat_id: int, participant: dict):
+        conn.execute(
+            "INSERT INTO participants (chat_id, user_id, username, first_name, joined_at) "
+            "VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (chat_id, user_id) DO UPDATE SET "
+            "username = excluded.username, first_name = excluded.first_name",
+            (chat_id, participant['user_id'], participant.get('username') or '',
+             participant.get('first_name'), _ts(participant.get('joined_at')))
+        )
+
+    def save_participant(self, chat_id: int, participant: dict):
+        with self._transaction() as conn:
+            self._upsert_participant(conn, chat_id, participant)
+            if 'joined_at' in participant:
+                _insert_event(conn, chat_id, member_joined_event(participant))
+
+    def delete_trip(self, chat_id: int, user_ids: list, progress_callback=None):
+        with self._transaction() as conn:
+            debts = conn.execute("DELETE FROM debts WHERE chat_id = ?", (chat_id,)).rowcount
+            groups = conn.execute("DELETE FROM debt_groups WHERE chat_id = ?", (chat_id,)).rowcount
+            conn.execute("DELETE FROM participants WHERE chat_id = ?", (chat_id,))
+            conn.execute("DELETE FROM trip_events WHERE chat_id = ?", (chat_id,))
+
+            affected = [row['user_id'] for row in conn.execute(
+                "SELECT user_id FROM user_trips WHERE chat_id = ?", (chat_id,)
+            )]
+            conn.execute("DELETE FROM user_trips WHERE chat_id = ?", (chat_id,))
+            # Активной становится первая из оставшихся поездок пользователя
+            conn.execute(
+                "UPDATE users SET updated_at = ?, active_trip = ("
+                "    SELECT chat_id FROM user_trips WHERE user_trips.user_id = users.user_id "
+                "    ORDER BY rowid LIMIT 1"
+                ") WHERE active_trip = ?",
+                (_ts(datetime.now()), chat_id)
+            )
+            conn.execute("DELETE FROM trips WHERE chat_id = ?", (chat_id,))
+
+        total = debts + groups + len(affected)
+        if progress_callback and total:
+            progress_callback(total, total)
+        return debts, groups
+
+    # ============ ДОЛГИ ============
+
+    def create_debt_group(self, group_data: dict, debts: list):
+        group_id = _new_id()
+        debt_ids = [_new_id() for _ in debts]
+
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO debt_groups (id, chat_id, total_amount, currency, payer_id, all_participants, "
+                "description, category, created_at, is_deleted) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (group_id, group_data['chat_id'], group_data['total_amount'], group_data['currency'],
+                 group_data['payer_id'], json.dumps(group_data['all_participants']),
+                 group_data.get('description'), group_data.get('category'),
+                 _ts(group_data.get('created_at')), int(group_data.get('is_deleted', False)))
+            )
+            conn.executemany(
+                "INSERT INTO debts (id, debt_group_id, chat_id, debtor_id, creditor_id, amount, currency, "
+                "is_paid, paid_at, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (debt_id, group_id, debt['chat_id'], debt['debtor_id'], debt['creditor_id'],
+                     debt['amount'], debt['currency'], int(debt.get('is_paid', False)),
+                     _ts(debt.get('paid_at')), _ts(debt.get('created_at')))
+                    for debt_id, debt in zip(debt_ids, debts)
+                ]
+            )
+            _insert_event(conn, group_data['chat_id'], debt_created_event(group_id, group_data, debts, debt_ids))
+        return group_id, debt_ids
+
+    def get_debt_groups(self, chat_id: int):
+        with self._conn() as conn:
+            rows = conn.execute(
+                "SELECT * FROM debt_groups WHERE chat_id = ? AND is_deleted = 0 ORDER BY created_at DESC",
+                (chat_id,)
+            ).fetchall()
+        return [dict(_group_from_row(row), id=row['id']) for row in rows]
+
+    def get_debt_groups_page(self, chat_id: int, limit: int, after: tuple = None, newer: bool = False):
+        where, params = _page_condition('created_at', after, newer)
+        order = 'ASC' if newer else 'DESC'
+        with self._conn() as conn:
+            rows = conn.execute(
+                f"SELECT * FROM debt_groups WHERE chat_id = ? AND is_deleted = 0{where} "
+                f"ORDER BY created_at {order}, id {order} LIMIT ?",
+                (chat_id, *params, limit)
+            ).fetchall()
+        return [dict(_group_from_row(row), id=row['id']) for row in rows]
+
+    def get_paid_debts_page(self, chat_id: int, limit: int, after: tuple = None, newer: bool = False):
+        where, params = _page_condition('paid_at', after, newer)
+        order = 'ASC' if newer else 'DESC'
+        with self._conn() as conn:
+            rows = conn.execute(
+                f"SELECT * FROM debts WHERE chat_id = ? AND is_paid = 1 AND paid_at IS NOT NULL{where} "
+                f"ORDER BY paid_at {order}, id {order} LIMIT ?",
+                (chat_id, *params, limit)
+            )
+            return [_debt_from_row(row) for row in rows]
+
+    def get_events_page(self, chat_id: int, limit: int, after: tuple = None, newer: bool = False):
+        where, params = _page_condition('created_at', after, newer)
+        order = 'ASC' if newer else 'DESC'
+        with self._conn() as conn:
+            rows = conn.execute(
+                f"SELECT * FROM trip_events WHERE chat_id = ?{where} "
+                f"ORDER BY created_at {order}, id {order} LIMIT ?",
+                (chat_id, *params, limit)
+            )
+            return [_event_from_row(row) for row in rows]
+
+    def get_debt_group(self, debt_group_id: str):
+        with self._conn() as conn:
+            row = conn.execute("SELECT * FROM debt_groups WHERE id = ?", (debt_group_id,)).fetchone()
+        return _group_from_row(row) if row else None
+
+    def get_debt_groups_by_ids(self, debt_group_ids: list):
+        ids = [group_id for group_id in dict.fromkeys(debt_group_ids) if group_id]
+        result = {}
+        with self._conn() as conn:
+            for chunk in _chunks(ids):
+                rows = conn.execute(
+                    f"SELECT * FROM debt_groups WHERE id IN ({_placeholders(len(chunk))})", chunk
+                )
+                result.update((row['id'], _group_from_row(row)) for row in rows)
+        return result
+
+    def query_debts(self, chat_id: int, debtor_id: int = None, creditor_id: int = None,
+                    is_paid: bool = None, newest_first: bool = False):
+        sql = "SELECT * FROM debts WHERE chat_id = ?"
+        params = [chat_id]
+        if debtor_id is not None:
+            sql += " AND debtor_id = ?"
+            params.append(debtor_id)
+        if creditor_id is not None:
+            sql += " AND creditor_id = ?"
+            params.append(creditor_id)
+        if is_paid is not None:
+            sql += " AND is_paid = ?"
+            params.append(int(is_paid))
+        if newest_first:
+            sql += " ORDER BY created_at DESC"
+
+        with self._conn() as conn:
+            return [_debt_from_row(row) for row in conn.execute(sql, params)]
+
+    def get_debt(self, debt_id: str):
+        with self._conn() as conn:
+            row = conn.execute("SELECT * FROM debts WHERE id = ?", (debt_id,)).fetchone()
+        return _debt_from_row(row) if row else None
+
+    def mark_debt_paid(self, debt_id: str, paid_at):
+        with self._transaction() as conn:
+            row = conn.execute("SELECT * FROM debts WHERE id = ?", (debt_id,)).fetchone()
+            if row is None:
+                return None
+
+            data = _debt_from_row(row)
+            del data['id']
+            if data['is_paid']:
+                return data
+
+            conn.execute("UPDATE debts SET is_paid = 1, paid_at = ? WHERE id = ?", (_ts(paid_at), debt_id))
+            _insert_event(conn, data['chat_id'], debt_paid_event(debt_id, data, paid_at))
+
+        data['is_paid'] = True
+        data['paid_at'] = paid_at
+        return data
+
+    def delete_debt_group(self, debt_group_id: str):
+        with self._transaction() as conn:
+            row = conn.execute("SELECT * FROM debt_groups WHERE id = ?", (debt_group_id,)).fetchone()
+            if row is None:
+                return False
+            if row['is_deleted']:
+                return True
+
+            cancelled_ids = [debt['id'] for debt in conn.execute(
+                "SELECT id FROM debts WHERE debt_group_id = ? AND is_paid = 0 AND is_deleted = 0", (debt_group_id,)
+            )]
+            deleted_at = datetime.now()
+            conn.execute(
+                "UPDATE debt_groups SET is_deleted = 1, deleted_at = ? WHERE id = ?",
+                (_ts(deleted_at), debt_group_id)
+            )
+            conn.execute(
+                "UPDATE debts SET is_deleted = 1 WHERE debt_group_id = ? AND is_paid = 0",
+                (debt_group_id,)
+            )
+            _insert_event(conn, row['chat_id'],
+                          debt_deleted_event(debt_group_id, _group_from_row(row), cancelled_ids, deleted_at))
+        return True
+
+    # ============ БАЛАНСЫ ============
+
+    def get_balances(self, chat_id: int):
+        return self.compute_balances(chat_id)
+
+    def compute_balances(self, chat_id: int):
+        with self._conn() as conn:
+            rows = conn.execute(
+                "SELECT debtor_id, creditor_id, currency, SUM(amount) AS total_amount FROM debts "
+                "WHERE chat_id = ? AND is_paid = 0 AND is_deleted = 0 "
+                "GROUP BY debtor_id, creditor_id, currency",
+                (chat_id,)
+            ).fetchall()
+
+        return {
+            balance_key(row['debtor_id'], row['creditor_id'], row['currency']): {
+                'debtor_id': row['debtor_id'],
+                'creditor_id': row['creditor_id'],
+                'currency': row['currency'],
+                'total_amount': row['total_amount']
+            }
+            for row in rows
+        }
+
+    def rebuild_balances(self, chat_id: int):
+        return self.compute_balances(chat_id)
+
+    # ============ ПОЛЬЗОВАТЕЛИ ============
+
+    def get_user_settings(self, user_id: int):
+        with self._conn() as conn:
+            row = conn.execute("SELECT data FROM user_settings WHERE user_id = ?", (user_id,)).fetchone()
+        return json.loads(row['data']) if row else None
+
+    def get_user_settings_bulk(self, user_ids: list):
+        ids = list(dict.fromkeys(user_ids))
+        result = {}
+        with self._conn() as conn:
+            for chunk in _chunks(ids):
+                rows = conn.execute(
+                    f"SELECT user_id, data FROM user_settings WHERE user_id IN ({_placeholders(len(chunk))})",
+                    chunk
+                )
+                result.update((row['user_id'], json.loads(row['data'])) for row in rows)
+        return result
+
+    def update_user_settings(self, user_id: int, fields: dict):
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO user_settings (user_id, data) VALUES (?, ?) "
+                "ON CONFLICT (user_id) DO UPDATE SET data = json_patch(data, excluded.data)",
+                (user_id, json.dumps(fields))
+            )
+
+    def get_user_trips(self, user_id: int):
+        with self._conn() as conn:
+            user = conn.execute(
+                "SELECT active_trip, updated_at FROM users WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            if user is None:
+                return None
+            trips = conn.execute(
+                "SELECT chat_id FROM user_trips WHERE user_id = ? ORDER BY rowid", (user_id,)
+            ).fetchall()
+
+        return {
+            'active_trip': user['active_trip'],
+            'trips': [row['chat_id'] for row in trips],
+            'updated_at': _dt(user['updated_at'])
+        }
+
+    def link_user_to_trip(self, user_id: int, chat_id: int, has_active_trip: bool = False):
+        with self._transaction() as conn:
+            conn.execute("INSERT OR IGNORE INTO user_trips (user_id, chat_id) VALUES (?, ?)", (user_id, chat_id))
+            conn.execute(
+                "INSERT INTO users (user_id, active_trip, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (user_id) DO UPDATE SET "
+                "active_trip = COALESCE(NULLIF(users.active_trip, 0), excluded.active_trip), "
+                "updated_at = excluded.updated_at",
+                (user_id, chat_id, _ts(datetime.now()))
+            )
+
+    def set_active_trip(self, user_id: int, chat_id: int):
+        with self._transaction() as conn:
+            updated = conn.execute(
+                "UPDATE users SET active_trip = ?, updated_at = ? WHERE user_id = ?",
+                (chat_id, _ts(datetime.now()), user_id)
+            ).rowcount
+        if not updated:
+            raise LookupError(f"User {user_id} has no trips")
+
+    # ============ ОТЛОЖЕННОЕ УДАЛЕНИЕ ============
+
+    def add_pending_deletions(self, chat_id: int, messages: dict):
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO pending_deletions (chat_id, message_id, due_at) VALUES (?, ?, ?)",
+                [(chat_id, message_id, due_at) for message_id, due_at in messages.items()]
+            )
+
+    def get_pending_deletions(self):
+        result = {}
+        with self._conn() as conn:
+            for row in conn.execute("SELECT chat_id, message_id, due_at FROM pending_deletions"):
+                result.setdefault(row['chat_id'], {})[row['message_id']] = row['due_at']
+        return result
+
+    def remove_pending_deletions(self, chat_id: int, message_ids: list):
+        with self._transaction() as conn:
+            for chunk in _chunks(list(message_ids)):
+                conn.execute(
+                    f"DELETE FROM pending_deletions WHERE chat_id = ? "
+                    f"AND message_id IN ({_placeholders(len(chunk))})",
+                    [chat_id, *chunk]
+                )
@@ -0,0 +1,149 @@
+import base64
+
+import pytest
+
+from callback_data import ACTIONS, MARKER, MAX_LENGTH, VERSION, CallbackData
+
+FIRESTORE_ID = 'aZ09bY18cX27dW36eV45'
+SQLITE_ID = '42'
+
+
+def pack(raw: bytes) -> str:
+    """Собрать callback_data из сырых байтов (для повреждённых данных)"""
+    return MARKER + base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def unpack(data: str) -> bytes:
+    payload = data[len(MARKER):]
+    return base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4))
+
+
+# ============ round trip ============
+
+@pytest.mark.parametrize('chat_id', [0, 1, -1, 63, -64, 64, -1001234567890, 2 ** 52, -(2 ** 52)])
+def test_chat_id_round_trip(chat_id):
+    data = CallbackData.encode('switch_trip', chat_id=chat_id)
+    assert CallbackData.decode(data) == ('switch_trip', {'chat_id': chat_id})
+
+
+def test_zigzag_keeps_small_negative_ids_short():
+    # -1 и 1 после zigzag — 1 и 2, один байт varint
+    assert len(unpack(CallbackData.encode('switch_trip', chat_id=-1))) == 3
+    assert len(unpack(CallbackData.encode('switch_trip', chat_id=1))) == 3
+
+
+@pytest.mark.parametrize('debt_id', [
+    FIRESTORE_ID,
+    'AAAAAAAAAAAAAAAAAAAA',
+    '99999999999999999999',
+    SQLITE_ID,
+    'aZ09bY18cX27dW36eV4',
+    'aZ09bY18cX27dW36eV4-',
+    'долг',
+])
+def test_debt_id_round_trip(debt_id):
+    data = CallbackData.encode('show_debt_creditor', chat_id=-100123, debt_id=debt_id)
+    assert CallbackData.decode(data) == ('show_debt_creditor', {'chat_id': -100123, 'debt_id': debt_id})
+
+
+def test_firestore_debt_id_is_packed_as_base62():
+    data = CallbackData.encode('show_debt_creditor', chat_id=-1001234567890, debt_id=FIRESTORE_ID)
+    # Заголовок, действие, chat_id varint и 15 байт вместо 20 символов
+    assert len(unpack(data)) == 2 + 6 + 15
+    assert len(data) < len(f'show_debt_creditor_{FIRESTORE_ID}')
+
+
+@pytest.mark.parametrize('cursor', [
+    (0, FIRESTORE_ID),
+    (1_760_000_000_123_456, FIRESTORE_ID),
+    (1_760_000_000_123_456, SQLITE_ID),
+    (1_760_000_000_123_456, ''),
+])
+@pytest.mark.parametrize('action', ['history_older', 'history_newer'])
+def test_cursor_round_trip(action, cursor):
+    data = CallbackData.encode(action, chat_id=-1001234567890, cursor=cursor)
+    assert CallbackData.decode(data) == (action, {'chat_id': -1001234567890, 'cursor': cursor})
+
+
+def test_cursor_and_debt_together():
+    data = CallbackData.encode('show_debt', chat_id=-5, debt_id=SQLITE_ID, cursor=(10, FIRESTORE_ID))
+    assert CallbackData.decode(data) == ('show_debt', {'chat_id': -5, 'cursor': (10, FIRESTORE_ID), 'debt_id': SQLITE_ID})
+
+
+@pytest.mark.parametrize('action', ACTIONS)
+def test_every_action_round_trips(action):
+    data = CallbackData.encode(action)
+    assert CallbackData.is_packed(data)
+    assert CallbackData.decode(data) == (action, {})
+
+
+def test_legacy_callbacks_are_not_packed():
+    assert not CallbackData.is_packed('show_debt_creditor_abc')
+    assert not CallbackData.is_packed('dm_debts')
+
+
+# ============ лимит 64 байта ============
+
+@pytest.mark.parametrize('action, fields', [
+    ('show_debt_creditor', {'debt_id': FIRESTORE_ID}),
+    ('history_newer', {'cursor': (2 ** 63 - 1, FIRESTORE_ID)}),
+])
+def test_real_buttons_fit_limit(action, fields):
+    data = CallbackData.encode(action, chat_id=-(2 ** 52), **fields)
+    assert len(data) <= MAX_LENGTH
+
+
+def test_too_long_callback_raises():
+    with pytest.raises(ValueError, match='too long'):
+        CallbackData.encode('show_debt', chat_id=-1, debt_id='x' * 50)
+
+
+def test_unknown_action_cannot_be_encoded():
+    with pytest.raises(KeyError):
+        CallbackData.encode('no_such_action')
+
+
+# ============ повреждённые данные ============
+
+HEADER = VERSION << 4
+
+
+@pytest.mark.parametrize('raw, message', [
+    (b'', 'too short'),
+    (bytes([HEADER]), 'too short'),
+    (bytes([(VERSION + 1) << 4, 0]), 'Unsupported callback version'),
+    (bytes([0, 0]), 'Unsupported callback version'),
+    (bytes([HEADER, len(ACTIONS)]), 'Unknown callback action'),
+    (bytes([HEADER, 255]), 'Unknown callback action'),
+    # chat_id обрезан посреди varint
+    (bytes([HEADER | 0x1, 9, 0x80, 0x80]), 'Truncated varint'),
+    (bytes([HEADER | 0x1, 9]), 'Truncated varint'),
+    # Курсор: нет длины ссылки, ссылка короче заявленной, base62 не той длины
+    (bytes([HEADER | 0x8, 10, 5]), 'Truncated varint'),
+    (bytes([HEADER | 0x8, 10, 5, 8 << 1, 1, 2]), 'Truncated cursor'),
+    (bytes([HEADER | 0x8, 10, 5, (3 << 1) | 1, 1, 2, 3]), 'Bad cursor reference'),
+    # base62 долга короче 15 байт или длиннее
+    (bytes([HEADER | 0x2 | 0x4, 5]) + bytes(14), 'Bad debt reference'),
+    (bytes([HEADER | 0x2 | 0x4, 5]) + bytes(16), 'Bad debt reference'),
+    # 15 байт, но число не помещается в 20 символов base62
+    (bytes([HEADER | 0x2 | 0x4, 5]) + b'\xff' * 15, 'Bad base62 reference'),
+])
+def test_decode_rejects_corrupt_payload(raw, message):
+    with pytest.raises(ValueError, match=message):
+        CallbackData.decode(pack(raw))
+
+
+def test_decode_rejects_bad_base64():
+    with pytest.raises(ValueError):
+        CallbackData.decode(MARKER + 'A')
+
+
+def test_decode_rejects_truncated_payload():
+    data = CallbackData.encode('show_debt_creditor', chat_id=-1001234567890, debt_id=FIRESTORE_ID)
+    with pytest.raises(ValueError):
+        CallbackData.decode(data[:-4])
+
+
+def test_decode_rejects_bad_utf8_reference():
+    with pytest.raises(ValueError):
+        CallbackData.decode(pack(bytes([HEADER | 0x2, 5]) + b'\xff\xfe'))
@@ -0,0 +1,135 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from callback_data import CallbackData
+from router import CallbackRouter
+
+FIRESTORE_ID = 'aZ09bY18cX27dW36eV45'
+
+
+async def show_debt(update, context, **kwargs):
+    return 'show_debt', kwargs
+
+
+async def show_debt_creditor(update, context, **kwargs):
+    return 'show_debt_creditor', kwargs
+
+
+async def switch_trip(update, context, **kwargs):
+    return 'switch_trip', kwargs
+
+
+async def dm_back(update, context, **kwargs):
+    return 'dm_back', kwargs
+
+
+def make_router(reverse=False):
+    routes = [
+        ('show_debt_', show_debt, {'debt_id': str}),
+        ('show_debt_creditor_', show_debt_creditor, {'debt_id': str}),
+        ('switch_trip_', switch_trip, {'chat_id': int}),
+        ('split_', switch_trip, {'chat_id': int, 'amount': float}),
+    ]
+    router = CallbackRouter()
+    router.add_exact({'dm_back': dm_back, 'show_debt_list': dm_back})
+    for prefix, handler, arg_types in reversed(routes) if reverse else routes:
+        router.add_prefix(prefix, handler, **arg_types)
+    router.add_action('show_debt', show_debt, 'chat_id', 'debt_id')
+    router.add_action('history_older', show_debt, 'chat_id', 'cursor')
+    return router
+
+
+def resolve(router, data):
+    route, kwargs = router.resolve(data)
+    return (route.handler if route else None), kwargs
+
+
+# ============ строковые callback'и ============
+
+@pytest.mark.parametrize('reverse', [False, True])
+@pytest.mark.parametrize('data, handler, kwargs', [
+    ('show_debt_abc', show_debt, {'debt_id': 'abc'}),
+    ('show_debt_creditor_abc', show_debt_creditor, {'debt_id': 'abc'}),
+    # Незаконченный длинный префикс — побеждает самый длинный совпавший
+    ('show_debt_credito', show_debt, {'debt_id': 'credito'}),
+    ('show_debt_creditor_', show_debt_creditor, {'debt_id': ''}),
+])
+def test_longest_prefix_wins_regardless_of_order(reverse, data, handler, kwargs):
+    assert resolve(make_router(reverse), data) == (handler, kwargs)
+
+
+def test_exact_key_beats_prefix():
+    assert resolve(make_router(), 'show_debt_list') == (dm_back, {})
+    assert resolve(make_router(), 'dm_back') == (dm_back, {})
+
+
+@pytest.mark.parametrize('data, kwargs', [
+    ('switch_trip_-1001234567890', {'chat_id': -1001234567890}),
+    ('switch_trip_42', {'chat_id': 42}),
+])
+def test_legacy_callback_args_are_parsed(data, kwargs):
+    assert resolve(make_router(), data) == (switch_trip, kwargs)
+
+
+def test_several_args_split_on_underscore():
+    assert resolve(make_router(), 'split_-100_12.5') == (switch_trip, {'chat_id': -100, 'amount': 12.5})
+
+
+@pytest.mark.parametrize('data', ['split_-100', 'switch_trip_abc', 'switch_trip_'])
+def test_bad_legacy_args_raise(data):
+    with pytest.raises(ValueError):
+        make_router().resolve(data)
+
+
+@pytest.mark.parametrize('data', ['', 'unknown', 'show_deb', 'dm_back_', 'xshow_debt_1'])
+def test_unknown_callback_is_not_routed(data):
+    assert make_router().resolve(data) == (None, None)
+
+
+# ============ упакованные кнопки ============
+
+def test_packed_action_gets_only_registered_fields():
+    data = CallbackData.encode('show_debt', chat_id=-100, debt_id=FIRESTORE_ID)
+    assert resolve(make_router(), data) == (show_debt, {'chat_id': -100, 'debt_id': FIRESTORE_ID})
+
+    data = CallbackData.encode('history_older', chat_id=-100, debt_id=FIRESTORE_ID, cursor=(5, 'x'))
+    assert resolve(make_router(), data) == (show_debt, {'chat_id': -100, 'cursor': (5, 'x')})
+
+
+def test_packed_action_without_optional_field():
+    data = CallbackData.encode('show_debt', chat_id=-100)
+    assert resolve(make_router(), data) == (show_debt, {'chat_id': -100})
+
+
+def test_unregistered_packed_action_is_not_routed():
+    assert make_router().resolve(CallbackData.encode('pay_debt', chat_id=-100)) == (None, None)
+
+
+# ============ dispatch ============
+
+def make_update(data):
+    answered = []
+
+    async def answer():
+        answered.append(True)
+
+    return SimpleNamespace(callback_query=SimpleNamespace(data=data, answer=answer)), answered
+
+
+@pytest.mark.parametrize('data', ['unknown', 'switch_trip_abc', '~!!'])
+def test_dispatch_answers_unknown_and_corrupt_callbacks(data):
+    router = make_router()
+    update, answered = make_update(data)
+    assert asyncio.run(router.dispatch(update, None)) is None
+    assert answered == [True]
+
+
+def test_dispatch_calls_handler_and_records_stats():
+    router = make_router()
+    update, answered = make_update('switch_trip_-100')
+    assert asyncio.run(router.dispatch(update, None)) == ('switch_trip', {'chat_id': -100})
+    assert answered == []
+    assert router.stats()['switch_trip_*']['count'] == 1
+    assert router.stats()['switch_trip_*']['errors'] == 0
@@ -0,0 +1,235 @@
+"""Контракт StorageBackend: одни и те же сценарии для SQLite и поддельного Firestore"""
+from datetime import datetime, timedelta
+
+import pytest
+
+from fake_firestore import FakeFirestore
+from storage_firestore import FirestoreBackend
+from storage_sqlite import SqliteBackend
+
+CHAT_ID = -100500
+START = datetime(2026, 1, 10, 12, 0, 0)
+
+
+@pytest.fixture(params=['sqlite', 'firestore'])
+def backend(request):
+    if request.param == 'sqlite':
+        return SqliteBackend(':memory:')
+    return FirestoreBackend(client=FakeFirestore())
+
+
+def create_trip(backend, user_ids=(1, 2, 3)):
+    backend.create_trip({
+        'chat_id': CHAT_ID,
+        'name': 'Тест',
+        'currency': 'EUR',
+        'creator_id': user_ids[0],
+        'created_at': START,
+        'participants': [],
+        'is_active': True,
+        'event_log': True
+    })
+    for i, user_id in enumerate(user_ids):
+        backend.save_participant(CHAT_ID, {
+            'user_id': user_id,
+            'username': f"user_{user_id}",
+            'first_name': f"Имя{user_id}",
+            'joined_at': START + timedelta(seconds=i + 1)
+        })
+        backend.link_user_to_trip(user_id, CHAT_ID)
+
+
+def create_debt(backend, payer_id, debtor_ids, amount, minute, currency='EUR'):
+    created_at = START + timedelta(minutes=minute)
+    share = amount / (len(debtor_ids) + 1)
+    group_data = {
+        'chat_id': CHAT_ID,
+        'total_amount': amount,
+        'currency': currency,
+        'payer_id': payer_id,
+        'all_participants': [payer_id, *debtor_ids],
+        'description': f"трата {minute}",
+        'category': '💸',
+        'created_at': created_at,
+        'is_deleted': False
+    }
+    debts = [
+        {
+            'chat_id': CHAT_ID,
+            'debtor_id': debtor_id,
+            'creditor_id': payer_id,
+            'amount': share,
+            'currency': currency,
+            'is_paid': False,
+            'is_deleted': False,
+            'created_at': created_at
+        }
+        for debtor_id in debtor_ids
+    ]
+    return backend.create_debt_group(group_data, debts)
+
+
+def amounts(pairs):
+    """{key: сумма} без нулевых пар (Firestore хранит обнулённые пары в документе баланса)"""
+    return {
+        key: round(pair['total_amount'], 6)
+        for key, pair in pairs.items() if abs(pair['total_amount']) > 1e-9
+    }
+
+
+# ============ ПОЕЗДКИ ============
+
+def test_trip_with_participants(backend):
+    create_trip(backend)
+    backend.save_participant(CHAT_ID, {'user_id': 2, 'username': 'renamed'})
+
+    trip = backend.get_trip(CHAT_ID)
+    assert trip['name'] == 'Тест'
+    assert trip['event_log'] is True
+    assert [p['user_id'] for p in trip['participants']] == [1, 2, 3]
+    assert trip['participants'][1]['username'] == 'renamed'
+    assert backend.get_trips([CHAT_ID, 42]).keys() == {CHAT_ID}
+
+
+# ============ БАЛАНСЫ ============
+
+def test_ledger_matches_aggregate(backend):
+    create_trip(backend)
+    assert amounts(backend.get_balances(CHAT_ID)) == {}
+
+    create_debt(backend, 1, [2, 3], 90, minute=1)
+    create_debt(backend, 2, [1], 50, minute=2)
+    create_debt(backend, 1, [2], 1000, minute=3, currency='THB')
+
+    stored = amounts(backend.get_balances(CHAT_ID))
+    assert stored == amounts(backend.compute_balances(CHAT_ID))
+    assert stored == {'2_1_EUR': 30, '3_1_EUR': 30, '1_2_EUR': 25, '2_1_THB': 500}
+
+
+def test_mark_debt_paid_is_idempotent(backend):
+    create_trip(backend)
+    _, debt_ids = create_debt(backend, 1, [2, 3], 90, minute=1)
+    paid_at = START + timedelta(hours=1)
+
+    first = backend.mark_debt_paid(debt_ids[0], paid_at)
+    second = backend.mark_debt_paid(debt_ids[0], paid_at + timedelta(hours=1))
+
+    assert first['is_paid'] and second['is_paid']
+    assert backend.get_debt(debt_ids[0])['paid_at'] == paid_at
+    assert amounts(backend.get_balances(CHAT_ID)) == {'3_1_EUR': 30}
+    assert amounts(backend.compute_balances(CHAT_ID)) == {'3_1_EUR': 30}
+    assert backend.mark_debt_paid('missing', paid_at) is None
+
+
+def test_delete_debt_group(backend):
+    create_trip(backend)
+    group_id, debt_ids = create_debt(backend, 1, [2, 3], 90, minute=1)
+    kept_id, _ = create_debt(backend, 2, [1], 50, minute=2)
+    backend.mark_debt_paid(debt_ids[0], START + timedelta(hours=1))
+
+    assert backend.delete_debt_group(group_id) is True
+    assert backend.delete_debt_group(group_id) is True
+    assert backend.delete_debt_group('missing') is False
+
+    assert [group['id'] for group in backend.get_debt_groups(CHAT_ID)] == [kept_id]
+    # Погашенный долг остаётся погашенным, непогашенный списан
+    assert backend.get_debt(debt_ids[0])['is_paid'] is True
+    assert backend.get_debt(debt_ids[1])['is_deleted'] is True
+    assert amounts(backend.get_balances(CHAT_ID)) == amounts(backend.compute_balances(CHAT_ID)) == {'1_2_EUR': 25}
+
+
+# ============ СТРАНИЦЫ ============
+
+def test_debt_groups_paging_cursors(backend):
+    create_trip(backend)
+    group_ids = [create_debt(backend, 1, [2], 10, minute=minute)[0] for minute in range(7)]
+    newest_first = list(reversed(group_ids))
+
+    seen, after = [], None
+    while True:
+        page = backend.get_debt_groups_page(CHAT_ID, 3, after)
+        if not page:
+            break
+        seen.extend(group['id'] for group in page)
+        after = (page[-1]['created_at'], page[-1]['id'])
+    assert seen == newest_first
+
+    # Обратно к новым от середины
+    middle = backend.get_debt_groups_page(CHAT_ID, 7)[4]
+    newer = backend.get_debt_groups_page(CHAT_ID, 2, (middle['created_at'], middle['id']), newer=True)
+    assert [group['id'] for group in newer] == [newest_first[3], newest_first[2]]
+
+
+def test_paging_breaks_timestamp_ties_by_id(backend):
+    create_trip(backend)
+    group_ids = sorted(create_debt(backend, 1, [2], 10, minute=5)[0] for _ in range(5))
+
+    first = backend.get_debt_groups_page(CHAT_ID, 2)
+    rest = backend.get_debt_groups_page(CHAT_ID, 10, (first[-1]['created_at'], first[-1]['id']))
+    assert [group['id'] for group in first + rest] == list(reversed(group_ids))
+
+
+def test_paid_debts_and_events_pages(backend):
+    create_trip(backend)
+    _, debt_ids = create_debt(backend, 1, [2, 3], 90, minute=1)
+    for i, debt_id in enumerate(debt_ids):
+        backend.mark_debt_paid(debt_id, START + timedelta(hours=i + 1))
+
+    paid = backend.get_paid_debts_page(CHAT_ID, 10)
+    assert [debt['id'] for debt in paid] == list(reversed(debt_ids))
+
+    events = backend.get_events_page(CHAT_ID, 100)
+    assert [event['type'] for event in events] == [
+        'debt_paid', 'debt_paid', 'debt_created',
+        'member_joined', 'member_joined', 'member_joined', 'trip_created'
+    ]
+    oldest = backend.get_events_page(CHAT_ID, 2, newer=True)
+    assert [event['type'] for event in oldest] == ['trip_created', 'member_joined']
+
+
+# ============ УДАЛЕНИЕ ПОЕЗДКИ ============
+
+def test_delete_trip(backend):
+    create_trip(backend)
+    backend.link_user_to_trip(1, -200)
+    create_debt(backend, 1, [2, 3], 90, minute=1)
+    create_debt(backend, 2, [1], 50, minute=2)
+
+    assert backend.delete_trip(CHAT_ID, [1, 2, 3]) == (3, 2)
+
+    assert backend.get_trip(CHAT_ID) is None
+    assert backend.get_debt_groups(CHAT_ID) == []
+    assert backend.query_debts(CHAT_ID) == []
+    assert backend.get_events_page(CHAT_ID, 10) == []
+    assert amounts(backend.get_balances(CHAT_ID) or {}) == {}
+
+    user = backend.get_user_trips(1)
+    assert user['trips'] == [-200]
+    assert user['active_trip'] == -200
+    assert backend.get_user_trips(2)['trips'] == []
+
+
+def test_link_retry_keeps_concurrent_active_trip():
+    """Повтор транзакции после конфликта не затирает active_trip, поставленный другим вызовом"""
+    client = FakeFirestore()
+    backend = FirestoreBackend(client=client)
+    transaction = client.transaction()
+    commit = transaction._commit
+    attempts = []
+
+    def conflicting_commit():
+        attempts.append(1)
+        if len(attempts) == 1:
+            # Между чтением и коммитом первой попытки другой вызов ставит активную поездку
+            client.collection('user_trips').document('1').set({'active_trip': -200, 'trips': [-200]})
+        return commit()
+
+    transaction._commit = conflicting_commit
+    client.transaction = lambda **kwargs: transaction
+
+    backend.link_user_to_trip(1, CHAT_ID)
+
+    assert len(attempts) == 2
+    user = backend.get_user_trips(1)
+    assert user['active_trip'] == -200
+    assert sorted(user['trips']) == [CHAT_ID, -200]
@@ -0,0 +1,89 @@
+import asyncio
+from datetime import datetime
+
+from telegram import Chat, Message, Update
+
+from bot import ChatSequentialUpdateProcessor
+
+BUSY_CHAT = -100
+OTHER_CHAT = -200
+
+
+def make_update(update_id, chat_id):
+    return Update(update_id, message=Message(update_id, datetime.now(), Chat(chat_id, 'group')))
+
+
+def run(coroutine):
+    return asyncio.run(asyncio.wait_for(coroutine, timeout=5))
+
+
+def test_busy_chat_does_not_block_other_chats():
+    """Очередь занятого чата больше CONCURRENT_UPDATES, а другой чат всё равно обрабатывается сразу"""
+    async def scenario():
+        processor = ChatSequentialUpdateProcessor(2)
+        release = asyncio.Event()
+        done = []
+
+        async def slow(update_id):
+            await release.wait()
+            done.append(update_id)
+
+        async def fast(update_id):
+            done.append(update_id)
+
+        busy = [
+            asyncio.create_task(processor.process_update(make_update(i, BUSY_CHAT), slow(i)))
+            for i in range(5)
+        ]
+        await asyncio.sleep(0)
+
+        await processor.process_update(make_update(99, OTHER_CHAT), fast(99))
+        assert done == [99]
+
+        release.set()
+        await asyncio.gather(*busy)
+        return done
+
+    assert run(scenario()) == [99, 0, 1, 2, 3, 4]
+
+
+def test_updates_of_one_chat_run_in_order():
+    async def scenario():
+        processor = ChatSequentialUpdateProcessor(8)
+        running = []
+        order = []
+
+        async def handle(update_id):
+            running.append(update_id)
+            assert len(running) == 1
+            await asyncio.sleep(0.01 * (3 - update_id))
+            running.remove(update_id)
+            order.append(update_id)
+
+        await asyncio.gather(*(
+            processor.process_update(make_update(i, BUSY_CHAT), handle(i)) for i in range(3)
+        ))
+        return order
+
+    assert run(scenario()) == [0, 1, 2]
+
+
+def test_failing_update_does_not_stop_chat_queue():
+    async def scenario():
+        processor = ChatSequentialUpdateProcessor(2)
+        done = []
+
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise RuntimeError('boom')
+
+        async def handle(update_id):
+            done.append(update_id)
+
+        await asyncio.gather(
+            processor.process_update(make_update(1, BUSY_CHAT), fail()),
+            processor.process_update(make_update(2, BUSY_CHAT), handle(2)),
+        )
+        return done
+
+    assert run(scenario()) == [2]
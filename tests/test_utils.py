@@ -0,0 +1,106 @@
+import pytest
+
+from utils import Utils
+
+PARTICIPANTS = [
+    {'user_id': 1, 'username': 'anna_k', 'first_name': 'Анна'},
+    {'user_id': 2, 'username': '', 'first_name': 'Борис'},
+    {'user_id': 3, 'username': 'Vova', 'first_name': 'Владимир'},
+]
+
+
+# ============ parse_currency_from_text ============
+
+@pytest.mark.parametrize('text, expected', [
+    ('2000 @user такси', (2000.0, None, '@user такси')),
+    ('2000.50 THB @user такси', (2000.5, 'THB', '@user такси')),
+    ('12,5 @user кофе', (12.5, None, '@user кофе')),
+    ('1 500,5 rub кофе', (1500.5, 'RUB', 'кофе')),
+    ('1 234 567 @a', (1234567.0, None, '@a')),
+    ('  10 eur', (10.0, 'EUR', '')),
+    ('300 2 пиццы @a', (300.0, None, '2 пиццы @a')),
+    ('500 abc @a', (500.0, None, 'abc @a')),
+])
+def test_parse_amount_and_currency(text, expected):
+    assert Utils.parse_currency_from_text(text) == expected
+
+
+@pytest.mark.parametrize('text', ['', 'такси 200', '0 @a', '12.5.3 @a', '1,2,3 @a', None])
+def test_parse_amount_rejects_invalid(text):
+    amount, currency, _ = Utils.parse_currency_from_text(text)
+    assert amount is None and currency is None
+
+
+def test_unknown_currency_code_stays_in_description():
+    assert Utils.parse_currency_from_text('100 XYZ @a') == (100.0, None, 'XYZ @a')
+
+
+# ============ parse_participants_from_text ============
+
+def test_mentions_by_username_and_first_name():
+    text = '@ANNA_K @борис @vova ужин'
+    assert Utils.parse_participants_from_text(text, PARTICIPANTS) == [1, 2, 3]
+
+
+def test_mentions_keep_order_and_skip_duplicates_and_unknown():
+    text = '@vova @nobody @anna_k @Vova'
+    assert Utils.parse_participants_from_text(text, PARTICIPANTS) == [3, 1]
+
+
+def test_no_mentions():
+    assert Utils.parse_participants_from_text('200 такси', PARTICIPANTS) == []
+
+
+# ============ ФОРМАТИРОВАНИЕ ============
+
+@pytest.mark.parametrize('amount, expected', [
+    (2000, '2 000 EUR'),
+    (12.5, '12.50 EUR'),
+    (1234567.891, '1 234 567.89 EUR'),
+    (99.999, '100 EUR'),
+])
+def test_format_amount(amount, expected):
+    assert Utils.format_amount(amount, 'EUR') == expected
+
+
+def test_escape_markdown():
+    assert Utils.escape_markdown('a_b*c`d[e]') == 'a\\_b\\*c\\`d\\[e]'
+
+
+def test_participant_name_fallbacks():
+    index = Utils.participants_index(PARTICIPANTS)
+    assert Utils.get_participant_name(1, PARTICIPANTS) == '@anna_k'
+    assert Utils.get_participant_name(2, index) == 'Борис'
+    assert Utils.get_participant_name(42, index) == 'ID 42'
+
+
+def test_summary_groups_by_currency_and_escapes_names():
+    trip = {'name': 'Sea_trip'}
+    summary = [
+        {'debtor_id': 2, 'creditor_id': 1, 'currency': 'USD', 'total_amount': 5},
+        {'debtor_id': 3, 'creditor_id': 1, 'currency': 'EUR', 'total_amount': 10},
+        {'debtor_id': 2, 'creditor_id': 1, 'currency': 'EUR', 'total_amount': 20.5},
+    ]
+    text = Utils.format_summary(trip, summary, PARTICIPANTS)
+
+    assert 'Sea\\_trip' in text
+    assert text.index('*EUR*') < text.index('*USD*')
+    # Внутри валюты — по убыванию суммы
+    assert text.index('20.50 EUR') < text.index('10 EUR')
+    assert '@anna\\_k' in text
+
+
+def test_empty_summary():
+    assert 'Пока долгов нет' in Utils.format_summary({'name': 'T'}, [], PARTICIPANTS)
+
+
+def test_debts_list_totals_per_currency():
+    debts = [
+        {'creditor_id': 1, 'amount': 10, 'currency': 'EUR', 'group_info': {'description': 'ужин_1'}},
+        {'creditor_id': 3, 'amount': 2.5, 'currency': 'EUR', 'group_info': {'description': 'кофе'}},
+        {'creditor_id': 1, 'amount': 300, 'group_info': {'description': 'такси', 'currency': 'THB'}},
+    ]
+    text = Utils.format_my_debts(debts, PARTICIPANTS)
+
+    assert '*Итого:* 12.50 EUR, 300 THB' in text
+    assert 'ужин\\_1' in text